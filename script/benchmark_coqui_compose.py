@@ -0,0 +1,103 @@
+"""Compare static and lazy composition of Coqui STT graphs.
+
+Trains a Coqui STT model with the test fixtures both ways and transcribes the
+test WAV files. Requires downloaded models and tools.
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List
+
+from speech_to_phrase.const import Settings
+from speech_to_phrase.models import MODELS, ModelType
+from speech_to_phrase.train import train
+
+from .benchmark_util import get_wav_paths, load_things, make_settings, transcribe_wavs
+
+_STATIC_GRAPH_FILES = ["token2sen.fst"]
+_LAZY_GRAPH_FILES = ["token2char.fst", "char2word.fst", "word2sen.fst"]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("language", help="Language of Coqui STT model")
+    parser.add_argument("--models-dir", required=True)
+    parser.add_argument("--tools-dir", required=True)
+    args = parser.parse_args()
+
+    model = MODELS[args.language]
+    if model.type != ModelType.COQUI_STT:
+        print(f"Not a Coqui STT model: {model.id}", file=sys.stderr)
+        return 1
+
+    things = load_things(args.language)
+    wav_paths = get_wav_paths(args.language)
+
+    print(
+        "mode",
+        "build_seconds",
+        "graph_mb",
+        "load_seconds",
+        "median_decode_seconds",
+        "max_decode_seconds",
+        "correct",
+        "total",
+        sep="\t",
+    )
+    for lazy_compose in (False, True):
+        with tempfile.TemporaryDirectory() as temp_dir_str:
+            settings = make_settings(
+                args.models_dir,
+                temp_dir_str,
+                args.tools_dir,
+                coqui_lazy_compose=lazy_compose,
+            )
+
+            start_time = time.perf_counter()
+            asyncio.run(train(model, settings, things, force_retrain=True))
+            build_seconds = time.perf_counter() - start_time
+
+            train_dir = settings.model_train_dir(model.id)
+            graph_paths = [
+                train_dir / file_name
+                for file_name in (
+                    _LAZY_GRAPH_FILES if lazy_compose else _STATIC_GRAPH_FILES
+                )
+            ]
+            graph_bytes = sum(p.stat().st_size for p in graph_paths)
+            load_seconds = asyncio.run(_time_load(settings, graph_paths))
+
+            decode_seconds, num_correct = asyncio.run(
+                transcribe_wavs(model, settings, wav_paths)
+            )
+            print(
+                "lazy" if lazy_compose else "static",
+                f"{build_seconds:.2f}",
+                f"{graph_bytes / (1024 * 1024):.1f}",
+                f"{load_seconds:.3f}",
+                f"{statistics.median(decode_seconds):.3f}",
+                f"{max(decode_seconds):.3f}",
+                num_correct,
+                len(wav_paths),
+                sep="\t",
+            )
+
+    return 0
+
+
+async def _time_load(settings: Settings, graph_paths: List[Path]) -> float:
+    """Time reading graphs from disk with fstinfo."""
+    start_time = time.perf_counter()
+    for graph_path in graph_paths:
+        await settings.tools.async_run("fstinfo", ["--info_type=fast", str(graph_path)])
+
+    return time.perf_counter() - start_time
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""Benchmark grammar FST construction on the bundled languages."""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+from hassil import Intents
+
+from speech_to_phrase.const import WordCasing
+from speech_to_phrase.g2p import LexiconDatabase
+from speech_to_phrase.hass_api import Things
+from speech_to_phrase.hassil_fst import Fst, G2PInfo, intents_to_fst
+from speech_to_phrase.lang_sentences import LanguageData, load_shared_lists
+from speech_to_phrase.models import MODELS
+from speech_to_phrase.util import yaml
+
+_DIR = Path(__file__).parent
+_REPO_DIR = _DIR.parent
+_STP_DIR = _REPO_DIR / "speech_to_phrase"
+_SENTENCES_DIR = _STP_DIR / "sentences"
+_SHARED_LISTS_PATH = _STP_DIR / "shared_lists.yaml"
+_FIXTURES_DIR = _REPO_DIR / "tests" / "fixtures"
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "language", nargs="*", help="Languages to benchmark (default: all)"
+    )
+    parser.add_argument(
+        "--entities",
+        type=int,
+        default=0,
+        help="Number of extra generated entity names per domain in the fixtures",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Number of times to repeat each step"
+    )
+    args = parser.parse_args()
+
+    languages = args.language or sorted(
+        p.stem for p in _FIXTURES_DIR.glob("*.yaml") if p.stem in MODELS
+    )
+
+    print(
+        "language",
+        "intents_to_fst",
+        "remove_spaces",
+        "prune",
+        "states",
+        "arcs",
+        sep="\t",
+    )
+    for language in languages:
+        intents = _load_intents(language, args.entities)
+        model = MODELS[language]
+        g2p_info = G2PInfo(LexiconDatabase(), WordCasing.get_function(model.casing))
+
+        build_times = []
+        remove_spaces_times = []
+        prune_times = []
+        fst = Fst()
+        for _ in range(args.repeat):
+            start_time = time.perf_counter()
+            fst_with_spaces = intents_to_fst(
+                intents, number_language=model.number_language, g2p_info=g2p_info
+            )
+            build_times.append(time.perf_counter() - start_time)
+
+            start_time = time.perf_counter()
+            fst = fst_with_spaces.remove_spaces()
+            remove_spaces_times.append(time.perf_counter() - start_time)
+
+            start_time = time.perf_counter()
+            fst.prune()
+            prune_times.append(time.perf_counter() - start_time)
+
+        print(
+            language,
+            f"{min(build_times):.3f}",
+            f"{min(remove_spaces_times):.3f}",
+            f"{min(prune_times):.3f}",
+            len(fst.states),
+            sum(len(arcs) for arcs in fst.arcs.values()),
+            sep="\t",
+        )
+
+    return 0
+
+
+def _load_intents(language: str, extra_entities: int) -> Intents:
+    """Load bundled sentences with test fixtures as lists."""
+    model = MODELS[language]
+    with open(
+        _SENTENCES_DIR / f"{model.sentences_language}.yaml", "r", encoding="utf-8"
+    ) as sentences_file:
+        lang_data = LanguageData.from_dict(yaml.load(sentences_file))
+        sentences_dict = lang_data.to_intents_dict()
+
+    with open(
+        _FIXTURES_DIR / f"{language}.yaml", "r", encoding="utf-8"
+    ) as fixtures_file:
+        things_dict = yaml.load(fixtures_file)["fixtures"]
+
+    if extra_entities > 0:
+        domains = {e["domain"] for e in things_dict.get("entities", [])}
+        things_dict.setdefault("entities", []).extend(
+            {"name": f"{domain} {entity_idx}", "domain": domain}
+            for domain in sorted(domains)
+            for entity_idx in range(extra_entities)
+        )
+
+    lists_dict = sentences_dict.get("lists", {})
+    lists_dict.update(Things.from_dict(things_dict).to_lists_dict())
+
+    with open(_SHARED_LISTS_PATH, "r", encoding="utf-8") as shared_lists_file:
+        lists_dict.update(load_shared_lists(yaml.load(shared_lists_file)))
+
+    sentences_dict["lists"] = lists_dict
+    for list_info in lists_dict.values():
+        if "values" in list_info:
+            list_info.pop("wildcard", None)
+
+    intents = Intents.from_dict(sentences_dict)
+    lang_data.add_transformed_slot_lists(intents.slot_lists)
+
+    return intents
+
+
+if __name__ == "__main__":
+    sys.exit(main())
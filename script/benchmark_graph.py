@@ -0,0 +1,148 @@
+"""Compare static HCLG.fst with lookahead (HCLr.fst + Gr.fst) decoding.
+
+Requires a model that has already been trained, and Kaldi tools with the
+lookahead decoder. The trained model directory is copied so it isn't changed.
+
+Audio is streamed to the decoders in real time, like during transcription.
+Latency is the time from the end of the audio until the decoder exits.
+"""
+
+import argparse
+import asyncio
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+from pathlib import Path
+from typing import List, Tuple
+
+from speech_to_phrase.speech_tools import SpeechTools
+from speech_to_phrase.train_kaldi import build_decoding_graph
+from speech_to_phrase.transcribe_kaldi import get_decode_command, get_wav_stream_header
+
+_GRAPH_FILES = {False: ["HCLG.fst"], True: ["HCLr.fst", "Gr.fst"]}
+_CHUNK_SAMPLES = 1024
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("model", help="Id of trained model")
+    parser.add_argument("wav", nargs="+", help="16Khz 16-bit mono WAV files")
+    parser.add_argument("--models-dir", required=True)
+    parser.add_argument("--train-dir", required=True)
+    parser.add_argument("--tools-dir", required=True)
+    args = parser.parse_args()
+
+    model_dir = Path(args.models_dir).absolute() / args.model
+    tools = SpeechTools.from_tools_dir(args.tools_dir)
+    model_file = model_dir / "model" / "model" / "final.mdl"
+    online_conf = model_dir / "model" / "online" / "conf" / "online.conf"
+
+    print(
+        "mode",
+        "build_seconds",
+        "graph_mb",
+        "median_latency_seconds",
+        "max_latency_seconds",
+        "max_rss_mb",
+        sep="\t",
+    )
+    with tempfile.TemporaryDirectory() as temp_dir_str:
+        train_dir = Path(temp_dir_str) / args.model
+        shutil.copytree(
+            Path(args.train_dir).absolute() / args.model, train_dir, symlinks=True
+        )
+        graph_dir = train_dir / "graph"
+        lattice_path = str(Path(temp_dir_str) / "lattice.ark")
+
+        for lookahead in (False, True):
+            start_time = time.perf_counter()
+            asyncio.run(
+                build_decoding_graph(
+                    model_dir / "model", train_dir, tools, lookahead=lookahead
+                )
+            )
+            build_seconds = time.perf_counter() - start_time
+            graph_bytes = sum(
+                (graph_dir / file_name).stat().st_size
+                for file_name in _GRAPH_FILES[lookahead]
+            )
+
+            latency_seconds: List[float] = []
+            max_rss_kb = 0
+            for wav_path in args.wav:
+                seconds, rss_kb = _decode(
+                    get_decode_command(
+                        model_file,
+                        online_conf,
+                        graph_dir,
+                        lattice_path,
+                        lookahead=lookahead,
+                    ),
+                    tools,
+                    wav_path,
+                    lookahead,
+                )
+                latency_seconds.append(seconds)
+                max_rss_kb = max(max_rss_kb, rss_kb)
+
+            print(
+                "lookahead" if lookahead else "static",
+                f"{build_seconds:.2f}",
+                f"{graph_bytes / (1024 * 1024):.1f}",
+                f"{statistics.median(latency_seconds):.3f}",
+                f"{max(latency_seconds):.3f}",
+                f"{max_rss_kb / 1024:.1f}",
+                sep="\t",
+            )
+
+    return 0
+
+
+def _decode(
+    command: List[str], tools: SpeechTools, wav_path: str, lookahead: bool
+) -> Tuple[float, int]:
+    """Stream WAV to decoder and return (latency seconds, max RSS in KB)."""
+    with wave.open(wav_path, "rb") as wav_file:
+        rate = wav_file.getframerate()
+        bytes_per_sample = wav_file.getsampwidth() * wav_file.getnchannels()
+        audio_bytes = wav_file.readframes(wav_file.getnframes())
+
+    proc = subprocess.Popen(  # pylint: disable=consider-using-with
+        command,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        env=tools.extended_env,
+    )
+    assert proc.stdin is not None
+    if lookahead:
+        # Lookahead decoder reads a WAV stream instead of raw audio
+        proc.stdin.write(get_wav_stream_header())
+
+    chunk_bytes = _CHUNK_SAMPLES * bytes_per_sample
+    for offset in range(0, len(audio_bytes), chunk_bytes):
+        proc.stdin.write(audio_bytes[offset : offset + chunk_bytes])
+        proc.stdin.flush()
+        time.sleep(_CHUNK_SAMPLES / rate)
+
+    start_time = time.perf_counter()
+    proc.stdin.close()
+
+    # Get resource usage for only this process
+    _pid, status, rusage = os.wait4(proc.pid, 0)
+    seconds = time.perf_counter() - start_time
+    proc.returncode = status
+
+    if status != 0:
+        raise RuntimeError(f"Decoding failed: {command}")
+
+    return seconds, rusage.ru_maxrss
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+"""Measure event loop lag while grammars are compiled for training.
+
+Compares compiling on the event loop (as training used to) with compiling in a
+worker process. Requires a downloaded model for its lexicon.
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import tempfile
+import time
+from typing import Awaitable, Callable, List, Tuple
+
+from speech_to_phrase.models import MODELS
+from speech_to_phrase.train import compile_grammar
+from speech_to_phrase.worker_pool import WorkerPool
+
+from .benchmark_util import load_things, make_settings
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("language", help="Language of model")
+    parser.add_argument("--models-dir", required=True)
+    parser.add_argument(
+        "--entities",
+        type=int,
+        default=0,
+        help="Number of extra generated entity names per domain in the fixtures",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=10,
+        help="Milliseconds between event loop ticks",
+    )
+    args = parser.parse_args()
+
+    model = MODELS[args.language]
+    things = load_things(args.language, extra_entities=args.entities)
+
+    print("mode", "seconds", "ticks", "median_lag_ms", "max_lag_ms", sep="\t")
+    worker_pool = WorkerPool()
+    with tempfile.TemporaryDirectory() as temp_dir_str:
+        settings = make_settings(
+            args.models_dir, temp_dir_str, temp_dir_str, custom_sentences_dirs=[]
+        )
+        settings.model_train_dir(model.id).mkdir(parents=True)
+
+        async def compile_inline() -> None:
+            compile_grammar(model, settings, things)
+
+        async def compile_in_process() -> None:
+            await worker_pool.run(compile_grammar, model, settings, things)
+
+        for mode, compile_func in (
+            ("inline", compile_inline),
+            ("process", compile_in_process),
+        ):
+            seconds, lags = asyncio.run(
+                _measure_lag(compile_func, args.interval / 1000)
+            )
+            print(
+                mode,
+                f"{seconds:.2f}",
+                len(lags),
+                f"{statistics.median(lags) * 1000:.1f}",
+                f"{max(lags) * 1000:.1f}",
+                sep="\t",
+            )
+
+    worker_pool.shutdown()
+
+    return 0
+
+
+async def _measure_lag(
+    compile_func: Callable[[], Awaitable[None]], interval: float
+) -> Tuple[float, List[float]]:
+    """Run compile_func while measuring how late periodic ticks are."""
+    lags: List[float] = [0.0]
+    done = asyncio.Event()
+
+    async def tick() -> None:
+        while not done.is_set():
+            start_time = time.perf_counter()
+            await asyncio.sleep(interval)
+            lags.append(time.perf_counter() - start_time - interval)
+
+    tick_task = asyncio.create_task(tick())
+
+    # Let the ticker start
+    await asyncio.sleep(0)
+
+    start_time = time.perf_counter()
+    await compile_func()
+    seconds = time.perf_counter() - start_time
+
+    done.set()
+    await tick_task
+
+    return seconds, lags
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""Compare graph size, build time, and accuracy for different n-gram orders.
+
+Trains a Kaldi model with the test fixtures for each order and transcribes the
+test WAV files. Requires downloaded models and tools.
+"""
+
+import argparse
+import asyncio
+import sys
+import tempfile
+import time
+from typing import Optional
+
+from speech_to_phrase.const import Settings
+from speech_to_phrase.models import MODELS
+from speech_to_phrase.train import train
+
+from .benchmark_util import get_wav_paths, load_things, make_settings, transcribe_wavs
+
+_GRAPH_FILES = ["HCLG.fst", "HCLr.fst", "Gr.fst"]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("language", help="Language of model")
+    parser.add_argument("--models-dir", required=True)
+    parser.add_argument("--tools-dir", required=True)
+    parser.add_argument(
+        "--order", type=int, nargs="+", default=[1, 2, 3, 4], help="N-gram orders"
+    )
+    parser.add_argument(
+        "--prune-theta", type=float, help="Threshold for relative entropy pruning"
+    )
+    args = parser.parse_args()
+
+    model = MODELS[args.language]
+    things = load_things(args.language)
+    wav_paths = get_wav_paths(args.language, include_oov=False)
+
+    print(
+        "order",
+        "build_seconds",
+        "g_mb",
+        "graph_mb",
+        "correct",
+        "total",
+        sep="\t",
+    )
+    with tempfile.TemporaryDirectory() as temp_dir_str:
+        # Train once so HCL.fst etc. aren't included in build times
+        asyncio.run(
+            train(
+                model,
+                _make_settings(args, temp_dir_str, args.order[0]),
+                things,
+                force_retrain=True,
+            )
+        )
+
+        for order in args.order:
+            settings = _make_settings(args, temp_dir_str, order)
+            start_time = time.perf_counter()
+            asyncio.run(train(model, settings, things, force_retrain=True))
+            build_seconds = time.perf_counter() - start_time
+
+            train_dir = settings.model_train_dir(model.id)
+            g_bytes = (train_dir / "data" / "lang" / "G.fst").stat().st_size
+            graph_bytes = sum(
+                (train_dir / "graph" / file_name).stat().st_size
+                for file_name in _GRAPH_FILES
+                if (train_dir / "graph" / file_name).is_file()
+            )
+
+            _transcribe_seconds, num_correct = asyncio.run(
+                transcribe_wavs(model, settings, wav_paths)
+            )
+            print(
+                order,
+                f"{build_seconds:.2f}",
+                f"{g_bytes / (1024 * 1024):.1f}",
+                f"{graph_bytes / (1024 * 1024):.1f}",
+                num_correct,
+                len(wav_paths),
+                sep="\t",
+            )
+
+    return 0
+
+
+def _make_settings(
+    args: argparse.Namespace, train_dir: str, order: Optional[int]
+) -> Settings:
+    return make_settings(
+        args.models_dir,
+        train_dir,
+        args.tools_dir,
+        ngram_order=order,
+        ngram_prune_theta=args.prune_theta,
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
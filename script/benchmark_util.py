@@ -0,0 +1,88 @@
+"""Shared helpers for benchmark scripts.
+
+Run benchmarks from the repository root as modules, e.g.:
+python3 -m script.benchmark_ngram_order en --models-dir ... --tools-dir ...
+"""
+
+import time
+from pathlib import Path
+from typing import Any, List, Tuple, Union
+
+from pysilero_vad import SileroVoiceActivityDetector
+
+from speech_to_phrase.audio import wav_audio_stream
+from speech_to_phrase.const import Settings
+from speech_to_phrase.hass_api import Things
+from speech_to_phrase.models import Model
+from speech_to_phrase.transcribe import transcribe
+from speech_to_phrase.util import yaml
+
+_DIR = Path(__file__).parent
+TESTS_DIR = _DIR.parent / "tests"
+
+
+def make_settings(
+    models_dir: Union[str, Path],
+    train_dir: Union[str, Path],
+    tools_dir: Union[str, Path],
+    **kwargs: Any,
+) -> Settings:
+    """Create settings without Home Assistant that use the test sentences."""
+    kwargs.setdefault("custom_sentences_dirs", [TESTS_DIR / "custom_sentences"])
+    return Settings(
+        models_dir=models_dir,
+        train_dir=train_dir,
+        tools_dir=tools_dir,
+        hass_token="",
+        hass_websocket_uri="",
+        retrain_on_connect=False,
+        **kwargs,
+    )
+
+
+def load_things(language: str, extra_entities: int = 0) -> Things:
+    """Load things from test fixtures.
+
+    If extra_entities > 0, that many generated entity names are added for each
+    domain.
+    """
+    with open(
+        TESTS_DIR / "fixtures" / f"{language}.yaml", "r", encoding="utf-8"
+    ) as fixtures_file:
+        things_dict = yaml.load(fixtures_file)["fixtures"]
+
+    if extra_entities > 0:
+        domains = {e["domain"] for e in things_dict.get("entities", [])}
+        things_dict.setdefault("entities", []).extend(
+            {"name": f"{domain} {entity_idx}", "domain": domain}
+            for domain in sorted(domains)
+            for entity_idx in range(extra_entities)
+        )
+
+    return Things.from_dict(things_dict)
+
+
+def get_wav_paths(language: str, include_oov: bool = True) -> List[Path]:
+    """Get test WAV files whose names are their expected transcripts."""
+    return sorted(
+        p
+        for p in (TESTS_DIR / "wav" / language).glob("*.wav")
+        if include_oov or (not p.name.startswith("oov_"))
+    )
+
+
+async def transcribe_wavs(
+    model: Model, settings: Settings, wav_paths: List[Path]
+) -> Tuple[List[float], int]:
+    """Transcribe each WAV and return (seconds per WAV, exact matches)."""
+    vad = SileroVoiceActivityDetector()
+    transcribe_seconds: List[float] = []
+    num_correct = 0
+    for wav_path in wav_paths:
+        start_time = time.perf_counter()
+        text = await transcribe(model, settings, wav_audio_stream(wav_path, vad))
+        transcribe_seconds.append(time.perf_counter() - start_time)
+        if text == wav_path.stem:
+            num_correct += 1
+
+    return transcribe_seconds, num_correct
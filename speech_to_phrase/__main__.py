@@ -5,16 +5,14 @@ import asyncio
 import logging
 from functools import partial
 from pathlib import Path
-from typing import Optional
+from typing import List
 
 from wyoming.server import AsyncServer
 
 from . import __version__
 from .const import Settings, State
 from .event_handler import SpeechToPhraseEventHandler
-from .hass_api import HomeAssistantInfo, get_hass_info
-from .models import DEFAULT_MODEL, Model, get_models_for_languages
-from .train import train
+from .retrain import RetrainCoordinator
 
 _LOGGER = logging.getLogger()
 
@@ -62,6 +60,77 @@ async def main() -> None:
         action="store_true",
         help="Automatically retrain on every client connection",
     )
+    parser.add_argument(
+        "--retrain-on-change",
+        action="store_true",
+        help="Automatically retrain when Home Assistant or custom sentences change",
+    )
+    parser.add_argument(
+        "--retrain-debounce-seconds",
+        type=float,
+        default=5.0,
+        help="Seconds without changes to wait before retraining",
+    )
+    parser.add_argument(
+        "--lookahead-min-arcs",
+        type=int,
+        help=(
+            "Compose the grammar during decoding instead of building HCLG.fst "
+            "when it has at least this many arcs. Decoding only finishes "
+            "after the audio ends, so measure latency with "
+            "script/benchmark_graph.py first "
+            "(requires online2-wav-nnet3-latgen-faster-lookahead)"
+        ),
+    )
+    parser.add_argument(
+        "--train-workers",
+        type=int,
+        default=1,
+        help="Maximum number of models to train at the same time",
+    )
+    parser.add_argument(
+        "--train-niceness",
+        type=int,
+        default=10,
+        help="Niceness added to training processes (0 to disable)",
+    )
+    parser.add_argument(
+        "--train-max-defer-seconds",
+        type=float,
+        default=10.0,
+        help="Seconds to wait for active transcriptions before starting training",
+    )
+    parser.add_argument(
+        "--ngram-order",
+        type=int,
+        help="Order of the n-gram language model (overrides model default)",
+    )
+    parser.add_argument(
+        "--ngram-prune-theta",
+        type=float,
+        help="Threshold for relative entropy pruning of the n-gram model",
+    )
+    parser.add_argument(
+        "--ngram-max-arcs",
+        type=int,
+        help=(
+            "Automatically use the largest n-gram order (up to --ngram-order or 5) "
+            "whose model has at most this many arcs"
+        ),
+    )
+    parser.add_argument(
+        "--write-arpa",
+        action="store_true",
+        help="Also write the n-gram language model as ARPA text (for debugging)",
+    )
+    parser.add_argument(
+        "--coqui-lazy-compose",
+        action="store_true",
+        help=(
+            "Compose Coqui STT graphs during transcription instead of "
+            "building token2sen.fst"
+        ),
+    )
     # Audio
     parser.add_argument("--volume-multiplier", type=float, default=1.0)
     #
@@ -89,16 +158,36 @@ async def main() -> None:
             hass_websocket_uri=args.hass_websocket_uri,
             retrain_on_connect=args.retrain_on_connect,
             volume_multiplier=args.volume_multiplier,
+            lookahead_min_arcs=args.lookahead_min_arcs,
+            train_workers=args.train_workers,
+            train_niceness=args.train_niceness,
+            train_max_defer_seconds=args.train_max_defer_seconds,
+            write_arpa=args.write_arpa,
+            ngram_order=args.ngram_order,
+            ngram_prune_theta=args.ngram_prune_theta,
+            ngram_max_arcs=args.ngram_max_arcs,
+            coqui_lazy_compose=args.coqui_lazy_compose,
         )
     )
 
+    coordinator = RetrainCoordinator(
+        state, debounce_seconds=args.retrain_debounce_seconds
+    )
     if args.retrain_on_start:
-        await _retrain_once(state, force_retrain=True)
+        await coordinator.retrain(force_retrain=True)
+
+    background_tasks: List[asyncio.Task] = []
 
     # Retrain on an interval
-    retrain_task: Optional[asyncio.Task] = None
     if (args.retrain_seconds is not None) and (args.retrain_seconds > 0):
-        retrain_task = asyncio.create_task(_retrain_loop(state, args.retrain_seconds))
+        background_tasks.append(
+            asyncio.create_task(_retrain_loop(coordinator, args.retrain_seconds))
+        )
+
+    # Retrain on changes
+    if args.retrain_on_change:
+        background_tasks.append(asyncio.create_task(coordinator.watch_hass()))
+        background_tasks.append(asyncio.create_task(coordinator.watch_sentences()))
 
     # Run server
     wyoming_server = AsyncServer.from_uri(args.uri)
@@ -110,78 +199,18 @@ async def main() -> None:
     except KeyboardInterrupt:
         pass
     finally:
-        if retrain_task is not None:
-            retrain_task.cancel()
-            await retrain_task
+        for background_task in background_tasks:
+            background_task.cancel()
 
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+        state.train_scheduler.worker_pool.shutdown()
 
-async def _retrain_loop(state: State, wait_seconds: float) -> None:
+
+async def _retrain_loop(coordinator: RetrainCoordinator, wait_seconds: float) -> None:
     """Wait and retrain on a loop."""
     while True:
         await asyncio.sleep(wait_seconds)
-        await _retrain_once(state)
-
-
-async def _retrain_once(state: State, force_retrain: bool = False) -> None:
-    """Retrain all models that match HA's language or a pipeline language."""
-    settings = state.settings
-    _LOGGER.debug(
-        "Getting exposed things from Home Assistant (%s)", settings.hass_websocket_uri
-    )
-    hass_info = await get_hass_info(
-        token=settings.hass_token, uri=settings.hass_websocket_uri
-    )
-    _LOGGER.debug("HA system language: %s", hass_info.system_language)
-    if hass_info.pipeline_languages:
-        _LOGGER.debug("HA pipeline language(s): %s", hass_info.pipeline_languages)
-
-    settings.default_language = hass_info.system_language
-    things = hass_info.things
-    _LOGGER.debug(
-        "Got %s entities, %s area(s), %s floor(s), %s extra sentence(s)",
-        len(things.entities),
-        len(things.areas),
-        len(things.floors),
-        len(things.extra_sentences),
-    )
-
-    languages_to_train = list(hass_info.pipeline_languages) + [
-        hass_info.system_language
-    ]
-    models_to_train = get_models_for_languages(languages_to_train)
-    if not models_to_train:
-        # Fall back to English model
-        models_to_train = [DEFAULT_MODEL]
-
-    async with state.model_train_tasks_lock:
-        for model in models_to_train:
-            if model.id in state.model_train_tasks:
-                # Already training
-                continue
-
-            train_task = asyncio.create_task(
-                _train_model(model, settings, hass_info, force_retrain=force_retrain)
-            )
-            state.model_train_tasks[model.id] = train_task
-            train_task.add_done_callback(
-                partial(
-                    lambda _task, model_id: state.model_train_tasks.pop(model_id, None),
-                    model.id,
-                )
-            )
-
-
-async def _train_model(
-    model: Model,
-    settings: Settings,
-    hass_info: HomeAssistantInfo,
-    force_retrain: bool = False,
-) -> None:
-    try:
-        await train(model, settings, hass_info.things, force_retrain=force_retrain)
-    except Exception:
-        _LOGGER.exception("Unexpected error while training %s", model.id)
-        raise
+        await coordinator.retrain()
 
 
 # -----------------------------------------------------------------------------
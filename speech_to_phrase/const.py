@@ -8,6 +8,7 @@ from pathlib import Path
 from typing import Dict, List, Optional, Union
 
 from .speech_tools import SpeechTools
+from .train_scheduler import TrainingScheduler
 
 # Kaldi
 EPS = "<eps>"
@@ -70,6 +71,15 @@ class Settings:
         shared_lists_path: Optional[Path] = None,
         default_language: str = Language.ENGLISH.value,
         volume_multiplier: float = 1.0,
+        lookahead_min_arcs: Optional[int] = None,
+        train_workers: int = 1,
+        train_niceness: int = 10,
+        train_max_defer_seconds: float = 10.0,
+        write_arpa: bool = False,
+        ngram_order: Optional[int] = None,
+        ngram_prune_theta: Optional[float] = None,
+        ngram_max_arcs: Optional[int] = None,
+        coqui_lazy_compose: bool = False,
     ) -> None:
         """Initialize settings."""
         self.models_dir = Path(models_dir)
@@ -93,6 +103,33 @@ class Settings:
         self.default_language = default_language
         self.volume_multiplier = volume_multiplier
 
+        # Grammars with at least this many arcs are composed with HCL.fst
+        # during decoding instead of being expanded into HCLG.fst.
+        self.lookahead_min_arcs = lookahead_min_arcs
+
+        # Training runs at most this many models at once, with subprocesses
+        # at a lower priority than decoding.
+        self.train_workers = train_workers
+        self.train_tools = self.tools.for_training(train_niceness)
+
+        # Seconds to wait for active decodes to finish before training
+        self.train_max_defer_seconds = train_max_defer_seconds
+
+        # Write n-gram model as ARPA text too (for debugging)
+        self.write_arpa = write_arpa
+
+        # Override the n-gram order and pruning of every model.
+        # With a maximum number of arcs, the largest order (up to ngram_order)
+        # whose n-gram model fits is chosen automatically.
+        self.ngram_order = ngram_order
+        self.ngram_prune_theta = ngram_prune_theta
+        self.ngram_max_arcs = ngram_max_arcs
+
+        # Keep Coqui STT token/char/word/sentence layers separate and compose
+        # them with the pruned logits during decoding instead of training
+        # token2sen.fst.
+        self.coqui_lazy_compose = coqui_lazy_compose
+
     def model_data_dir(self, model_id: str) -> Path:
         """Path to model data."""
         return self.models_dir / model_id
@@ -105,6 +142,22 @@ class Settings:
         """Path to training info file for a model."""
         return self.model_train_dir(model_id) / "training_info.json"
 
+    def model_train_manifest_path(self, model_id: str) -> Path:
+        """Path to manifest of completed training stages for a model."""
+        return self.model_train_dir(model_id) / "training_stages.json"
+
+    def model_training_report_path(self, model_id: str) -> Path:
+        """Path to stage timings of recent training runs for a model."""
+        return self.model_train_dir(model_id) / "training_report.json"
+
+    def model_file_hashes_path(self, model_id: str) -> Path:
+        """Path to cache of file content hashes for a model."""
+        return self.model_train_dir(model_id) / "file_hashes.json"
+
+    def model_g2p_guesses_path(self, model_id: str) -> Path:
+        """Path to cache of guessed pronunciations for a model."""
+        return self.model_train_dir(model_id) / "g2p_guesses.json"
+
     def training_sentences_path(self, model_id: str) -> Path:
         """Path to YAML file with training sentences."""
         return self.model_train_dir(model_id) / "sentences.yaml"
@@ -125,11 +178,8 @@ class State:
     settings: Settings
     """Application settings."""
 
-    model_train_tasks: Dict[str, asyncio.Task] = field(default_factory=dict)
-    """Training tasks for each model id."""
-
-    model_train_tasks_lock: asyncio.Lock = field(default_factory=asyncio.Lock)
-    """Lock for model_train_tasks."""
+    train_scheduler: TrainingScheduler = field(init=False)
+    """Queue of training jobs for each model id."""
 
     cached_transcribers: Dict[str, CachedTranscriber] = field(default_factory=dict)
     """Transcription tasks/audio queues for each model id."""
@@ -137,6 +187,13 @@ class State:
     cached_transcriber_lock: asyncio.Lock = field(default_factory=asyncio.Lock)
     """Lock for cached_transcriber."""
 
+    def __post_init__(self) -> None:
+        self.train_scheduler = TrainingScheduler(
+            max_workers=self.settings.train_workers,
+            max_defer_seconds=self.settings.train_max_defer_seconds,
+            worker_niceness=self.settings.train_tools.niceness,
+        )
+
 
 class WordCasing(str, Enum):
     """Casing applied to text when training model."""
@@ -4,6 +4,7 @@ import asyncio
 import logging
 import time
 from collections.abc import AsyncIterable
+from functools import partial
 from typing import Optional
 
 from pysilero_vad import SileroVoiceActivityDetector
@@ -19,6 +20,7 @@ from .const import CHANNELS, RATE, WIDTH, CachedTranscriber, State
 from .hass_api import get_hass_info
 from .models import DEFAULT_MODEL, MODELS, Model
 from .train import train
+from .train_scheduler import TrainingPriority
 from .transcribe import transcribe
 from .util import get_language_family
 
@@ -75,6 +77,7 @@ class SpeechToPhraseEventHandler(AsyncEventHandler):
         self.transcribe_task: Optional[asyncio.Task] = None
         self.model = DEFAULT_MODEL
         self.is_model_trained = False
+        self.is_decoding = False
 
     async def handle_event(self, event: Event) -> bool:
         """Handle Wyoming event."""
@@ -121,6 +124,7 @@ class SpeechToPhraseEventHandler(AsyncEventHandler):
                 self.transcribe_task = None
 
             await self._retrain()
+            self._set_decoding(True)
 
             async with self.state.cached_transcriber_lock:
                 cached_transcriber = self.state.cached_transcribers.pop(
@@ -155,7 +159,10 @@ class SpeechToPhraseEventHandler(AsyncEventHandler):
 
             start_time = time.monotonic()
             await self.audio_queue.put(None)  # end stream
-            text = await self.transcribe_task
+            try:
+                text = await self.transcribe_task
+            finally:
+                self._set_decoding(False)
 
             _LOGGER.debug(
                 "Got transcription in %s second(s): %s",
@@ -198,6 +205,19 @@ class SpeechToPhraseEventHandler(AsyncEventHandler):
 
     async def disconnect(self) -> None:
         """Handle disconnection."""
+        self._set_decoding(False)
+
+    def _set_decoding(self, is_decoding: bool) -> None:
+        """Let background training know if audio is being decoded."""
+        if is_decoding == self.is_decoding:
+            return
+
+        if is_decoding:
+            self.state.train_scheduler.start_decoding()
+        else:
+            self.state.train_scheduler.stop_decoding()
+
+        self.is_decoding = is_decoding
 
     async def _audio_stream(
         self, audio_queue: "asyncio.Queue[Optional[bytes]]"
@@ -234,17 +254,20 @@ class SpeechToPhraseEventHandler(AsyncEventHandler):
 
         model = self.model
 
-        async with self.state.model_train_tasks_lock:
-            # Use existing training task or create a new one
-            train_task = self.state.model_train_tasks.pop(model.id, None)
-            if train_task is None:
-                train_task = asyncio.create_task(self._retrain_model(model))
-                self.state.model_train_tasks[model.id] = train_task
-                train_task.add_done_callback(
-                    lambda _task: self.state.model_train_tasks.pop(model.id, None)
-                )
+        while True:
+            # Use existing training job or queue a new one ahead of background jobs
+            train_task = self.state.train_scheduler.schedule(
+                model.id,
+                partial(self._retrain_model, model),
+                priority=TrainingPriority.CLIENT,
+            )
 
-        await train_task
+            # Jobs with stale inputs are cancelled and replaced
+            await asyncio.wait([train_task])
+            if not train_task.cancelled():
+                break
+
+        train_task.result()
         self.is_model_trained = True
 
     async def _retrain_model(self, model: Model) -> None:
@@ -253,7 +276,12 @@ class SpeechToPhraseEventHandler(AsyncEventHandler):
             hass_info = await get_hass_info(
                 token=self.settings.hass_token, uri=self.settings.hass_websocket_uri
             )
-            await train(model, self.settings, hass_info.things)
+            await train(
+                model,
+                self.settings,
+                hass_info.things,
+                worker_pool=self.state.train_scheduler.worker_pool,
+            )
         except Exception:
             _LOGGER.exception("Unexpected error training %s", model.id)
             raise
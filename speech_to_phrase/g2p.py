@@ -1,11 +1,15 @@
 """Grapheme to phoneme methods."""
 
+import json
+import logging
+import mmap
+import os
 import sqlite3
 import subprocess
 import tempfile
-from collections.abc import Iterable
+from collections.abc import Iterable, Iterator
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple, Union
+from typing import Dict, List, Optional, Set, Tuple, Union
 
 import regex as re
 from unicode_rbnf import RbnfEngine
@@ -15,6 +19,10 @@ _INITIALISM_DOTS = re.compile(r"^(?:\p{L}\.){2,}$")
 _NUMBER_SPLIT = re.compile(r"(\d+(?:\.\d+)?)|[-_]")
 _NUMBER = re.compile(r"^\d+(\.\d+)?$")
 
+_WORD_INDEX_VERSION = 1
+
+_LOGGER = logging.getLogger(__name__)
+
 # -----------------------------------------------------------------------------
 
 
@@ -25,6 +33,7 @@ class LexiconDatabase:
         self.db_path = Path(db_path) if db_path else None
         self._conn = sqlite3.Connection(str(self.db_path)) if self.db_path else None
         self._cache: Dict[str, Optional[List[List[str]]]] = {}
+        self._db_words: Optional[Union[WordIndex, Set[str]]] = None
 
     def add(self, word: str, pronunciations: List[List[str]]) -> None:
         """Add pronunciations for a word (cache only)."""
@@ -36,48 +45,115 @@ class LexiconDatabase:
 
     def exists(self, word: str) -> bool:
         """Check if a pronunciation is known for the word."""
-        if (not self._cache) and (self._conn is not None):
-            # Load word list and add placeholders
-            cur = self._conn.execute("SELECT DISTINCT word FROM word_phonemes")
-            for row in cur:
-                self._cache[row[0]] = None
-
         word_vars = tuple(self._word_variations(word))
         for word_var in word_vars:
-            if word_var in self._cache:
+            if self._cache.get(word_var):
                 return True
 
+        if (self._db_words is None) and (self._conn is not None):
+            self._db_words = self._load_db_words()
+
+        if self._db_words is not None:
+            for word_var in word_vars:
+                if word_var in self._db_words:
+                    return True
+
         return False
 
     def lookup(self, word: str) -> List[List[str]]:
         """Get pronunciations for a word."""
-        word_vars = list(self._word_variations(word))
-        for word_var in word_vars:
-            cached_prons = self._cache.get(word_var)
-            if cached_prons is not None:
-                return cached_prons
+        _word, prons = next(self.lookup_many([word]))
+        return prons
+
+    def lookup_many(
+        self, words: Iterable[str]
+    ) -> Iterator[Tuple[str, List[List[str]]]]:
+        """Get pronunciations for many words, in order.
+
+        Words that aren't cached are looked up in a single query.
+        """
+        words = list(words)
+        word_prons: Dict[str, List[List[str]]] = {}
+        uncached_words: Dict[str, List[str]] = {}
+        for word in words:
+            if (word in word_prons) or (word in uncached_words):
+                continue
+
+            word_vars = list(self._word_variations(word))
+            for word_var in word_vars:
+                cached_prons = self._cache.get(word_var)
+                if cached_prons is not None:
+                    word_prons[word] = cached_prons
+                    break
+            else:
+                uncached_words[word] = word_vars
+
+        if uncached_words and (self._conn is not None):
+            db_prons = self._lookup_db(
+                {
+                    word_var
+                    for word_vars in uncached_words.values()
+                    for word_var in word_vars
+                }
+            )
+            for word, word_vars in uncached_words.items():
+                prons: List[List[str]] = []
+                for word_var in word_vars:
+                    prons = db_prons.get(word_var, [])
+                    if prons:
+                        # Only use pronunciation for first variation
+                        self._cache[word_var] = prons
+                        break
+
+                # Update cache
+                self._cache[word] = prons
+                word_prons[word] = prons
 
-        if self._conn is None:
-            return []
+        for word in words:
+            yield (word, word_prons.get(word, []))
 
-        db_prons: List[List[str]] = []
-        for word_var in word_vars:
+    def _lookup_db(self, words: Iterable[str]) -> Dict[str, List[List[str]]]:
+        """Get all pronunciations for words from the database."""
+        assert self._conn is not None
+        db_prons: Dict[str, List[List[str]]] = {}
+
+        self._conn.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS lookup_words (word TEXT PRIMARY KEY)"
+        )
+        try:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO lookup_words (word) VALUES (?)",
+                ((word,) for word in words),
+            )
             cur = self._conn.execute(
-                "SELECT phonemes FROM word_phonemes WHERE word = ? ORDER by pron_order",
-                (word_var,),
+                "SELECT word_phonemes.word, word_phonemes.phonemes "
+                "FROM word_phonemes "
+                "INNER JOIN lookup_words ON word_phonemes.word = lookup_words.word "
+                "ORDER BY word_phonemes.word, word_phonemes.pron_order"
             )
-            for row in cur:
-                db_prons.append(row[0].split())
+            for word, phonemes in cur:
+                db_prons.setdefault(word, []).append(phonemes.split())
+        finally:
+            self._conn.execute("DELETE FROM lookup_words")
+            self._conn.commit()
 
-            if db_prons:
-                # Only return pronunciation for first variation
-                self._cache[word_var] = db_prons
-                break
+        return db_prons
 
-        # Update cache
-        self._cache[word] = db_prons
+    def _load_db_words(self) -> Union["WordIndex", Set[str]]:
+        """Load index of words in the database."""
+        assert (self.db_path is not None) and (self._conn is not None)
+        try:
+            return WordIndex.load(
+                self.db_path.with_suffix(".words"), self.db_path, self._conn
+            )
+        except OSError:
+            _LOGGER.exception(
+                "Failed to create word index for %s. Loading words into memory.",
+                self.db_path,
+            )
 
-        return db_prons
+        cur = self._conn.execute("SELECT DISTINCT word FROM word_phonemes")
+        return {row[0] for row in cur}
 
     def _word_variations(self, word: str) -> Iterable[str]:
         yield word
@@ -94,6 +170,98 @@ class LexiconDatabase:
             yield word_upper
 
 
+class WordIndex:
+    """Sorted list of lexicon words, memory-mapped for membership tests.
+
+    The index is built once from the database and shared between processes.
+    It is rebuilt when the database's size or modification time changes.
+    """
+
+    def __init__(self, index_path: Path) -> None:
+        self.index_path = index_path
+        with open(index_path, "rb") as index_file:
+            self._data = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        # Skip header
+        self._start = self._data.find(b"\n") + 1
+
+    @staticmethod
+    def load(index_path: Path, db_path: Path, conn: sqlite3.Connection) -> "WordIndex":
+        """Load index, building it first if it's missing or out of date."""
+        header = WordIndex._get_header(db_path)
+        try:
+            with open(index_path, "rb") as index_file:
+                is_valid = index_file.readline() == header
+        except FileNotFoundError:
+            is_valid = False
+
+        if not is_valid:
+            _LOGGER.debug("Building word index: %s", index_path)
+            WordIndex.build(index_path, header, conn)
+
+        return WordIndex(index_path)
+
+    @staticmethod
+    def build(index_path: Path, header: bytes, conn: sqlite3.Connection) -> None:
+        """Write words from the database in sorted order, one per line."""
+        # Write to a temporary file first so other processes never see a
+        # partial index.
+        with tempfile.NamedTemporaryFile(
+            "wb", dir=index_path.parent, prefix=index_path.name, delete=False
+        ) as index_file:
+            try:
+                index_file.write(header)
+                cur = conn.execute(
+                    "SELECT DISTINCT word FROM word_phonemes ORDER BY word"
+                )
+                for (word,) in cur:
+                    if "\n" in word:
+                        continue
+
+                    index_file.write(word.encode("utf-8"))
+                    index_file.write(b"\n")
+            except Exception:
+                os.unlink(index_file.name)
+                raise
+
+        os.replace(index_file.name, index_path)
+
+    def __contains__(self, word: str) -> bool:
+        """Binary search for word."""
+        data = self._data
+        target = word.encode("utf-8")
+
+        # lo and hi are always at the start of a line
+        lo, hi = self._start, len(data)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            line_start = data.rfind(b"\n", lo, mid) + 1
+            if line_start <= 0:
+                line_start = lo
+
+            line_end = data.find(b"\n", line_start, hi)
+            if line_end < 0:
+                line_end = hi
+
+            line = data[line_start:line_end]
+            if line == target:
+                return True
+
+            if line < target:
+                lo = line_end + 1
+            else:
+                hi = line_start
+
+        return False
+
+    @staticmethod
+    def _get_header(db_path: Path) -> bytes:
+        db_stat = os.stat(db_path)
+        return (
+            f"{_WORD_INDEX_VERSION} {db_stat.st_size} {db_stat.st_mtime_ns}\n"
+        ).encode("utf-8")
+
+
 # -----------------------------------------------------------------------------
 
 
@@ -143,6 +311,69 @@ def split_words(
 # -----------------------------------------------------------------------------
 
 
+class GuessCache:
+    """Persistent cache of pronunciations guessed by a g2p model.
+
+    Words map to their guessed phonemes, or None if no pronunciation could be
+    guessed. Guesses are discarded when the g2p model's hash changes.
+    """
+
+    def __init__(self, cache_path: Union[str, Path], g2p_model_hash: str) -> None:
+        """Load cache if it exists."""
+        self.cache_path = Path(cache_path)
+        self.g2p_model_hash = g2p_model_hash
+        self.guesses: Dict[str, Optional[str]] = {}
+        self._is_dirty = False
+
+        if self.cache_path.exists():
+            try:
+                with open(self.cache_path, "r", encoding="utf-8") as cache_file:
+                    cache_dict = json.load(cache_file)
+
+                if cache_dict.get("g2p_model_hash") == g2p_model_hash:
+                    self.guesses = cache_dict["guesses"]
+            except Exception:  # pylint: disable=broad-exception-caught
+                _LOGGER.exception("Failed to load g2p guesses: %s", self.cache_path)
+                self.guesses = {}
+
+    def add(self, word: str, phonemes: Optional[str]) -> None:
+        """Add a guess (None if no pronunciation could be guessed)."""
+        self.guesses[word] = phonemes
+        self._is_dirty = True
+
+    def save(self) -> None:
+        """Persist guesses if they've changed."""
+        if not self._is_dirty:
+            return
+
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.cache_path.with_suffix(".tmp")
+        with open(temp_path, "w", encoding="utf-8") as cache_file:
+            json.dump(
+                {"g2p_model_hash": self.g2p_model_hash, "guesses": self.guesses},
+                cache_file,
+                ensure_ascii=False,
+            )
+
+        temp_path.replace(self.cache_path)
+        self._is_dirty = False
+
+
+def parse_phonetisaurus_output(
+    output_lines: Iterable[str],
+) -> Iterator[Tuple[str, Optional[str]]]:
+    """Parse (word, phonemes) from phonetisaurus output.
+
+    Phonemes are None for words that no pronunciation could be guessed for.
+    """
+    for line in output_lines:
+        line_parts = line.split()
+        if len(line_parts) == 2:
+            yield (line_parts[0], None)
+        elif len(line_parts) >= 3:
+            yield (line_parts[0], " ".join(line_parts[2:]))
+
+
 def guess_pronunciations(
     words: Iterable[str],
     g2p_model_path: Union[str, Path],
@@ -167,13 +398,6 @@ def guess_pronunciations(
             .decode()
             .splitlines()
         )
-        for line in phonetisaurus_output:
-            line = line.strip()
-            if line:
-                line_parts = line.split()
-                if len(line_parts) < 3:
-                    continue
-
-                word = line_parts[0]
-                phonemes = " ".join(line_parts[2:])
+        for word, phonemes in parse_phonetisaurus_output(phonetisaurus_output):
+            if phonemes is not None:
                 yield (word, phonemes)
@@ -0,0 +1,99 @@
+"""Content hashing with a file stat cache."""
+
+import hashlib
+import json
+import logging
+import os
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, Optional, Union
+
+_LOGGER = logging.getLogger(__name__)
+
+_CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass
+class FileHash:
+    """Hash of a file's full contents along with its stat info."""
+
+    size: int
+    mtime_ns: int
+    hash: str
+
+
+class FileHashCache:
+    """Hashes full file contents, skipping files whose size/mtime are unchanged.
+
+    If a cache path is given, hashes are persisted between runs.
+    """
+
+    def __init__(self, cache_path: Optional[Union[str, Path]] = None) -> None:
+        """Load cache if it exists."""
+        self.cache_path = Path(cache_path) if cache_path else None
+        self._hashes: Dict[str, FileHash] = {}
+        self._is_dirty = False
+
+        if (self.cache_path is not None) and self.cache_path.exists():
+            try:
+                with open(self.cache_path, "r", encoding="utf-8") as cache_file:
+                    self._hashes = {
+                        path_str: FileHash(**hash_dict)
+                        for path_str, hash_dict in json.load(cache_file).items()
+                    }
+            except Exception:  # pylint: disable=broad-exception-caught
+                _LOGGER.exception("Failed to load file hashes: %s", self.cache_path)
+                self._hashes = {}
+
+    def hash_file(self, file_path: Union[str, Path]) -> str:
+        """Get hash of a file's full contents."""
+        file_path = Path(file_path).absolute()
+        path_str = str(file_path)
+        file_stat = os.stat(file_path)
+
+        cached_hash = self._hashes.get(path_str)
+        if (
+            (cached_hash is not None)
+            and (cached_hash.size == file_stat.st_size)
+            and (cached_hash.mtime_ns == file_stat.st_mtime_ns)
+        ):
+            return cached_hash.hash
+
+        file_hash = hash_file(file_path)
+        self._hashes[path_str] = FileHash(
+            size=file_stat.st_size, mtime_ns=file_stat.st_mtime_ns, hash=file_hash
+        )
+        self._is_dirty = True
+
+        return file_hash
+
+    def save(self) -> None:
+        """Persist hashes if a cache path was given."""
+        if (self.cache_path is None) or (not self._is_dirty):
+            return
+
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.cache_path.with_suffix(".tmp")
+        with open(temp_path, "w", encoding="utf-8") as cache_file:
+            json.dump(
+                {
+                    path_str: asdict(file_hash)
+                    for path_str, file_hash in self._hashes.items()
+                },
+                cache_file,
+            )
+
+        temp_path.replace(self.cache_path)
+        self._is_dirty = False
+
+
+def hash_file(file_path: Union[str, Path]) -> str:
+    """Hash the full contents of a file."""
+    hasher = hashlib.sha256()
+    with open(file_path, "rb") as hash_file_obj:
+        chunk = hash_file_obj.read(_CHUNK_SIZE)
+        while chunk:
+            hasher.update(chunk)
+            chunk = hash_file_obj.read(_CHUNK_SIZE)
+
+    return hasher.hexdigest()
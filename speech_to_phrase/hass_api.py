@@ -3,7 +3,7 @@
 import hashlib
 import logging
 import re
-from collections.abc import Generator
+from collections.abc import AsyncIterator, Generator, Iterable
 from dataclasses import dataclass, field, fields
 from typing import Any, Dict, List, Optional, Set, Union
 
@@ -19,6 +19,15 @@ MEDIA_PLAYER_PAUSE = 1
 MEDIA_PLAYER_VOLUME_SET = 4
 MEDIA_PLAYER_NEXT_TRACK = 32
 
+# Events for changes to entities, areas, floors, and sentence triggers
+CHANGE_EVENT_TYPES = {
+    "area_registry_updated",
+    "automation_reloaded",
+    "entity_registry_updated",
+    "floor_registry_updated",
+    "script_reloaded",
+}
+
 
 @dataclass
 class Entity:
@@ -118,22 +127,22 @@ class Things:
         if not self._hash:
             hasher = hashlib.sha256()
 
-            for entity_hash in sorted(e.get_hash() for e in self.entities):
-                hasher.update(entity_hash.encode("utf-8"))
-
-            for area_hash in sorted(e.get_hash() for e in self.entities):
-                hasher.update(area_hash.encode("utf-8"))
-
-            for floor_hash in sorted(e.get_hash() for e in self.entities):
-                hasher.update(floor_hash.encode("utf-8"))
-
-            for extra_sentence in sorted(self.extra_sentences):
-                hasher.update(extra_sentence.encode("utf-8"))
+            for component_hash in self.get_component_hashes().values():
+                hasher.update(component_hash.encode("utf-8"))
 
             self._hash = hasher.hexdigest()
 
         return self._hash
 
+    def get_component_hashes(self) -> Dict[str, str]:
+        """Get a stable hash for each kind of thing (entities, areas, etc.)."""
+        return {
+            "entities": _hash_strings(e.get_hash() for e in self.entities),
+            "areas": _hash_strings(a.get_hash() for a in self.areas),
+            "floors": _hash_strings(f.get_hash() for f in self.floors),
+            "extra_sentences": _hash_strings(self.extra_sentences),
+        }
+
     def to_lists_dict(self) -> Dict[str, Any]:
         """Get lists dictionary for hassil intents."""
         lists_dict: Dict[str, Any] = {}
@@ -217,6 +226,15 @@ def _remove_template_syntax(name: str) -> str:
     return re.sub(r"[{}\[\]<>()]", "", name)
 
 
+def _hash_strings(strings: Iterable[str]) -> str:
+    """Get a stable hash for strings, independent of order."""
+    hasher = hashlib.sha256()
+    for string in sorted(strings):
+        hasher.update(string.encode("utf-8"))
+
+    return hasher.hexdigest()
+
+
 def _coerce_list(str_or_list: Union[str, List[str]]) -> List[str]:
     if isinstance(str_or_list, str):
         return [str_or_list]
@@ -247,19 +265,7 @@ async def get_hass_info(token: str, uri: str) -> HomeAssistantInfo:
 
     async with aiohttp.ClientSession() as session:
         async with session.ws_connect(uri, max_msg_size=0) as websocket:
-            # Authenticate
-            msg = await websocket.receive_json()
-            assert msg["type"] == "auth_required", msg
-
-            await websocket.send_json(
-                {
-                    "type": "auth",
-                    "access_token": token,
-                }
-            )
-
-            msg = await websocket.receive_json()
-            assert msg["type"] == "auth_ok", msg
+            await _authenticate(websocket, token)
 
             # Get system language
             await websocket.send_json({"id": next_id(), "type": "get_config"})
@@ -466,6 +472,56 @@ async def get_hass_info(token: str, uri: str) -> HomeAssistantInfo:
     )
 
 
+async def watch_hass_changes(token: str, uri: str) -> AsyncIterator[str]:
+    """Yield the types of HA events that may change what needs to be trained."""
+    async with aiohttp.ClientSession() as session:
+        async with session.ws_connect(uri, max_msg_size=0) as websocket:
+            await _authenticate(websocket, token)
+
+            for msg_id, event_type in enumerate(sorted(CHANGE_EVENT_TYPES), start=1):
+                await websocket.send_json(
+                    {"id": msg_id, "type": "subscribe_events", "event_type": event_type}
+                )
+
+                # Events from earlier subscriptions may arrive before the result
+                while True:
+                    msg = await websocket.receive_json()
+                    if msg.get("type") == "event":
+                        yield msg["event"]["event_type"]
+                    elif (msg.get("type") == "result") and (msg.get("id") == msg_id):
+                        break
+
+                if not msg.get("success"):
+                    _LOGGER.error(
+                        "Failed to subscribe to %s events: %s",
+                        event_type,
+                        msg.get("error"),
+                    )
+
+            while True:
+                msg = await websocket.receive_json()
+                if msg.get("type") != "event":
+                    continue
+
+                yield msg["event"]["event_type"]
+
+
+async def _authenticate(websocket: Any, token: str) -> None:
+    """Authenticate with HA websocket API."""
+    msg = await websocket.receive_json()
+    assert msg["type"] == "auth_required", msg
+
+    await websocket.send_json(
+        {
+            "type": "auth",
+            "access_token": token,
+        }
+    )
+
+    msg = await websocket.receive_json()
+    assert msg["type"] == "auth_ok", msg
+
+
 def _find_ask_question_answers(item: Any) -> Generator[str]:
     """Yields answer sentences from automation or script config for ask_question."""
     if isinstance(item, dict):
@@ -4,13 +4,25 @@ import json
 import logging
 import math
 import re
-from collections import defaultdict
+from array import array
+from collections import Counter, defaultdict
 from collections.abc import Callable
 from collections.abc import Sequence as ABCSequence
 from dataclasses import dataclass, field
-from enum import Enum, auto
+from enum import IntEnum, auto
 from functools import reduce
-from typing import Dict, List, Optional, Set, TextIO, Tuple, Union
+from typing import (
+    BinaryIO,
+    Dict,
+    FrozenSet,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    TextIO,
+    Tuple,
+    Union,
+)
 
 from hassil import (
     Alternative,
@@ -33,6 +45,7 @@ from hassil import (
 from unicode_rbnf import RbnfEngine
 
 from .g2p import LexiconDatabase, split_words
+from .openfst import SymbolTable, VectorArc, write_vector_fst
 
 EPS = "<eps>"
 SPACE = "<space>"
@@ -40,12 +53,13 @@ BEGIN_OUTPUT = "__begin_output:"
 END_OUTPUT = "__end_output"
 SENTENCE_OUTPUT = "__sentence_output:"
 OUTPUT_PREFIX = "__output:"
+CLASS_PREFIX = "__class:"
 WORD_PENALTY = 0.03
 
 _LOGGER = logging.getLogger(__name__)
 
 
-class SuppressOutput(Enum):
+class SuppressOutput(IntEnum):
     DISABLED = auto()
     UNTIL_END = auto()
     UNTIL_SPACE = auto()
@@ -117,6 +131,81 @@ class Fst:
         self.states.add(to_state)
         self.arcs[from_state].append(FstArc(to_state, in_label, out_label, log_prob))
 
+    def insert(self, other: "Fst", state: int, other_end: int) -> int:
+        """Copy arcs of another FST, starting at state.
+
+        Returns the state corresponding to other_end.
+        """
+        offset = self.copy_arcs_from(other, state)
+        if other_end == other.start:
+            return state
+
+        return offset + other_end
+
+    def copy_arcs_from(self, other: "Fst", state: int) -> int:
+        """Copy arcs of another FST with its start state mapped to state.
+
+        All other states of the other FST are offset by the returned amount.
+        """
+        offset = self.current_state
+        self.current_state += other.current_state
+
+        def map_state(other_state: int) -> int:
+            if other_state == other.start:
+                return state
+
+            return offset + other_state
+
+        for other_state, other_arcs in other.arcs.items():
+            from_state = map_state(other_state)
+            self.states.add(from_state)
+            arcs = self.arcs[from_state]
+            for arc in other_arcs:
+                to_state = map_state(arc.to_state)
+                self.states.add(to_state)
+                arcs.append(FstArc(to_state, arc.in_label, arc.out_label, arc.log_prob))
+
+        self.words.update(other.words)
+        self.output_words.update(other.output_words)
+
+        return offset
+
+    def replace_labels(self, replacements: Dict[str, "Fst"]) -> "Fst":
+        """Copy with each arc whose input label is a key replaced by that FST.
+
+        Like fstreplace, the arc's weight is kept on an epsilon arc into the
+        replacement, and its final states get epsilon arcs back out.
+        """
+        replaced = Fst(start=self.start, current_state=self.current_state)
+        replaced.states.update(self.states)
+        replaced.final_states.update(self.final_states)
+
+        for state, arcs in self.arcs.items():
+            for arc in arcs:
+                other = replacements.get(arc.in_label)
+                if other is None:
+                    replaced.add_edge(
+                        state, arc.to_state, arc.in_label, arc.out_label, arc.log_prob
+                    )
+                    continue
+
+                # Other start state maps to a new entry state
+                other_start = replaced.next_edge(state, EPS, EPS, arc.log_prob)
+                offset = replaced.copy_arcs_from(other, other_start)
+                for other_final in other.final_states:
+                    replaced.add_edge(
+                        (
+                            other_start
+                            if other_final == other.start
+                            else offset + other_final
+                        ),
+                        arc.to_state,
+                        EPS,
+                        EPS,
+                    )
+
+        return replaced
+
     def accept(self, state: int) -> None:
         self.states.add(state)
         self.final_states.add(state)
@@ -153,10 +242,58 @@ class Fst:
             for symbol, symbol_id in symbols.items():
                 print(symbol, symbol_id, file=symbols_file)
 
+    def write_binary(
+        self,
+        fst_file: BinaryIO,
+        isymbols: SymbolTable,
+        osymbols: Optional[SymbolTable] = None,
+        keep_symbols: bool = False,
+        project_input: bool = False,
+    ) -> None:
+        """Write in OpenFST's binary vector format (see CompactFst)."""
+        self.to_compact().write_binary(
+            fst_file,
+            isymbols,
+            osymbols=osymbols,
+            keep_symbols=keep_symbols,
+            project_input=project_input,
+        )
+
+    def to_compact(self) -> "CompactFst":
+        """Copy into an array-backed FST with the same arcs and symbols."""
+        compact_fst = CompactFst()
+        compact_fst.start = self.start
+        compact_fst.current_state = self.current_state
+        for state in self.final_states:
+            compact_fst.accept(state)
+
+        for state, arcs in self.arcs.items():
+            for arc in arcs:
+                compact_fst.add_edge(
+                    state, arc.to_state, arc.in_label, arc.out_label, arc.log_prob
+                )
+
+        return compact_fst
+
     def remove_spaces(self) -> "Fst":
-        """Remove <space> tokens and merge partial word labels."""
+        """Remove <space> tokens and merge partial word labels.
+
+        Uses an explicit stack instead of recursion, visiting arcs in the same
+        depth-first order. Where paths join between spaces, traversal is
+        memoized on the input state, pending word buffer (input and output
+        word), output-suppression mode, and the output state that the word's
+        arcs start from.
+        """
+        # (state, arc index, suppress mode after space) -> output state
         visited: Dict[Tuple[int, int, int], int] = {}
 
+        # (state, word, output word, suppress mode, output state)
+        seen_configs: Set[Tuple[int, str, Optional[str], int, int]] = set()
+
+        # Only states with multiple incoming arcs can be reached twice
+        in_degree = Counter(arc.to_state for arcs in self.arcs.values() for arc in arcs)
+        join_states = {state for state, degree in in_degree.items() if degree > 1}
+
         fst_without_spaces = Fst()
         for arc in self.arcs[self.start]:
             # Copy initial weighted intent arc
@@ -164,143 +301,277 @@ class Fst:
                 fst_without_spaces.start, log_prob=arc.log_prob
             )
 
-            for next_arc_idx, next_arc in enumerate(self.arcs[arc.to_state]):
-                self._remove_spaces(
-                    arc.to_state,
-                    next_arc,
-                    next_arc_idx,
-                    "",
-                    None,
-                    visited,
-                    fst_without_spaces,
-                    output_state,
-                )
+            self._remove_spaces(
+                arc.to_state,
+                output_state,
+                visited,
+                seen_configs,
+                join_states,
+                fst_without_spaces,
+            )
+
+        # Every new state has an incoming arc
+        fst_without_spaces.states.update(range(fst_without_spaces.current_state + 1))
 
         return fst_without_spaces
 
     def _remove_spaces(
         self,
-        state: int,
-        arc: FstArc,
-        arc_idx: int,
-        word: str,
-        output_word: Optional[str],
+        start_state: int,
+        start_output_state: int,
         visited: Dict[Tuple[int, int, int], int],
+        seen_configs: Set[Tuple[int, str, Optional[str], int, int]],
+        join_states: Set[int],
         fst_without_spaces: "Fst",
-        output_state: int,
-        suppress_output: SuppressOutput = SuppressOutput.DISABLED,
     ) -> None:
-        if arc.in_label == SPACE:
-            key = (state, arc.to_state, arc_idx)
-            cached_state = visited.get(key)
-            input_symbol = word or EPS
-            output_symbol = input_symbol
-
-            if suppress_output in (
-                SuppressOutput.UNTIL_END,
-                SuppressOutput.UNTIL_SPACE,
-            ):
-                # Suppress output
-                output_symbol = output_word or EPS
-                output_word = None  # consume
-            elif output_word is not None:
-                # Override output
-                output_symbol = output_word
-                output_word = None  # consume
-
-            if cached_state is not None:
-                fst_without_spaces.add_edge(
-                    output_state,
-                    cached_state,
-                    input_symbol,
-                    output_symbol,
-                    log_prob=WORD_PENALTY if input_symbol != EPS else None,
-                )
-                return
-
-            output_state = fst_without_spaces.next_edge(
-                output_state,
-                input_symbol,
-                output_symbol,
-                log_prob=WORD_PENALTY if input_symbol != EPS else None,
+        # Arcs are added directly since their labels come from this FST's
+        # labels, which were already checked by add_edge.
+        output_arcs = fst_without_spaces.arcs
+        words = fst_without_spaces.words
+        output_words = fst_without_spaces.output_words
+        output_final_states = fst_without_spaces.final_states
+        final_states = self.final_states
+        arcs = self.arcs
+
+        # Plain ints keep memo keys atomic, so the garbage collector stops
+        # tracking them.
+        disabled = int(SuppressOutput.DISABLED)
+        until_end = int(SuppressOutput.UNTIL_END)
+        until_space = int(SuppressOutput.UNTIL_SPACE)
+
+        # Each frame holds the remaining arcs of a state along with the
+        # traversal state (word, output word, suppress mode, output state)
+        # that was reached when entering it.
+        stack: List[
+            Tuple[
+                int,
+                Iterator[Tuple[int, FstArc]],
+                str,
+                Optional[str],
+                int,
+                int,
+            ]
+        ] = [
+            (
+                start_state,
+                iter(enumerate(arcs[start_state])),
+                "",
+                None,
+                disabled,
+                start_output_state,
             )
-            visited[key] = output_state
+        ]
+
+        while stack:
+            state, arcs_iter, word, output_word, suppress_output, output_state = stack[
+                -1
+            ]
+            next_arc = next(arcs_iter, None)
+            if next_arc is None:
+                stack.pop()
+                continue
+
+            arc_idx, arc = next_arc
+
+            # Follow chains of single arcs without pushing a frame
+            while True:
+                in_label = arc.in_label
+                out_label = arc.out_label
+                if in_label == SPACE:
+                    input_symbol = word or EPS
+                    output_symbol = input_symbol
+
+                    if suppress_output != disabled:
+                        # Suppress output
+                        output_symbol = output_word or EPS
+                        output_word = None  # consume
+
+                        if suppress_output == until_space:
+                            suppress_output = disabled
+                    elif output_word is not None:
+                        # Override output
+                        output_symbol = output_word
+                        output_word = None  # consume
+
+                    if input_symbol == EPS:
+                        log_prob: Optional[float] = None
+                    else:
+                        log_prob = WORD_PENALTY
+                        words.add(input_symbol)
+
+                    key = (state, arc_idx, suppress_output)
+                    cached_state = visited.get(key)
+                    if cached_state is not None:
+                        output_arcs[output_state].append(
+                            FstArc(cached_state, input_symbol, output_symbol, log_prob)
+                        )
+                        if output_symbol != EPS:
+                            output_words.add(output_symbol)
 
-            if arc.to_state in self.final_states:
-                fst_without_spaces.final_states.add(output_state)
+                        break
 
-            word = ""
+                    fst_without_spaces.current_state += 1
+                    next_output_state = fst_without_spaces.current_state
+                    output_arcs[output_state].append(
+                        FstArc(next_output_state, input_symbol, output_symbol, log_prob)
+                    )
+                    if output_symbol != EPS:
+                        output_words.add(output_symbol)
+
+                    output_state = next_output_state
+                    visited[key] = output_state
+
+                    if arc.to_state in final_states:
+                        output_final_states.add(output_state)
+
+                    word = ""
+                elif in_label != EPS:
+                    word += in_label
+
+                    if (
+                        (suppress_output == disabled)
+                        and (out_label != EPS)
+                        and (out_label != in_label)
+                    ):
+                        # Short-term output override
+                        suppress_output = until_space
+                        output_word = out_label
+
+                if out_label.startswith("__"):
+                    if out_label.startswith(BEGIN_OUTPUT):
+                        # Start suppressing output
+                        suppress_output = until_end
+                    elif out_label.startswith(END_OUTPUT):
+                        # Stop suppressing output
+                        suppress_output = until_space
+                    elif out_label.startswith(SENTENCE_OUTPUT):
+                        output_state = fst_without_spaces.next_edge(
+                            output_state, EPS, out_label
+                        )
+                    elif out_label.startswith(OUTPUT_PREFIX):
+                        # Output on next space
+                        output_word = out_label
+
+                state = arc.to_state
+                if state in join_states:
+                    config = (state, word, output_word, suppress_output, output_state)
+                    if config in seen_configs:
+                        # Continuation was already produced
+                        break
+
+                    seen_configs.add(config)
+
+                next_arcs = arcs[state]
+                if len(next_arcs) != 1:
+                    if not next_arcs:
+                        break
+
+                    stack.append(
+                        (
+                            state,
+                            iter(enumerate(next_arcs)),
+                            word,
+                            output_word,
+                            suppress_output,
+                            output_state,
+                        )
+                    )
+                    break
 
-            if suppress_output == SuppressOutput.UNTIL_SPACE:
-                suppress_output = SuppressOutput.DISABLED
-        elif arc.in_label != EPS:
-            word += arc.in_label
+                arc_idx = 0
+                arc = next_arcs[0]
 
-            if (
-                (suppress_output == SuppressOutput.DISABLED)
-                and (arc.out_label != EPS)
-                and (arc.out_label != arc.in_label)
-            ):
-                # Short-term output override
-                suppress_output = SuppressOutput.UNTIL_SPACE
-                output_word = arc.out_label
-
-        if arc.out_label.startswith(BEGIN_OUTPUT):
-            # Start suppressing output
-            suppress_output = SuppressOutput.UNTIL_END
-        elif arc.out_label.startswith(END_OUTPUT):
-            # Stop suppressing output
-            suppress_output = SuppressOutput.UNTIL_SPACE
-        elif arc.out_label.startswith(SENTENCE_OUTPUT):
-            output_state = fst_without_spaces.next_edge(
-                output_state, EPS, arc.out_label
-            )
-        elif arc.out_label.startswith(OUTPUT_PREFIX):
-            # Output on next space
-            output_word = arc.out_label
+    def prune(self) -> None:
+        """Remove paths not connected to a final state.
+
+        Dead ends are removed in one scan of the arcs. If that creates new dead
+        ends, incoming arcs are indexed once so that chains of any length are
+        removed without rescanning.
+        """
+        states_to_prune = {
+            state
+            for state in self.states
+            if (not self.arcs[state]) and (state not in self.final_states)
+        }
+        if not states_to_prune:
+            return
+
+        removed_arcs: List[FstArc] = []
+        next_states_to_prune = self._prune_states(states_to_prune, removed_arcs)
+
+        if next_states_to_prune:
+            # Incoming arcs and number of outgoing arcs for remaining states
+            from_states: Dict[int, List[int]] = defaultdict(list)
+            num_arcs: Dict[int, int] = {}
+            for state, arcs in self.arcs.items():
+                num_arcs[state] = len(arcs)
+                for arc in arcs:
+                    from_states[arc.to_state].append(state)
+
+            states_to_prune = set(next_states_to_prune)
+            stack = list(next_states_to_prune)
+            while stack:
+                state = stack.pop()
+                for from_state in from_states.get(state, []):
+                    num_arcs[from_state] -= 1
+                    if (
+                        (num_arcs[from_state] == 0)
+                        and (from_state not in self.final_states)
+                        and (from_state not in states_to_prune)
+                    ):
+                        states_to_prune.add(from_state)
+                        stack.append(from_state)
+
+            self._prune_states(states_to_prune, removed_arcs)
+
+        # Drop words that were only on removed arcs
+        removed_words = {arc.in_label for arc in removed_arcs}
+        removed_output_words = {arc.out_label for arc in removed_arcs}
+        removed_words.discard(EPS)
+        removed_output_words.discard(EPS)
+        for arcs in self.arcs.values():
+            if (not removed_words) and (not removed_output_words):
+                break
 
-        for next_arc_idx, next_arc in enumerate(self.arcs[arc.to_state]):
-            self._remove_spaces(
-                arc.to_state,
-                next_arc,
-                next_arc_idx,
-                word,
-                output_word,
-                visited,
-                fst_without_spaces,
-                output_state,
-                suppress_output=suppress_output,
-            )
+            for arc in arcs:
+                removed_words.discard(arc.in_label)
+                removed_output_words.discard(arc.out_label)
 
-    def prune(self) -> None:
-        """Remove paths not connected to a final state."""
-        while True:
-            states_to_prune: Set[int] = set()
+        self.words.difference_update(removed_words)
+        self.output_words.difference_update(removed_output_words)
 
-            for state in self.states:
-                if (not self.arcs[state]) and (state not in self.final_states):
-                    states_to_prune.add(state)
+    def _prune_states(
+        self, states_to_prune: Set[int], removed_arcs: List[FstArc]
+    ) -> Set[int]:
+        """Remove states and arcs into them.
 
-            if not states_to_prune:
-                break
+        Returns the remaining states left without arcs (new dead ends).
+        """
+        self.states.difference_update(states_to_prune)
+        for state in states_to_prune:
+            removed_arcs.extend(self.arcs.pop(state, []))
 
-            self.states.difference_update(states_to_prune)
+        new_dead_ends: Set[int] = set()
+        for state, arcs in self.arcs.items():
+            for arc in arcs:
+                if arc.to_state in states_to_prune:
+                    break
+            else:
+                # No arcs into pruned states
+                continue
 
-            # Prune outgoing arcs
-            for state in states_to_prune:
-                self.arcs.pop(state, None)
+            kept_arcs = []
+            for arc in arcs:
+                if arc.to_state in states_to_prune:
+                    removed_arcs.append(arc)
+                else:
+                    kept_arcs.append(arc)
 
-            # Prune incoming arcs
-            for state in self.states:
-                needs_pruning = any(
-                    arc.to_state in states_to_prune for arc in self.arcs[state]
-                )
-                if needs_pruning:
-                    self.arcs[state] = [
-                        arc
-                        for arc in self.arcs[state]
-                        if arc.to_state not in states_to_prune
-                    ]
+            self.arcs[state] = kept_arcs
+            if (not kept_arcs) and (state not in self.final_states):
+                new_dead_ends.add(state)
+
+        return new_dead_ends
 
     def to_strings(self, add_spaces: bool) -> List[str]:
         strings: List[str] = []
@@ -366,6 +637,256 @@ class Fst:
             tokens.append(path)
 
 
+class CompactFst:
+    """Array-backed FST with interned symbol ids.
+
+    Arcs are stored in parallel typed arrays instead of FstArc objects, which
+    uses far less memory for large grammars. Supports the same construction and
+    writing API as Fst, but not the grammar transformations (remove_spaces,
+    prune, etc.).
+    """
+
+    __slots__ = (
+        "symbols",
+        "symbol_ids",
+        "from_states",
+        "to_states",
+        "in_labels",
+        "out_labels",
+        "log_probs",
+        "final_states",
+        "start",
+        "current_state",
+        "_states",
+        "_words",
+        "_output_words",
+    )
+
+    def __init__(self) -> None:
+        self.symbols: List[str] = [EPS]
+        self.symbol_ids: Dict[str, int] = {EPS: 0}
+
+        self.from_states = array("i")
+        self.to_states = array("i")
+        self.in_labels = array("i")
+        self.out_labels = array("i")
+        self.log_probs = array("d")  # nan = no weight
+
+        self.final_states: Set[int] = set()
+        self.start = 0
+        self.current_state = 0
+
+        # Computed on first access and cleared when arcs or final states change
+        self._states: Optional[FrozenSet[int]] = None
+        self._words: Optional[FrozenSet[str]] = None
+        self._output_words: Optional[FrozenSet[str]] = None
+
+    @property
+    def states(self) -> FrozenSet[int]:
+        if self._states is None:
+            self._states = frozenset(
+                itertools.chain(self.from_states, self.to_states, self.final_states)
+            )
+
+        if self.start not in self._states:
+            return self._states.union((self.start,))
+
+        return self._states
+
+    @property
+    def words(self) -> FrozenSet[str]:
+        if self._words is None:
+            self._words = frozenset(
+                self.symbols[i] for i in set(self.in_labels) if i != 0
+            )
+
+        return self._words
+
+    @property
+    def output_words(self) -> FrozenSet[str]:
+        if self._output_words is None:
+            self._output_words = frozenset(
+                self.symbols[i] for i in set(self.out_labels) if i != 0
+            )
+
+        return self._output_words
+
+    @property
+    def num_arcs(self) -> int:
+        return len(self.from_states)
+
+    @property
+    def num_states(self) -> int:
+        """Number of states in OpenFST's vector format (highest state + 1)."""
+        return max(self.states, default=-1) + 1
+
+    def symbol_id(self, symbol: str) -> int:
+        """Get id of a symbol, interning it if necessary."""
+        symbol_id = self.symbol_ids.get(symbol)
+        if symbol_id is None:
+            if not symbol:
+                raise ValueError("Labels cannot be empty")
+
+            if " " in symbol:
+                raise ValueError(f"Cannot have white space in labels: {symbol}")
+
+            symbol_id = len(self.symbols)
+            self.symbols.append(symbol)
+            self.symbol_ids[symbol] = symbol_id
+
+        return symbol_id
+
+    def next_state(self) -> int:
+        self.current_state += 1
+        return self.current_state
+
+    def next_edge(
+        self,
+        from_state: int,
+        in_label: Optional[str] = None,
+        out_label: Optional[str] = None,
+        log_prob: Optional[float] = None,
+    ) -> int:
+        to_state = self.next_state()
+        self.add_edge(from_state, to_state, in_label, out_label, log_prob)
+        return to_state
+
+    def add_edge(
+        self,
+        from_state: int,
+        to_state: int,
+        in_label: Optional[str] = None,
+        out_label: Optional[str] = None,
+        log_prob: Optional[float] = None,
+    ) -> None:
+        if in_label is None:
+            in_label = EPS
+
+        if out_label is None:
+            out_label = in_label
+
+        # Intern labels first so a rejected label doesn't misalign the arrays
+        in_label_id = self.symbol_id(in_label)
+        out_label_id = self.symbol_id(out_label)
+
+        self.from_states.append(from_state)
+        self.to_states.append(to_state)
+        self.in_labels.append(in_label_id)
+        self.out_labels.append(out_label_id)
+        self.log_probs.append(math.nan if log_prob is None else log_prob)
+
+        self._states = None
+        self._words = None
+        self._output_words = None
+
+    def accept(self, state: int) -> None:
+        self.final_states.add(state)
+        self._states = None
+
+    def write(self, fst_file: TextIO, symbols_file: Optional[TextIO] = None) -> None:
+        """Write arcs in the order they were added, then final states."""
+        symbols = self.symbols
+        for from_state, to_state, in_label, out_label, log_prob in zip(
+            self.from_states,
+            self.to_states,
+            self.in_labels,
+            self.out_labels,
+            self.log_probs,
+        ):
+            if math.isnan(log_prob):
+                print(
+                    from_state,
+                    to_state,
+                    symbols[in_label],
+                    symbols[out_label],
+                    file=fst_file,
+                )
+            else:
+                print(
+                    from_state,
+                    to_state,
+                    symbols[in_label],
+                    symbols[out_label],
+                    log_prob,
+                    file=fst_file,
+                )
+
+        for state in self.final_states:
+            print(state, file=fst_file)
+
+        if symbols_file is not None:
+            for symbol_id, symbol in enumerate(symbols):
+                print(symbol, symbol_id, file=symbols_file)
+
+    def vector_arcs(
+        self,
+        isymbols: SymbolTable,
+        osymbols: SymbolTable,
+        project_input: bool = False,
+    ) -> Iterator[Tuple[int, List[VectorArc]]]:
+        """Yield arcs grouped by state in increasing order, with label ids."""
+        in_ids = {
+            label: isymbols.get_id(self.symbols[label]) for label in set(self.in_labels)
+        }
+        if project_input:
+            out_ids = in_ids
+            out_labels = self.in_labels
+        else:
+            out_ids = {
+                label: osymbols.get_id(self.symbols[label])
+                for label in set(self.out_labels)
+            }
+            out_labels = self.out_labels
+
+        arc_order = sorted(
+            range(len(self.from_states)), key=self.from_states.__getitem__
+        )
+        for state, arc_idxs in itertools.groupby(
+            arc_order, key=self.from_states.__getitem__
+        ):
+            yield state, [
+                (
+                    in_ids[self.in_labels[arc_idx]],
+                    out_ids[out_labels[arc_idx]],
+                    (
+                        0.0
+                        if math.isnan(self.log_probs[arc_idx])
+                        else self.log_probs[arc_idx]
+                    ),
+                    self.to_states[arc_idx],
+                )
+                for arc_idx in arc_idxs
+            ]
+
+    def write_binary(
+        self,
+        fst_file: BinaryIO,
+        isymbols: SymbolTable,
+        osymbols: Optional[SymbolTable] = None,
+        keep_symbols: bool = False,
+        project_input: bool = False,
+    ) -> None:
+        """Write in OpenFST's binary vector format, like fstcompile.
+
+        Labels are mapped to ids using the symbol tables, which are also stored
+        in the FST if keep_symbols is True. If project_input is True, output
+        labels are replaced by input labels (like fstproject).
+        """
+        if osymbols is None:
+            osymbols = isymbols
+
+        write_vector_fst(
+            fst_file,
+            start=self.start,
+            num_states=self.num_states,
+            num_arcs=self.num_arcs,
+            final_states=self.final_states,
+            state_arcs=self.vector_arcs(isymbols, osymbols, project_input),
+            isymbols=isymbols if keep_symbols else None,
+            osymbols=osymbols if keep_symbols else None,
+        )
+
+
 @dataclass
 class NumToWords:
     engine: RbnfEngine
@@ -385,6 +906,58 @@ class ExpressionWithOutput:
     list_name: Optional[str] = None
 
 
+ListValues = List[Union[Expression, ExpressionWithOutput]]
+
+
+@dataclass
+class ListCache:
+    """Expanded slot lists, shared by every reference with the same context.
+
+    Filtering values by context and splitting/looking up their words is done
+    once per list, and the resulting fragment is copied into each reference.
+    """
+
+    values: Dict[Tuple[int, str, str], Tuple[ListValues, Tuple[int, ...]]] = field(
+        default_factory=dict
+    )
+    fragments: Dict[
+        Tuple[int, str, str, Optional[int], Optional[int]], Tuple[Fst, Optional[int]]
+    ] = field(default_factory=dict)
+    has_references: Dict[int, bool] = field(default_factory=dict)
+    """List id -> True if any value contains a <rule> or {list}."""
+
+
+@dataclass
+class ClassLists:
+    """Lists replaced by nonterminal class labels in a template grammar.
+
+    Each distinct set of (context-filtered) list values gets its own label.
+    """
+
+    list_names: Set[str]
+    labels: Dict[Tuple[str, Tuple[int, ...]], str] = field(default_factory=dict)
+    values: Dict[str, ListValues] = field(default_factory=dict)
+    intent_data: Dict[str, IntentData] = field(default_factory=dict)
+
+    def get_label(
+        self,
+        list_name: str,
+        value_indexes: Tuple[int, ...],
+        values: ListValues,
+        intent_data: IntentData,
+    ) -> str:
+        """Get nonterminal label for a set of list values."""
+        key = (list_name, value_indexes)
+        label = self.labels.get(key)
+        if label is None:
+            label = f"{CLASS_PREFIX}{list_name}:{len(self.labels)}"
+            self.labels[key] = label
+            self.values[label] = values
+            self.intent_data[label] = intent_data
+
+        return label
+
+
 def expression_to_fst(
     expression: Union[Expression, ExpressionWithOutput],
     state: int,
@@ -395,6 +968,8 @@ def expression_to_fst(
     num_to_words: Optional[NumToWords] = None,
     g2p_info: Optional[G2PInfo] = None,
     suppress_output: bool = False,
+    class_lists: Optional[ClassLists] = None,
+    list_cache: Optional[ListCache] = None,
 ) -> Optional[int]:
     if isinstance(expression, ExpressionWithOutput):
         exp_output: ExpressionWithOutput = expression
@@ -416,6 +991,8 @@ def expression_to_fst(
             num_to_words,
             g2p_info,
             suppress_output=suppress_output,
+            class_lists=class_lists,
+            list_cache=list_cache,
         )
         if maybe_state is None:
             # Dead branch
@@ -495,6 +1072,8 @@ def expression_to_fst(
                     slot_lists,
                     num_to_words,
                     g2p_info,
+                    class_lists=class_lists,
+                    list_cache=list_cache,
                 )
                 if maybe_state is None:
                     # Dead branch
@@ -523,6 +1102,8 @@ def expression_to_fst(
                     slot_lists,
                     num_to_words,
                     g2p_info,
+                    class_lists=class_lists,
+                    list_cache=list_cache,
                 )
 
                 if maybe_state is None:
@@ -549,6 +1130,8 @@ def expression_to_fst(
                 slot_lists,
                 num_to_words,
                 g2p_info,
+                class_lists=class_lists,
+                list_cache=list_cache,
             )
 
         raise ValueError(f"Unexpected group type: {grp}")
@@ -570,57 +1153,97 @@ def expression_to_fst(
         if isinstance(slot_list, TextSlotList):
             text_list: TextSlotList = slot_list
 
-            values: List[Union[Expression, ExpressionWithOutput]] = []
-            for value in text_list.values:
-                if (intent_data.requires_context is not None) and (
-                    not check_required_context(
-                        intent_data.requires_context,
-                        value.context,
-                        allow_missing_keys=True,
-                    )
-                ):
-                    continue
-
-                if (intent_data.excludes_context is not None) and (
-                    not check_excluded_context(
-                        intent_data.excludes_context,
-                        value.context,
-                    )
-                ):
-                    continue
-
-                value_output_text: Optional[str] = None
-                if isinstance(value.text_in, TextChunk):
-                    value_chunk: TextChunk = value.text_in
-                    value_output_text = value_chunk.text
-                elif value.value_out is not None:
-                    value_output_text = str(value.value_out)
-
-                if value_output_text:
-                    values.append(
-                        ExpressionWithOutput(
-                            value.text_in,
-                            output_text=value_output_text,
-                            list_name=list_ref.slot_name,
-                        )
-                    )
-                else:
-                    values.append(value.text_in)
+            # Lists are shared by every reference with the same slot name and
+            # context requirements.
+            list_key = (
+                id(text_list),
+                list_ref.slot_name,
+                _get_context_key(intent_data),
+            )
+            cached_values = (
+                list_cache.values.get(list_key) if list_cache is not None else None
+            )
+            if cached_values is None:
+                cached_values = _filter_list_values(text_list, list_ref, intent_data)
+                if list_cache is not None:
+                    list_cache.values[list_key] = cached_values
 
+            values, value_indexes = cached_values
             if not values:
                 # Dead branch
                 return None
 
-            return expression_to_fst(
-                Alternative(values),  # type: ignore[arg-type]
-                state,
-                fst,
-                intent_data,
-                intents,
-                slot_lists,
-                num_to_words,
-                g2p_info,
+            if (class_lists is not None) and (
+                list_ref.list_name in class_lists.list_names
+            ):
+                # Nonterminal that will be replaced by a sub-grammar.
+                # Like list values, it is not surrounded by spaces, so any
+                # adjacent text is merged into the same word ("{name}'s").
+                class_label = class_lists.get_label(
+                    list_ref.list_name, value_indexes, values, intent_data
+                )
+                return fst.next_edge(state, class_label)
+
+            if list_cache is None:
+                return expression_to_fst(
+                    Alternative(values),  # type: ignore[arg-type]
+                    state,
+                    fst,
+                    intent_data,
+                    intents,
+                    slot_lists,
+                    num_to_words,
+                    g2p_info,
+                    class_lists=class_lists,
+                )
+
+            # Values with <rule> or {list} references are expanded with the
+            # intent's local rules and lists, so they can't be shared with
+            # intents that define their own.
+            has_references = list_cache.has_references.get(id(text_list))
+            if has_references is None:
+                has_references = any(
+                    _has_references(value.text_in) for value in text_list.values
+                )
+                list_cache.has_references[id(text_list)] = has_references
+
+            fragment_key = (
+                *list_key,
+                (
+                    id(intent_data.expansion_rules)
+                    if (has_references and intent_data.expansion_rules)
+                    else None
+                ),
+                (
+                    id(intent_data.slot_lists)
+                    if (has_references and intent_data.slot_lists)
+                    else None
+                ),
             )
+            fragment_info = list_cache.fragments.get(fragment_key)
+            if fragment_info is None:
+                fragment = Fst()
+                fragment_end = expression_to_fst(
+                    Alternative(values),  # type: ignore[arg-type]
+                    fragment.start,
+                    fragment,
+                    intent_data,
+                    intents,
+                    slot_lists,
+                    num_to_words,
+                    g2p_info,
+                    class_lists=class_lists,
+                    list_cache=list_cache,
+                )
+                fragment_info = (fragment, fragment_end)
+                list_cache.fragments[fragment_key] = fragment_info
+
+            fragment, fragment_end = fragment_info
+            if fragment_end is None:
+                # Dead branch
+                return None
+
+            return fst.insert(fragment, state, fragment_end)
 
         if isinstance(slot_list, RangeSlotList):
             range_list: RangeSlotList = slot_list
@@ -669,6 +1292,8 @@ def expression_to_fst(
                 slot_lists,
                 num_to_words,
                 g2p_info,
+                class_lists=class_lists,
+                list_cache=list_cache,
             )
 
         # Will be pruned
@@ -698,11 +1323,83 @@ def expression_to_fst(
             slot_lists,
             num_to_words,
             g2p_info,
+            class_lists=class_lists,
+            list_cache=list_cache,
         )
 
     return state
 
 
+def _filter_list_values(
+    text_list: TextSlotList, list_ref: ListReference, intent_data: IntentData
+) -> Tuple[ListValues, Tuple[int, ...]]:
+    """Get list values allowed by the intent's context requirements."""
+    values: ListValues = []
+    value_indexes: List[int] = []
+    for value_idx, value in enumerate(text_list.values):
+        if (intent_data.requires_context is not None) and (
+            not check_required_context(
+                intent_data.requires_context,
+                value.context,
+                allow_missing_keys=True,
+            )
+        ):
+            continue
+
+        if (intent_data.excludes_context is not None) and (
+            not check_excluded_context(
+                intent_data.excludes_context,
+                value.context,
+            )
+        ):
+            continue
+
+        value_output_text: Optional[str] = None
+        if isinstance(value.text_in, TextChunk):
+            value_chunk: TextChunk = value.text_in
+            value_output_text = value_chunk.text
+        elif value.value_out is not None:
+            value_output_text = str(value.value_out)
+
+        if value_output_text:
+            values.append(
+                ExpressionWithOutput(
+                    value.text_in,
+                    output_text=value_output_text,
+                    list_name=list_ref.slot_name,
+                )
+            )
+        else:
+            values.append(value.text_in)
+
+        value_indexes.append(value_idx)
+
+    return values, tuple(value_indexes)
+
+
+def _has_references(expression: Union[Expression, Sentence]) -> bool:
+    """True if expression contains a <rule> or {list} reference."""
+    if isinstance(expression, (RuleReference, ListReference)):
+        return True
+
+    if isinstance(expression, Sentence):
+        return _has_references(expression.expression)
+
+    if isinstance(expression, Group):
+        return any(_has_references(item) for item in expression.items)
+
+    return False
+
+
+def _get_context_key(intent_data: IntentData) -> str:
+    """Get a key for the context requirements of intent data."""
+    return json.dumps(
+        [intent_data.requires_context, intent_data.excludes_context],
+        sort_keys=True,
+        default=str,
+    )
+
+
 def get_count(
     e: Expression,
     intents: Intents,
@@ -786,6 +1483,7 @@ def intents_to_fst(
     include_intents: Optional[Set[str]] = None,
     g2p_info: Optional[G2PInfo] = None,
     normalize_probabilities: bool = False,
+    class_lists: Optional[ClassLists] = None,
 ) -> Fst:
     num_to_words: Optional[NumToWords] = None
     if number_language:
@@ -829,6 +1527,7 @@ def intents_to_fst(
 
     fst_with_spaces = Fst()
     final = fst_with_spaces.next_state()
+    list_cache = ListCache()
 
     for intent in filtered_intents:
         intent_logprob: Optional[float] = None
@@ -873,6 +1572,8 @@ def intents_to_fst(
                     num_to_words,
                     g2p_info,
                     suppress_output=(sentence_output is not None),
+                    class_lists=class_lists,
+                    list_cache=list_cache,
                 )
 
                 if state is None:
@@ -886,6 +1587,58 @@ def intents_to_fst(
     return fst_with_spaces
 
 
+def class_lists_to_fsts(
+    class_lists: ClassLists,
+    intents: Intents,
+    number_language: Optional[str] = None,
+    g2p_info: Optional[G2PInfo] = None,
+) -> Dict[str, Fst]:
+    """Create a sub-grammar for each nonterminal label in a template grammar.
+
+    Values are weighted uniformly, and the returned FSTs have spaces removed.
+    """
+    num_to_words: Optional[NumToWords] = None
+    if number_language:
+        try:
+            num_to_words = NumToWords(engine=RbnfEngine.for_language(number_language))
+        except ValueError:
+            _LOGGER.exception("Unable to convert numbers to words")
+
+    class_fsts: Dict[str, Fst] = {}
+    for label, values in class_lists.values.items():
+        # Same sign convention as intent probabilities in intents_to_fst
+        value_logprob: Optional[float] = None
+        value_prob = 1 / len(values)
+        if value_prob < 1:
+            value_logprob = math.log(value_prob)
+
+        fst_with_spaces = Fst()
+        final = fst_with_spaces.next_state()
+        value_start = fst_with_spaces.next_edge(
+            fst_with_spaces.start, log_prob=value_logprob
+        )
+        value_start = fst_with_spaces.next_edge(value_start, SPACE, SPACE)
+
+        state = expression_to_fst(
+            Alternative(values),  # type: ignore[arg-type]
+            value_start,
+            fst_with_spaces,
+            class_lists.intent_data[label],
+            intents,
+            num_to_words=num_to_words,
+            g2p_info=g2p_info,
+        )
+        if state is not None:
+            fst_with_spaces.add_edge(state, final, SPACE, SPACE)
+
+        fst_with_spaces.accept(final)
+        class_fst = fst_with_spaces.remove_spaces()
+        class_fst.prune()
+        class_fsts[label] = class_fst
+
+    return class_fsts
+
+
 def decode_meta(text: str) -> str:
     slots: Dict[str, str] = {}
 
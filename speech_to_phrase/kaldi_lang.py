@@ -0,0 +1,519 @@
+"""Python version of Kaldi's prepare_lang.sh.
+
+Only the default options are supported: word-position dependent phones, a
+silence probability of 0.5, and non-shared silence phones.
+
+Updates are append-only: words keep their ids in words.txt, and new words get
+the next ids. Lexicon entries are added to L.fst and L_disambig.fst in word id
+order, so the states and arcs of existing words stay the same and new words
+are added after them. Grammars over the existing words don't change when words
+are added. Files whose contents are unchanged are not rewritten.
+"""
+
+import io
+import logging
+import math
+from collections import defaultdict
+from collections.abc import Iterable
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .const import EPS, UNK
+from .openfst import OLABEL_SORTED, SymbolTable, VectorArc, write_vector_fst
+
+_LOGGER = logging.getLogger(__name__)
+
+WORD_DISAMBIG = "#0"
+BOS = "<s>"
+EOS = "</s>"
+
+_NONSILENCE_SUFFIXES = ("_B", "_E", "_I", "_S")
+_SILENCE_SUFFIXES = ("",) + _NONSILENCE_SUFFIXES
+_WORD_BOUNDARY = {"_B": "begin", "_E": "end", "_I": "internal", "_S": "singleton"}
+
+_NUM_NONSILENCE_STATES = 3
+_NUM_SILENCE_STATES = 5
+
+# (word, phones)
+LexiconEntry = Tuple[str, List[str]]
+
+
+def prepare_lang(
+    dict_dir: Path, lang_dir: Path, oov_word: str = UNK, sil_prob: float = 0.5
+) -> None:
+    """Create a Kaldi lang directory from a dict directory.
+
+    The dict directory must contain lexicon.txt, silence_phones.txt,
+    nonsilence_phones.txt, and optional_silence.txt (extra_questions.txt is
+    optional).
+    """
+    phones_dir = lang_dir / "phones"
+    phones_dir.mkdir(parents=True, exist_ok=True)
+
+    silence_lines = _read_lines(dict_dir / "silence_phones.txt")
+    nonsilence_lines = _read_lines(dict_dir / "nonsilence_phones.txt")
+    extra_question_lines = _read_lines(dict_dir / "extra_questions.txt")
+    optional_silence = _read_lines(dict_dir / "optional_silence.txt")[0][0]
+
+    # SIL -> SIL SIL_B SIL_E SIL_I SIL_S
+    # AA -> AA_B AA_E AA_I AA_S
+    phone_map: Dict[str, List[str]] = {}
+    for line in silence_lines:
+        for phone in line:
+            phone_map[phone] = [phone + suffix for suffix in _SILENCE_SUFFIXES]
+
+    for line in nonsilence_lines:
+        for phone in line:
+            phone_map[phone] = [phone + suffix for suffix in _NONSILENCE_SUFFIXES]
+
+    def map_line(line: Sequence[str]) -> List[str]:
+        return [mapped for phone in line for mapped in phone_map[phone]]
+
+    silence_phones = [p for line in silence_lines for p in map_line(line)]
+    nonsilence_phones = [p for line in nonsilence_lines for p in map_line(line)]
+
+    sets = [map_line(line) for line in silence_lines + nonsilence_lines]
+    extra_questions = [map_line(line) for line in extra_question_lines]
+
+    # Questions about word position
+    for suffix in _NONSILENCE_SUFFIXES:
+        extra_questions.append(
+            [phone + suffix for line in nonsilence_lines for phone in line]
+        )
+
+    for suffix in _SILENCE_SUFFIXES:
+        extra_questions.append(
+            [phone + suffix for line in silence_lines for phone in line]
+        )
+
+    # Lexicon with word-position dependent phones
+    lexicon: List[LexiconEntry] = []
+    for line in _read_lines(dict_dir / "lexicon.txt"):
+        if len(line) < 2:
+            _LOGGER.warning("Skipping lexicon entry without phones: %s", line)
+            continue
+
+        lexicon.append((line[0], _add_word_positions(line[1:])))
+
+    words = sorted({word for word, _phones in lexicon})
+    for reserved_word in (BOS, EOS):
+        if reserved_word in words:
+            raise ValueError(f"{reserved_word} is in the vocabulary")
+
+    word_symbols = SymbolTable(name=str(lang_dir / "words.txt"))
+    for word in get_word_order(words, _read_previous_words(lang_dir / "words.txt")):
+        word_symbols.ids[word] = len(word_symbols.ids)
+
+    # Existing words come first in the lexicon FSTs and disambiguation symbols
+    lexicon.sort(key=lambda entry: word_symbols.ids[entry[0]])
+    lexicon_disambig, max_disambig = add_lexicon_disambig(lexicon)
+
+    # One more for silence
+    num_disambig = max_disambig + 1
+    disambig_phones = [f"#{n}" for n in range(num_disambig + 1)]
+
+    phone_symbols = SymbolTable(name=str(lang_dir / "phones.txt"))
+    for phone in [EPS] + silence_phones + nonsilence_phones + disambig_phones:
+        phone_symbols.ids[phone] = len(phone_symbols.ids)
+
+    def phone_ids(phones: Iterable[str]) -> List[str]:
+        return [str(phone_symbols.get_id(phone)) for phone in phones]
+
+    _write_symbols(lang_dir / "phones.txt", phone_symbols)
+    _write_symbols(lang_dir / "words.txt", word_symbols)
+
+    # Phone lists
+    phone_lists = {
+        "silence": silence_phones,
+        "nonsilence": nonsilence_phones,
+        "optional_silence": [optional_silence],
+        "disambig": disambig_phones,
+        "context_indep": silence_phones,
+    }
+    for list_name, phones in phone_lists.items():
+        _write_lines(phones_dir / f"{list_name}.txt", ([p] for p in phones))
+        _write_lines(phones_dir / f"{list_name}.int", ([i] for i in phone_ids(phones)))
+        _write_lines(phones_dir / f"{list_name}.csl", [[":".join(phone_ids(phones))]])
+
+    for list_name, phone_lines in (
+        ("sets", sets),
+        ("extra_questions", extra_questions),
+    ):
+        _write_lines(phones_dir / f"{list_name}.txt", phone_lines)
+        _write_lines(
+            phones_dir / f"{list_name}.int", (phone_ids(line) for line in phone_lines)
+        )
+
+    _write_lines(phones_dir / "roots.txt", (["shared", "split"] + s for s in sets))
+    _write_lines(
+        phones_dir / "roots.int", (["shared", "split"] + phone_ids(s) for s in sets)
+    )
+
+    word_boundary = [
+        (phone, _WORD_BOUNDARY.get(phone[-2:], "nonword"))
+        for phone in silence_phones + nonsilence_phones
+    ]
+    _write_lines(phones_dir / "word_boundary.txt", word_boundary)
+    _write_lines(
+        phones_dir / "word_boundary.int",
+        ((phone_ids([phone])[0], position) for phone, position in word_boundary),
+    )
+
+    # Word-level disambiguation symbol passed through the lexicon
+    _write_lines(phones_dir / "wdisambig.txt", [[WORD_DISAMBIG]])
+    _write_lines(phones_dir / "wdisambig_phones.int", [phone_ids([WORD_DISAMBIG])])
+    _write_lines(
+        phones_dir / "wdisambig_words.int",
+        [[str(word_symbols.get_id(WORD_DISAMBIG))]],
+    )
+
+    # Optional silence isn't part of a word
+    align_lexicon = sorted(
+        {(word, word, *phones) for word, phones in lexicon}
+        | {(EPS, EPS, optional_silence)}
+    )
+    _write_lines(phones_dir / "align_lexicon.txt", align_lexicon)
+    _write_lines(
+        phones_dir / "align_lexicon.int",
+        (
+            [str(word_symbols.get_id(line[0])), str(word_symbols.get_id(line[1]))]
+            + phone_ids(line[2:])
+            for line in align_lexicon
+        ),
+    )
+
+    _write_lines(lang_dir / "oov.txt", [[oov_word]])
+    _write_lines(lang_dir / "oov.int", [[str(word_symbols.get_id(oov_word))]])
+
+    topo = _make_topo(phone_ids(nonsilence_phones), phone_ids(silence_phones))
+    _write_if_changed(lang_dir / "topo", topo.encode("utf-8"))
+
+    # Lexicon FSTs
+    _write_lexicon_fst(
+        lang_dir / "L.fst",
+        lexicon,
+        phone_symbols,
+        word_symbols,
+        optional_silence,
+        sil_prob,
+    )
+    _write_lexicon_fst(
+        lang_dir / "L_disambig.fst",
+        lexicon_disambig,
+        phone_symbols,
+        word_symbols,
+        optional_silence,
+        sil_prob,
+        sil_disambig=f"#{num_disambig}",
+        word_disambig=WORD_DISAMBIG,
+    )
+
+    validate_lang(lang_dir)
+
+
+def validate_lang(lang_dir: Path) -> None:
+    """Check that symbol tables and phone lists agree (like validate_lang.pl).
+
+    Only the consistency of the text files is checked, not the FSTs.
+    Raises ValueError if a check fails.
+    """
+    phones_dir = lang_dir / "phones"
+    word_ids = _read_contiguous_symbols(lang_dir / "words.txt")
+    phone_ids = _read_contiguous_symbols(lang_dir / "phones.txt")
+
+    for word in (WORD_DISAMBIG, BOS, EOS):
+        if word not in word_ids:
+            raise ValueError(f"Missing {word} in words.txt")
+
+    # Disambiguation symbols are #0, #1, ... at the end of phones.txt
+    disambig_phones = [line[0] for line in _read_lines(phones_dir / "disambig.txt")]
+    if disambig_phones != [f"#{n}" for n in range(len(disambig_phones))]:
+        raise ValueError(f"Disambiguation symbols are not #0..#N: {disambig_phones}")
+
+    if [phone_ids.get(phone) for phone in disambig_phones] != list(
+        range(len(phone_ids) - len(disambig_phones), len(phone_ids))
+    ):
+        raise ValueError("Disambiguation symbols are not at the end of phones.txt")
+
+    # Every phone is in exactly one of these lists
+    phone_lists = {
+        list_name: [line[0] for line in _read_lines(phones_dir / f"{list_name}.txt")]
+        for list_name in ("silence", "nonsilence", "disambig")
+    }
+    listed_phones = [phone for phones in phone_lists.values() for phone in phones]
+    if sorted(listed_phones) != sorted(set(phone_ids) - {EPS}):
+        raise ValueError(
+            "silence, nonsilence, and disambig phones must partition phones.txt"
+        )
+
+    # Integer versions must use the same ids as the symbol tables
+    for list_name, phones in phone_lists.items():
+        phone_int = [
+            int(line[0]) for line in _read_lines(phones_dir / f"{list_name}.int")
+        ]
+        if phone_int != [phone_ids[phone] for phone in phones]:
+            raise ValueError(f"phones/{list_name}.int doesn't match phones.txt")
+
+    for file_name, symbol_ids, symbol in (
+        ("wdisambig_words.int", word_ids, WORD_DISAMBIG),
+        ("wdisambig_phones.int", phone_ids, WORD_DISAMBIG),
+    ):
+        if _read_lines(phones_dir / file_name) != [[str(symbol_ids[symbol])]]:
+            raise ValueError(f"phones/{file_name} doesn't match {symbol}")
+
+    oov_word = _read_lines(lang_dir / "oov.txt")[0][0]
+    if _read_lines(lang_dir / "oov.int") != [[str(word_ids.get(oov_word))]]:
+        raise ValueError(f"oov.int doesn't match words.txt for {oov_word}")
+
+
+def get_word_order(words: Sequence[str], previous_words: Sequence[str]) -> List[str]:
+    """Get symbols of words.txt in id order, keeping the ids of previous words.
+
+    New words are appended in sorted order. Words that were removed keep
+    their ids unless they outnumber the current words, in which case all ids
+    are assigned again.
+    """
+    reserved_words = [EPS, WORD_DISAMBIG, BOS, EOS]
+    word_set = set(words)
+    previous_set = set(previous_words)
+    num_stale_words = len(previous_set - word_set - set(reserved_words))
+    if (not previous_set.issuperset(reserved_words)) or (
+        num_stale_words > len(word_set)
+    ):
+        # Renumber: <eps> words #0 <s> </s>
+        return [EPS] + sorted(word_set) + reserved_words[1:]
+
+    return list(previous_words) + sorted(word_set - previous_set)
+
+
+def add_lexicon_disambig(
+    lexicon: Sequence[LexiconEntry],
+) -> Tuple[List[LexiconEntry], int]:
+    """Add disambiguation symbols to pronunciations (like add_lex_disambig.pl).
+
+    Pronunciations that are shared by multiple words or are a prefix of
+    another pronunciation get a unique #n symbol at the end.
+
+    Returns the new lexicon and the largest disambiguation number used.
+    """
+    pron_counts: Dict[Tuple[str, ...], int] = defaultdict(int)
+    prefixes = set()
+    for _word, phones in lexicon:
+        pron = tuple(phones)
+        pron_counts[pron] += 1
+        for prefix_len in range(1, len(pron)):
+            prefixes.add(pron[:prefix_len])
+
+    max_disambig = 0
+    last_disambig: Dict[Tuple[str, ...], int] = {}
+    lexicon_disambig: List[LexiconEntry] = []
+    for word, phones in lexicon:
+        pron = tuple(phones)
+        if (pron not in prefixes) and (pron_counts[pron] < 2):
+            lexicon_disambig.append((word, list(phones)))
+            continue
+
+        disambig = last_disambig.get(pron, 0) + 1
+        last_disambig[pron] = disambig
+        max_disambig = max(max_disambig, disambig)
+        lexicon_disambig.append((word, list(phones) + [f"#{disambig}"]))
+
+    return lexicon_disambig, max_disambig
+
+
+# -----------------------------------------------------------------------------
+
+
+def _add_word_positions(phones: Sequence[str]) -> List[str]:
+    """Add _B, _I, _E, or _S suffixes to phones in a word."""
+    if len(phones) == 1:
+        return [f"{phones[0]}_S"]
+
+    return (
+        [f"{phones[0]}_B"]
+        + [f"{phone}_I" for phone in phones[1:-1]]
+        + [f"{phones[-1]}_E"]
+    )
+
+
+def _write_lexicon_fst(
+    fst_path: Path,
+    lexicon: Sequence[LexiconEntry],
+    phone_symbols: SymbolTable,
+    word_symbols: SymbolTable,
+    sil_phone: str,
+    sil_prob: float,
+    sil_disambig: Optional[str] = None,
+    word_disambig: Optional[str] = None,
+) -> None:
+    """Write lexicon FST with optional silence (like make_lexicon_fst.py).
+
+    If word_disambig is given, it's passed through with self loops (like
+    fstaddselfloops).
+    """
+    sil_cost = -math.log(sil_prob)
+    no_sil_cost = -math.log(1.0 - sil_prob)
+
+    start_state = 0
+    loop_state = 1  # words enter and leave from here
+    sil_state = 2  # words followed by silence end here
+    state_arcs: List[List[VectorArc]] = [[], [], []]
+
+    def add_state() -> int:
+        state_arcs.append([])
+        return len(state_arcs) - 1
+
+    sil_id = phone_symbols.get_id(sil_phone)
+    state_arcs[start_state].append((0, 0, no_sil_cost, loop_state))
+    state_arcs[start_state].append((0, 0, sil_cost, sil_state))
+    if sil_disambig is None:
+        state_arcs[sil_state].append((sil_id, 0, 0.0, loop_state))
+    else:
+        sil_disambig_state = add_state()
+        state_arcs[sil_state].append((sil_id, 0, 0.0, sil_disambig_state))
+        state_arcs[sil_disambig_state].append(
+            (phone_symbols.get_id(sil_disambig), 0, 0.0, loop_state)
+        )
+
+    for word, phones in lexicon:
+        word_id = word_symbols.get_id(word)
+        phone_ids = [phone_symbols.get_id(phone) for phone in phones]
+
+        state = loop_state
+        for phone_idx, phone_id in enumerate(phone_ids[:-1]):
+            next_state = add_state()
+            state_arcs[state].append(
+                (phone_id, word_id if phone_idx == 0 else 0, 0.0, next_state)
+            )
+            state = next_state
+
+        last_label = word_id if len(phone_ids) == 1 else 0
+        state_arcs[state].append((phone_ids[-1], last_label, no_sil_cost, loop_state))
+        state_arcs[state].append((phone_ids[-1], last_label, sil_cost, sil_state))
+
+    if word_disambig is not None:
+        # Self loops on final states and states with word outputs
+        disambig_phone_id = phone_symbols.get_id(word_disambig)
+        disambig_word_id = word_symbols.get_id(word_disambig)
+        for state, arcs in enumerate(state_arcs):
+            if (state == loop_state) or any(arc[1] != 0 for arc in arcs):
+                arcs.append((disambig_phone_id, disambig_word_id, 0.0, state))
+
+    for arcs in state_arcs:
+        arcs.sort(key=lambda arc: arc[1])
+
+    with io.BytesIO() as fst_file:
+        write_vector_fst(
+            fst_file,
+            start=start_state,
+            num_states=len(state_arcs),
+            num_arcs=sum(len(arcs) for arcs in state_arcs),
+            final_states={loop_state},
+            state_arcs=enumerate(state_arcs),
+            properties=OLABEL_SORTED,
+        )
+        _write_if_changed(fst_path, fst_file.getvalue())
+
+
+def _make_topo(nonsilence_ids: Sequence[str], silence_ids: Sequence[str]) -> str:
+    """HMM topology for phones (like gen_topo.pl)."""
+    lines = ["<Topology>", "<TopologyEntry>", "<ForPhones>"]
+    lines.append(" ".join(nonsilence_ids))
+    lines.append("</ForPhones>")
+    for state in range(_NUM_NONSILENCE_STATES):
+        lines.append(
+            f"<State> {state} <PdfClass> {state} "
+            f"<Transition> {state} 0.75 <Transition> {state + 1} 0.25 </State>"
+        )
+
+    lines.append(f"<State> {_NUM_NONSILENCE_STATES} </State>")
+    lines.append("</TopologyEntry>")
+
+    # Silence states are fully connected, except for the first and last
+    last_state = _NUM_SILENCE_STATES - 1
+    prob = 1.0 / last_state
+    lines.extend(["<TopologyEntry>", "<ForPhones>", " ".join(silence_ids)])
+    lines.append("</ForPhones>")
+    lines.append(
+        "<State> 0 <PdfClass> 0 "
+        + "".join(f"<Transition> {s} {prob} " for s in range(last_state))
+        + "</State>"
+    )
+    for state in range(1, last_state):
+        lines.append(
+            f"<State> {state} <PdfClass> {state} "
+            + "".join(f"<Transition> {s} {prob} " for s in range(1, last_state + 1))
+            + "</State>"
+        )
+
+    lines.append(
+        f"<State> {last_state} <PdfClass> {last_state} "
+        f"<Transition> {last_state} 0.75 "
+        f"<Transition> {_NUM_SILENCE_STATES} 0.25 </State>"
+    )
+    lines.append(f"<State> {_NUM_SILENCE_STATES} </State>")
+    lines.extend(["</TopologyEntry>", "</Topology>"])
+
+    return "\n".join(lines) + "\n"
+
+
+def _read_lines(path: Path) -> List[List[str]]:
+    """Read whitespace-separated fields from non-empty lines."""
+    if not path.is_file():
+        return []
+
+    with open(path, "r", encoding="utf-8") as text_file:
+        return [parts for line in text_file if (parts := line.split())]
+
+
+def _read_previous_words(words_path: Path) -> List[str]:
+    """Read words.txt from a previous run in id order, or nothing if invalid."""
+    if not words_path.is_file():
+        return []
+
+    try:
+        return list(_read_contiguous_symbols(words_path))
+    except ValueError:
+        _LOGGER.warning("Assigning new word ids. Invalid %s", words_path)
+
+    return []
+
+
+def _read_contiguous_symbols(path: Path) -> Dict[str, int]:
+    """Read symbol table whose ids are 0, 1, ... with <eps> = 0."""
+    symbol_ids: Dict[str, int] = {}
+    for expected_id, line in enumerate(_read_lines(path)):
+        if (len(line) != 2) or (line[1] != str(expected_id)):
+            raise ValueError(f"Expected id {expected_id} in {path}: {line}")
+
+        if line[0] in symbol_ids:
+            raise ValueError(f"Duplicate symbol in {path}: {line[0]}")
+
+        symbol_ids[line[0]] = expected_id
+
+    if symbol_ids.get(EPS) != 0:
+        raise ValueError(f"{EPS} must be 0 in {path}")
+
+    return symbol_ids
+
+
+def _write_symbols(path: Path, symbols: SymbolTable) -> None:
+    _write_lines(
+        path, ((symbol, str(symbol_id)) for symbol, symbol_id in symbols.ids.items())
+    )
+
+
+def _write_lines(path: Path, lines: Iterable[Sequence[str]]) -> None:
+    _write_if_changed(
+        path, "".join(" ".join(line) + "\n" for line in lines).encode("utf-8")
+    )
+
+
+def _write_if_changed(path: Path, data: bytes) -> bool:
+    """Write file only if its contents are different."""
+    if path.is_file() and (path.stat().st_size == len(data)):
+        if path.read_bytes() == data:
+            return False
+
+    path.write_bytes(data)
+    return True
@@ -51,6 +51,9 @@ class Model:
 
     # Shared
     arpa_method: str = "kneser_ney"
+    ngram_order: int = 3
+    ngram_prune_theta: Optional[float] = None
+    """Threshold for relative entropy pruning of the n-gram model."""
 
 
 MODELS: Dict[str, Model] = {
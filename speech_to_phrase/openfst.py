@@ -0,0 +1,182 @@
+"""Binary serialization of FSTs in OpenFST's vector format.
+
+Writing FSTs directly avoids printing a text FST and re-parsing it with
+fstcompile.
+"""
+
+import itertools
+import math
+import struct
+from collections.abc import Container, Iterable, Sequence
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Optional, Tuple, Union
+
+# (input label id, output label id, weight, next state)
+VectorArc = Tuple[int, int, float, int]
+
+ILABEL_SORTED = 0x10000000
+"""Property bit for FSTs whose arcs are sorted by input label."""
+
+OLABEL_SORTED = 0x40000000
+"""Property bit for FSTs whose arcs are sorted by output label."""
+
+_FST_MAGIC = 2125659606
+_SYMBOL_TABLE_MAGIC = 2125658996
+_VECTOR_FST_VERSION = 2
+_HAS_ISYMBOLS = 0x1
+_HAS_OSYMBOLS = 0x2
+_EXPANDED = 0x1
+_MUTABLE = 0x2
+
+_WEIGHT_ONE = 0.0
+_WEIGHT_ZERO = math.inf
+
+_INT32 = struct.Struct("<i")
+_INT64 = struct.Struct("<q")
+_HEADER = struct.Struct("<iiQqqq")
+_STATE = struct.Struct("<fq")
+_ARC = struct.Struct("<iifi")
+
+_BUFFER_SIZE = 1 << 16
+
+
+@dataclass
+class SymbolTable:
+    """Mapping from symbols to integer ids."""
+
+    name: str
+    ids: Dict[str, int] = field(default_factory=dict)
+
+    @staticmethod
+    def load(symbols_path: Union[str, Path]) -> "SymbolTable":
+        """Load text symbol table (e.g., words.txt).
+
+        Like OpenFST, the first id of a duplicated symbol is kept.
+        """
+        symbol_table = SymbolTable(name=str(symbols_path))
+        with open(symbols_path, "r", encoding="utf-8") as symbols_file:
+            for line in symbols_file:
+                parts = line.split()
+                if len(parts) != 2:
+                    continue
+
+                symbol_table.ids.setdefault(parts[0], int(parts[1]))
+
+        return symbol_table
+
+    def get_id(self, symbol: str) -> int:
+        """Get id of symbol, raising ValueError if it's missing."""
+        symbol_id = self.ids.get(symbol)
+        if symbol_id is None:
+            raise ValueError(f"Symbol is not in {self.name}: {symbol}")
+
+        return symbol_id
+
+    def subset(self, symbols: Iterable[str]) -> "SymbolTable":
+        """Copy with only some symbols, keeping their ids and order."""
+        symbols = set(symbols)
+        return SymbolTable(
+            name=self.name,
+            ids={
+                symbol: symbol_id
+                for symbol, symbol_id in self.ids.items()
+                if symbol in symbols
+            },
+        )
+
+    def write(self, fst_file: BinaryIO) -> None:
+        """Write in OpenFST's binary symbol table format."""
+        parts: List[bytes] = [
+            _INT32.pack(_SYMBOL_TABLE_MAGIC),
+            _pack_string(self.name),
+            _INT64.pack(max(self.ids.values(), default=-1) + 1),
+            _INT64.pack(len(self.ids)),
+        ]
+        for symbol, symbol_id in self.ids.items():
+            parts.append(_pack_string(symbol))
+            parts.append(_INT64.pack(symbol_id))
+
+        fst_file.write(b"".join(parts))
+
+
+def write_vector_fst(
+    fst_file: BinaryIO,
+    start: int,
+    num_states: int,
+    num_arcs: int,
+    final_states: Container[int],
+    state_arcs: Iterable[Tuple[int, Sequence[VectorArc]]],
+    isymbols: Optional[SymbolTable] = None,
+    osymbols: Optional[SymbolTable] = None,
+    properties: int = 0,
+) -> None:
+    """Write FST with tropical weights in OpenFST's binary vector format.
+
+    state_arcs must yield states in increasing order. States that aren't
+    yielded have no arcs. Final states have a weight of One.
+    """
+    flags = 0
+    if isymbols is not None:
+        flags |= _HAS_ISYMBOLS
+
+    if osymbols is not None:
+        flags |= _HAS_OSYMBOLS
+
+    fst_file.write(
+        b"".join(
+            (
+                _INT32.pack(_FST_MAGIC),
+                _pack_string("vector"),
+                _pack_string("standard"),
+                _HEADER.pack(
+                    _VECTOR_FST_VERSION,
+                    flags,
+                    properties | _EXPANDED | _MUTABLE,
+                    start,
+                    num_states,
+                    num_arcs,
+                ),
+            )
+        )
+    )
+
+    if isymbols is not None:
+        isymbols.write(fst_file)
+
+    if osymbols is not None:
+        osymbols.write(fst_file)
+
+    buffer: List[bytes] = []
+    next_state = 0
+    for state, arcs in itertools.chain(state_arcs, ((num_states, ()),)):
+        while next_state < state:
+            # State without arcs
+            buffer.append(
+                _STATE.pack(
+                    _WEIGHT_ONE if next_state in final_states else _WEIGHT_ZERO, 0
+                )
+            )
+            next_state += 1
+
+        if state >= num_states:
+            break
+
+        buffer.append(
+            _STATE.pack(
+                _WEIGHT_ONE if state in final_states else _WEIGHT_ZERO, len(arcs)
+            )
+        )
+        buffer.extend(_ARC.pack(*arc) for arc in arcs)
+        next_state = state + 1
+
+        if len(buffer) >= _BUFFER_SIZE:
+            fst_file.write(b"".join(buffer))
+            buffer.clear()
+
+    fst_file.write(b"".join(buffer))
+
+
+def _pack_string(value: str) -> bytes:
+    value_bytes = value.encode("utf-8")
+    return _INT32.pack(len(value_bytes)) + value_bytes
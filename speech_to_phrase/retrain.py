@@ -0,0 +1,192 @@
+"""Retraining when Home Assistant or sentences change."""
+
+import asyncio
+import hashlib
+import logging
+from functools import partial
+from typing import List, Optional
+
+from .const import Settings, State
+from .hass_api import HomeAssistantInfo, get_hass_info, watch_hass_changes
+from .models import DEFAULT_MODEL, Model, get_models_for_languages
+from .train import train
+from .worker_pool import WorkerPool
+
+_LOGGER = logging.getLogger(__name__)
+
+_HASS_RECONNECT_SECONDS = 30.0
+_SENTENCES_POLL_SECONDS = 5.0
+
+
+class RetrainCoordinator:
+    """Retrains models with the newest inputs.
+
+    Bursts of changes are debounced into a single retrain. Training with stale
+    inputs is cancelled (including its subprocesses) and restarted.
+    """
+
+    def __init__(self, state: State, debounce_seconds: float = 5.0) -> None:
+        self.state = state
+        self.debounce_seconds = debounce_seconds
+
+        self._inputs_hash: Optional[str] = None
+        self._retrain_task: Optional[asyncio.Task] = None
+
+    def request_retrain(self, reason: str) -> None:
+        """Retrain once no changes have arrived for debounce_seconds."""
+        _LOGGER.debug("Retrain requested: %s", reason)
+        if self._retrain_task is not None:
+            # Restart debounce
+            self._retrain_task.cancel()
+
+        self._retrain_task = asyncio.create_task(self._retrain_after_debounce())
+
+    async def retrain(self, force_retrain: bool = False) -> None:
+        """Retrain all models that match HA's language or a pipeline language.
+
+        If the inputs have changed since the last retrain, any training that
+        is queued or running is cancelled first. Training that started before
+        the first retrain (e.g., for a client) isn't cancelled.
+        """
+        settings = self.state.settings
+        hass_info = await _get_hass_info(settings)
+        settings.default_language = hass_info.system_language
+
+        inputs_hash = _get_inputs_hash(settings, hass_info)
+        if (self._inputs_hash is not None) and (inputs_hash != self._inputs_hash):
+            for model_id in await self.state.train_scheduler.cancel_all():
+                _LOGGER.info("Cancelled training with stale inputs: %s", model_id)
+
+        self._inputs_hash = inputs_hash
+
+        for model in _get_models_to_train(hass_info):
+            # Models that are already queued or training are skipped
+            self.state.train_scheduler.schedule(
+                model.id,
+                partial(
+                    _train_model,
+                    model,
+                    settings,
+                    hass_info,
+                    force_retrain=force_retrain,
+                    worker_pool=self.state.train_scheduler.worker_pool,
+                ),
+            )
+
+    async def watch_hass(self) -> None:
+        """Retrain when entities, areas, etc. change in Home Assistant."""
+        settings = self.state.settings
+        while True:
+            try:
+                async for event_type in watch_hass_changes(
+                    token=settings.hass_token, uri=settings.hass_websocket_uri
+                ):
+                    self.request_retrain(event_type)
+            except Exception:  # pylint: disable=broad-exception-caught
+                _LOGGER.exception("Unexpected error watching Home Assistant")
+
+            await asyncio.sleep(_HASS_RECONNECT_SECONDS)
+
+    async def watch_sentences(self) -> None:
+        """Retrain when custom sentence files change."""
+        sentences_hash = _get_custom_sentences_hash(self.state.settings)
+        while True:
+            await asyncio.sleep(_SENTENCES_POLL_SECONDS)
+            new_sentences_hash = _get_custom_sentences_hash(self.state.settings)
+            if new_sentences_hash != sentences_hash:
+                sentences_hash = new_sentences_hash
+                self.request_retrain("custom sentences")
+
+    async def _retrain_after_debounce(self) -> None:
+        await asyncio.sleep(self.debounce_seconds)
+        try:
+            await self.retrain()
+        except Exception:  # pylint: disable=broad-exception-caught
+            _LOGGER.exception("Unexpected error while retraining")
+
+
+async def _get_hass_info(settings: Settings) -> HomeAssistantInfo:
+    """Get exposed things and languages from Home Assistant."""
+    _LOGGER.debug(
+        "Getting exposed things from Home Assistant (%s)", settings.hass_websocket_uri
+    )
+    hass_info = await get_hass_info(
+        token=settings.hass_token, uri=settings.hass_websocket_uri
+    )
+    _LOGGER.debug("HA system language: %s", hass_info.system_language)
+    if hass_info.pipeline_languages:
+        _LOGGER.debug("HA pipeline language(s): %s", hass_info.pipeline_languages)
+
+    things = hass_info.things
+    _LOGGER.debug(
+        "Got %s entities, %s area(s), %s floor(s), %s extra sentence(s)",
+        len(things.entities),
+        len(things.areas),
+        len(things.floors),
+        len(things.extra_sentences),
+    )
+
+    return hass_info
+
+
+def _get_models_to_train(hass_info: HomeAssistantInfo) -> List[Model]:
+    languages_to_train = list(hass_info.pipeline_languages) + [
+        hass_info.system_language
+    ]
+    models_to_train = get_models_for_languages(languages_to_train)
+    if not models_to_train:
+        # Fall back to English model
+        models_to_train = [DEFAULT_MODEL]
+
+    return models_to_train
+
+
+def _get_inputs_hash(settings: Settings, hass_info: HomeAssistantInfo) -> str:
+    """Hash of everything that training depends on that can change at runtime."""
+    hasher = hashlib.sha256()
+    hasher.update(hass_info.things.get_hash().encode("utf-8"))
+    hasher.update(hass_info.system_language.encode("utf-8"))
+    hasher.update(" ".join(sorted(hass_info.pipeline_languages)).encode("utf-8"))
+    hasher.update(_get_custom_sentences_hash(settings).encode("utf-8"))
+
+    return hasher.hexdigest()
+
+
+def _get_custom_sentences_hash(settings: Settings) -> str:
+    """Hash of the names, sizes, and modification times of custom sentences."""
+    hasher = hashlib.sha256()
+    for custom_sentences_dir in settings.custom_sentences_dirs:
+        for custom_sentences_path in sorted(custom_sentences_dir.glob("*/*.yaml")):
+            try:
+                stat = custom_sentences_path.stat()
+            except OSError:
+                # Deleted while listing
+                continue
+
+            hasher.update(
+                f"{custom_sentences_path} {stat.st_size} {stat.st_mtime_ns}\n".encode(
+                    "utf-8"
+                )
+            )
+
+    return hasher.hexdigest()
+
+
+async def _train_model(
+    model: Model,
+    settings: Settings,
+    hass_info: HomeAssistantInfo,
+    force_retrain: bool = False,
+    worker_pool: Optional[WorkerPool] = None,
+) -> None:
+    try:
+        await train(
+            model,
+            settings,
+            hass_info.things,
+            force_retrain=force_retrain,
+            worker_pool=worker_pool,
+        )
+    except Exception:
+        _LOGGER.exception("Unexpected error while training %s", model.id)
+        raise
@@ -4,12 +4,51 @@ import asyncio
 import logging
 import os
 import shlex
-from dataclasses import dataclass
+import shutil
+import signal
+import subprocess
+from collections.abc import Iterator
+from contextlib import contextmanager, suppress
+from contextvars import ContextVar
+from dataclasses import dataclass, replace
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Union
+from typing import IO, Any, Dict, List, Optional, Tuple, Union
 
 _LOGGER = logging.getLogger(__name__)
 
+_PROCESS_USAGES: ContextVar[Optional[List["ProcessUsage"]]] = ContextVar(
+    "process_usages", default=None
+)
+
+
+@dataclass
+class ProcessUsage:
+    """Resources used by a subprocess and the processes it waited for."""
+
+    cpu_seconds: float
+    """User + system time."""
+
+    max_rss_kb: int
+    """Peak resident set size of the largest process.
+
+    On Linux, this is at least the peak of the process that started it, which
+    the subprocess shares until it runs the command.
+    """
+
+
+@contextmanager
+def collect_process_usage() -> Iterator[List[ProcessUsage]]:
+    """Collect the usage of subprocesses started in this context.
+
+    Only subprocesses started by this task (or tasks it creates) are included.
+    """
+    usages: List[ProcessUsage] = []
+    token = _PROCESS_USAGES.set(usages)
+    try:
+        yield usages
+    finally:
+        _PROCESS_USAGES.reset(token)
+
 
 @dataclass
 class SpeechTools:
@@ -20,6 +59,12 @@ class SpeechTools:
     openfst_dir: Path
     opengrm_dir: Path
     phonetisaurus_bin: Path
+    niceness: int = 0
+    """Niceness added to subprocesses, which also get the lowest I/O priority."""
+
+    new_session: bool = False
+    """Run subprocesses in their own session, so cancelling kills the pipeline."""
+
     _extended_env: Optional[Dict[str, Any]] = None
 
     @staticmethod
@@ -33,6 +78,13 @@ class SpeechTools:
             phonetisaurus_bin=tools_dir / "phonetisaurus",
         )
 
+    def for_training(self, niceness: int) -> "SpeechTools":
+        """Copy of tools for training.
+
+        Subprocesses run at a lower priority and in their own session.
+        """
+        return replace(self, niceness=niceness, new_session=True)
+
     @property
     def egs_utils_dir(self):
         return self.kaldi_dir / "utils"
@@ -69,80 +121,104 @@ class SpeechTools:
 
         return self._extended_env
 
-    async def async_run(self, program: str, args: List[str], **kwargs):
-        if "env" not in kwargs:
-            kwargs["env"] = self.extended_env
+    @property
+    def priority_command(self) -> List[str]:
+        """Command prefix that lowers the CPU and I/O priority of a subprocess."""
+        if self.niceness <= 0:
+            return []
 
-        if "stderr" not in kwargs:
-            kwargs["stderr"] = asyncio.subprocess.PIPE
+        command = ["nice", "-n", str(self.niceness)]
+        if shutil.which("ionice"):
+            # Lowest priority in the best-effort class
+            command.extend(["ionice", "-c", "2", "-n", "7"])
 
+        return command
+
+    async def async_run(self, program: str, args: List[str], **kwargs):
         _LOGGER.debug("%s %s", program, args)
-        proc = await asyncio.create_subprocess_exec(
-            program,
-            *args,
-            stdout=asyncio.subprocess.PIPE,
-            **kwargs,
+        return await self._run(
+            [program, *args], f"{program} {args}", input=None, **kwargs
         )
-        stdout, stderr = await proc.communicate()
-        if proc.returncode != 0:
-            error_text = f"Unexpected error running command {program} {args}"
-            if stderr:
-                error_text += f": {stderr.decode()}"
-            elif stdout:
-                error_text += f": {stdout.decode()}"
-
-            raise RuntimeError(error_text)
-
-        return stdout
 
     async def async_run_shell(self, cmd: str, **kwargs) -> bytes:
-        if "env" not in kwargs:
-            kwargs["env"] = self.extended_env
-
-        if "stderr" not in kwargs:
-            kwargs["stderr"] = asyncio.subprocess.PIPE
-
         _LOGGER.debug(cmd)
-        proc = await asyncio.create_subprocess_shell(
-            cmd,
-            stdout=asyncio.subprocess.PIPE,
-            **kwargs,
-        )
-        stdout, stderr = await proc.communicate()
-        if proc.returncode != 0:
-            error_text = f"Unexpected error running command {cmd}"
-            if stderr:
-                error_text += f": {stderr.decode()}"
-            elif stdout:
-                error_text += f": {stdout.decode()}"
-
-            raise RuntimeError(error_text)
-
-        return stdout
+        return await self._run(cmd, cmd, input=None, **kwargs)
 
     async def async_run_pipeline(  # pylint: disable=redefined-builtin
         self, *commands: List[str], input: Optional[bytes] = None, **kwargs
     ) -> bytes:
-        if "env" not in kwargs:
-            kwargs["env"] = self.extended_env
-
-        if "stderr" not in kwargs:
-            kwargs["stderr"] = asyncio.subprocess.PIPE
-
         if input is not None:
             kwargs["stdin"] = asyncio.subprocess.PIPE
 
         command_str = " | ".join((shlex.join(c) for c in commands))
         _LOGGER.debug(command_str)
+        return await self._run(command_str, command_str, input=input, **kwargs)
+
+    async def _run(  # pylint: disable=redefined-builtin
+        self,
+        command: Union[str, List[str]],
+        command_desc: str,
+        input: Optional[bytes],
+        **kwargs,
+    ) -> bytes:
+        """Run a program (list) or shell command (str) and return its output.
 
-        proc = await asyncio.create_subprocess_shell(
-            command_str,
-            stdout=asyncio.subprocess.PIPE,
-            **kwargs,
-        )
-        stdout, stderr = await proc.communicate(input=input)
-        if proc.returncode != 0:
-            error_text = f"Unexpected error running command {command_str}"
+        If process usage is being collected, the command is reaped with
+        os.wait4 to get its resource usage.
+        """
+        if "env" not in kwargs:
+            kwargs["env"] = self.extended_env
+
+        if "stderr" not in kwargs:
+            kwargs["stderr"] = asyncio.subprocess.PIPE
+
+        usages = _PROCESS_USAGES.get()
+        if usages is not None:
+            if isinstance(command, str):
+                popen = subprocess.Popen(  # pylint: disable=consider-using-with
+                    self._with_priority(command),
+                    shell=True,
+                    stdout=subprocess.PIPE,
+                    start_new_session=self.new_session,
+                    **kwargs,
+                )
+            else:
+                popen = subprocess.Popen(  # pylint: disable=consider-using-with
+                    [*self.priority_command, *command],
+                    stdout=subprocess.PIPE,
+                    start_new_session=self.new_session,
+                    **kwargs,
+                )
+
+            stdout, stderr, usage = await _communicate_with_usage(
+                popen, input=input, kill_group=self.new_session
+            )
+            usages.append(usage)
+            returncode = popen.returncode
+        else:
+            if isinstance(command, str):
+                proc = await asyncio.create_subprocess_shell(
+                    self._with_priority(command),
+                    stdout=asyncio.subprocess.PIPE,
+                    start_new_session=self.new_session,
+                    **kwargs,
+                )
+            else:
+                proc = await asyncio.create_subprocess_exec(
+                    *self.priority_command,
+                    *command,
+                    stdout=asyncio.subprocess.PIPE,
+                    start_new_session=self.new_session,
+                    **kwargs,
+                )
+
+            stdout, stderr = await _communicate(
+                proc, input=input, kill_group=self.new_session
+            )
+            returncode = proc.returncode
+
+        if returncode != 0:
+            error_text = f"Unexpected error running command {command_desc}"
             if stderr:
                 error_text += f": {stderr.decode()}"
             elif stdout:
@@ -151,3 +227,105 @@ class SpeechTools:
             raise RuntimeError(error_text)
 
         return stdout
+
+    def _with_priority(self, cmd: str) -> str:
+        """Run shell command with a lower priority (inherited by the pipeline)."""
+        priority_command = self.priority_command
+        if not priority_command:
+            return cmd
+
+        return shlex.join(priority_command + ["sh", "-c", cmd])
+
+
+async def _communicate(
+    proc: "asyncio.subprocess.Process",
+    input: Optional[bytes] = None,  # pylint: disable=redefined-builtin
+    kill_group: bool = False,
+) -> Tuple[bytes, bytes]:
+    """Communicate with a process, killing it if cancelled.
+
+    If kill_group is True, the process leads its own process group, and the
+    whole group (e.g., a shell pipeline) is killed. Otherwise, only the process
+    is killed and the rest of a pipeline exits once its input ends.
+    """
+    try:
+        return await proc.communicate(input=input)
+    except asyncio.CancelledError:
+        _kill(proc.pid, kill_group)
+        await proc.wait()
+        raise
+
+
+async def _communicate_with_usage(
+    popen: "subprocess.Popen[bytes]",
+    input: Optional[bytes] = None,  # pylint: disable=redefined-builtin
+    kill_group: bool = False,
+) -> Tuple[bytes, bytes, ProcessUsage]:
+    """Communicate with a process and reap it with os.wait4.
+
+    The usage includes the processes it waited for, such as the members of a
+    shell pipeline. Pipes are read without blocking the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        _, stdout, stderr = await asyncio.gather(
+            loop.run_in_executor(None, _write_and_close, popen.stdin, input),
+            _read_pipe(popen.stdout),
+            _read_pipe(popen.stderr),
+        )
+    except BaseException:
+        # Cancelled or failed to read
+        _kill(popen.pid, kill_group)
+        raise
+    finally:
+        _pid, status, rusage = await loop.run_in_executor(None, os.wait4, popen.pid, 0)
+        popen.returncode = os.waitstatus_to_exitcode(status)
+
+    return (
+        stdout,
+        stderr,
+        ProcessUsage(
+            cpu_seconds=rusage.ru_utime + rusage.ru_stime,
+            max_rss_kb=rusage.ru_maxrss,
+        ),
+    )
+
+
+def _kill(pid: int, kill_group: bool) -> None:
+    """Kill a process or its process group (ignored if already gone)."""
+    try:
+        if kill_group:
+            os.killpg(pid, signal.SIGKILL)
+        else:
+            os.kill(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def _write_and_close(pipe: Optional[IO[bytes]], data: Optional[bytes]) -> None:
+    """Write all data to a pipe and close it (blocking)."""
+    if pipe is None:
+        return
+
+    # Process may exit without reading all of its input
+    with suppress(BrokenPipeError):
+        if data:
+            pipe.write(data)
+
+    with suppress(BrokenPipeError):
+        pipe.close()
+
+
+async def _read_pipe(pipe: Optional[IO[bytes]]) -> bytes:
+    """Read a pipe until it's closed."""
+    if pipe is None:
+        return b""
+
+    reader = asyncio.StreamReader()
+    transport, _protocol = await asyncio.get_running_loop().connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), pipe
+    )
+    try:
+        return await reader.read()
+    finally:
+        transport.close()
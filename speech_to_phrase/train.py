@@ -3,22 +3,36 @@
 import hashlib
 import json
 import logging
-from dataclasses import asdict, dataclass
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional
 
 from hassil import Intents, merge_dict
 
 from .const import Settings, TrainingError, WordCasing
 from .g2p import LexiconDatabase
+from .hashing import FileHashCache
 from .hass_api import Things
-from .hassil_fst import Fst, G2PInfo, intents_to_fst
+from .hassil_fst import (
+    CLASS_PREFIX,
+    ClassLists,
+    CompactFst,
+    G2PInfo,
+    class_lists_to_fsts,
+    intents_to_fst,
+)
 from .lang_sentences import LanguageData, load_shared_lists
 from .models import Model, ModelType, download_model
 from .train_coqui_stt import train_coqui_stt
-from .train_kaldi import train_kaldi
+from .train_kaldi import ClassGrammar, train_kaldi
+from .train_progress import TrainingProgress
 from .util import quote_strings, yaml, yaml_output
+from .worker_pool import WorkerPool
 
 _LOGGER = logging.getLogger(__name__)
 
+# Lists from Home Assistant that are compiled as separate sub-grammars (Kaldi)
+_CLASS_LISTS = {"name", "area", "floor"}
+
 
 @dataclass
 class TrainingInfo:
@@ -27,24 +41,65 @@ class TrainingInfo:
     model_version: str
     sentences_hash: str
     things_hash: str
+    component_hashes: Dict[str, str] = field(default_factory=dict)
+    """Hashes of sentences, entities, areas, floors, and extra sentences."""
+
+    def get_changed_components(self, other: "TrainingInfo") -> List[str]:
+        """Get names of components whose hashes differ from other."""
+        changed = [
+            component
+            for component in sorted(
+                set(self.component_hashes) | set(other.component_hashes)
+            )
+            if self.component_hashes.get(component)
+            != other.component_hashes.get(component)
+        ]
+
+        if self.model_version != other.model_version:
+            changed.insert(0, "model")
+
+        return changed
+
+
+@dataclass
+class CompiledGrammar:
+    """Grammar FSTs compiled from sentences and things."""
+
+    fst: CompactFst
+    class_grammar: Optional[ClassGrammar] = None
+    """Template grammar with list sub-grammars (Kaldi only)."""
 
 
 async def train(
-    model: Model, settings: Settings, things: Things, force_retrain: bool = False
+    model: Model,
+    settings: Settings,
+    things: Things,
+    force_retrain: bool = False,
+    worker_pool: Optional[WorkerPool] = None,
 ) -> None:
     """Train a speech model.
 
     If the model does not exist, it will be downloaded.
     If the previous training information is identical, training will be skipped.
+
+    The grammar is compiled in worker_pool, or in a temporary worker process if
+    it's None.
     """
     model_dir = settings.model_data_dir(model.id)
     if not model_dir.exists():
         await download_model(model, settings)
 
+    file_hashes = FileHashCache(settings.model_file_hashes_path(model.id))
+    sentences_hash = _get_sentences_hash(model, settings, file_hashes)
     training_info = TrainingInfo(
         model_version=model.version,
-        sentences_hash=_get_sentences_hash(model, settings),
+        sentences_hash=sentences_hash,
         things_hash=things.get_hash(),
+        component_hashes={
+            "sentences": sentences_hash,
+            "settings": _get_settings_hash(settings),
+            **things.get_component_hashes(),
+        },
     )
 
     training_info_path = settings.model_training_info_path(model.id)
@@ -54,29 +109,58 @@ async def train(
 
         if last_training_info == training_info:
             _LOGGER.debug("Skipping training of %s", model.id)
+            file_hashes.save()
             return
 
-    _LOGGER.info("Started training: %s", model.id)
+        _LOGGER.debug(
+            "Changed since last training of %s: %s",
+            model.id,
+            last_training_info.get_changed_components(training_info),
+        )
+
+    progress = TrainingProgress(model.id, settings.model_training_report_path(model.id))
+    expected_seconds = progress.expected_seconds
+    if expected_seconds is not None:
+        _LOGGER.info(
+            "Started training: %s (expected to take %.0fs)", model.id, expected_seconds
+        )
+    else:
+        _LOGGER.info("Started training: %s", model.id)
+
     train_dir = settings.model_train_dir(model.id).absolute()
     train_dir.mkdir(parents=True, exist_ok=True)
 
     # Written at the end of training
     training_info_path.unlink(missing_ok=True)
 
-    # Create intents
-    intents = _create_intents(model, settings, things)
+    # Parsing sentences and building the grammar is CPU-bound, so it runs in a
+    # separate process to keep the event loop responsive.
+    with progress.stage("compile_grammar"):
+        pool = worker_pool or WorkerPool(niceness=settings.train_tools.niceness)
+        try:
+            grammar = await pool.run(compile_grammar, model, settings, things)
+        finally:
+            if pool is not worker_pool:
+                pool.shutdown()
 
     if model.type == ModelType.KALDI:
         lexicon = LexiconDatabase(settings.models_dir / model.id / "lexicon.db")
-        fst = _create_intents_fst(model, lexicon, intents)
-        await train_kaldi(model, settings, lexicon, fst)
+        await train_kaldi(
+            model,
+            settings,
+            lexicon,
+            grammar.fst,
+            file_hashes=file_hashes,
+            class_grammar=grammar.class_grammar,
+            progress=progress,
+        )
     elif model.type == ModelType.COQUI_STT:
-        lexicon = LexiconDatabase()
-        fst = _create_intents_fst(model, lexicon, intents)
-        await train_coqui_stt(model, settings, fst)
+        await train_coqui_stt(model, settings, grammar.fst, progress=progress)
     else:
         raise TrainingError(f"Unexpected model type for {model.id}: {model.type}")
 
+    file_hashes.save()
+
     # Write training info
     with open(training_info_path, "w", encoding="utf-8") as training_info_file:
         json.dump(
@@ -84,12 +168,39 @@ async def train(
             training_info_file,
         )
 
-    _LOGGER.info("Finished training: %s", model.id)
+    progress.finish()
+    _LOGGER.info("Finished training: %s in %.2fs", model.id, progress.run.total_seconds)
 
 
 # -----------------------------------------------------------------------------
 
 
+def compile_grammar(
+    model: Model, settings: Settings, things: Things
+) -> CompiledGrammar:
+    """Create intents and compile them into grammar FSTs.
+
+    Only takes and returns picklable objects, so it can run in another process.
+    """
+    intents = _create_intents(model, settings, things)
+
+    if model.type == ModelType.KALDI:
+        lexicon = LexiconDatabase(settings.models_dir / model.id / "lexicon.db")
+        grammar = _create_class_grammar(model, lexicon, intents)
+        if grammar is not None:
+            return grammar
+
+        # Lists can't be separated from the templates
+        return CompiledGrammar(fst=_create_intents_fst(model, lexicon, intents))
+
+    if model.type == ModelType.COQUI_STT:
+        return CompiledGrammar(
+            fst=_create_intents_fst(model, LexiconDatabase(), intents)
+        )
+
+    raise TrainingError(f"Unexpected model type for {model.id}: {model.type}")
+
+
 def _create_intents(model: Model, settings: Settings, things: Things) -> Intents:
     """Create intents from sentences and things from Home Assistant."""
     sentences_path = settings.sentences / f"{model.sentences_language}.yaml"
@@ -167,7 +278,7 @@ def _create_intents(model: Model, settings: Settings, things: Things) -> Intents
 
 def _create_intents_fst(
     model: Model, lexicon: LexiconDatabase, intents: Intents
-) -> Fst:
+) -> CompactFst:
     """Create a finite state transducer (FST) directly from intents.
 
     This allows for efficiently generating an n-gram language model using
@@ -184,20 +295,107 @@ def _create_intents_fst(
     # Remove dead branches
     fst.prune()
 
-    return fst
+    # Training only writes the grammar, so drop the per-arc objects
+    return fst.to_compact()
+
+
+def _create_class_grammar(
+    model: Model, lexicon: LexiconDatabase, intents: Intents
+) -> Optional[CompiledGrammar]:
+    """Create a template grammar with entity/area/floor lists as nonterminals.
+
+    The full grammar is derived from the template by replacing the
+    nonterminals with their sub-grammars, so the intents are only compiled
+    once.
+
+    Returns None if the lists can't be separated from the templates, such as
+    when a list reference is not surrounded by spaces ("{name}'s").
+    """
+    casing_func = WordCasing.get_function(model.casing)
+    g2p_info = G2PInfo(lexicon, casing_func)
+    class_lists = ClassLists(list_names=set(_CLASS_LISTS))
+
+    template_fst = intents_to_fst(
+        intents,
+        number_language=model.number_language,
+        g2p_info=g2p_info,
+        class_lists=class_lists,
+    ).remove_spaces()
+    template_fst.prune()
+
+    if not class_lists.values:
+        # No entity/area/floor lists used, so the template is the full grammar
+        return CompiledGrammar(fst=template_fst.to_compact())
+
+    # Nonterminals are not surrounded by spaces, so text right next to a list
+    # reference is merged into the nonterminal's word.
+    merged_words = {
+        word
+        for word in template_fst.words
+        if (CLASS_PREFIX in word) and (word not in class_lists.values)
+    }
+    if merged_words:
+        _LOGGER.debug(
+            "Not using class grammar for %s, merged words: %s",
+            model.id,
+            sorted(merged_words),
+        )
+        return None
+
+    class_fsts = class_lists_to_fsts(
+        class_lists,
+        intents,
+        number_language=model.number_language,
+        g2p_info=g2p_info,
+    )
+
+    for class_label, class_fst in class_fsts.items():
+        if not class_fst.final_states:
+            _LOGGER.debug("Empty sub-grammar: %s", class_label)
+            return None
+
+    return CompiledGrammar(
+        fst=template_fst.replace_labels(class_fsts).to_compact(),
+        class_grammar=ClassGrammar(
+            template=template_fst.to_compact(),
+            classes={
+                class_label: class_fst.to_compact()
+                for class_label, class_fst in class_fsts.items()
+            },
+        ),
+    )
+
+
+def _get_settings_hash(settings: Settings) -> str:
+    """Get a hash of settings that change the trained model."""
+    hasher = hashlib.sha256()
+    for value in (
+        settings.lookahead_min_arcs,
+        settings.ngram_order,
+        settings.ngram_prune_theta,
+        settings.ngram_max_arcs,
+        settings.write_arpa,
+        settings.coqui_lazy_compose,
+    ):
+        hasher.update(f"{value}\n".encode("utf-8"))
+
+    return hasher.hexdigest()
 
 
 def _get_sentences_hash(
-    model: Model, settings: Settings, chunk_size: int = 8192
+    model: Model, settings: Settings, file_hashes: FileHashCache
 ) -> str:
-    """Get a hash of sentences YAML files (builtin and custom)."""
+    """Get a hash of sentences YAML files (builtin, shared lists, and custom).
+
+    Full file contents are hashed, but files whose size and modification time
+    are unchanged are not re-read.
+    """
     hasher = hashlib.sha256()
 
     # Builtin sentences
     sentences_path = settings.sentences / f"{model.sentences_language}.yaml"
-    with open(sentences_path, "rb") as sentences_file:
-        chunk = sentences_file.read(chunk_size)
-        hasher.update(chunk)
+    hasher.update(file_hashes.hash_file(sentences_path).encode("utf-8"))
+    hasher.update(file_hashes.hash_file(settings.shared_lists_path).encode("utf-8"))
 
     # Custom sentences
     for custom_sentences_dir in settings.custom_sentences_dirs:
@@ -210,8 +408,8 @@ def _get_sentences_hash(
                 continue
 
         for custom_sentences_path in sorted(dir_for_language.glob("*.yaml")):
-            with open(custom_sentences_path, "rb") as custom_sentences_file:
-                chunk = custom_sentences_file.read(chunk_size)
-                hasher.update(chunk)
+            # Renaming a file changes the order sentences are merged in
+            hasher.update(custom_sentences_path.name.encode("utf-8"))
+            hasher.update(file_hashes.hash_file(custom_sentences_path).encode("utf-8"))
 
     return hasher.hexdigest()
@@ -9,18 +9,28 @@ import logging
 import shlex
 import unicodedata
 from pathlib import Path
-from typing import Dict, List, Set, Union
+from typing import Dict, Iterable, List, Optional, Set, TextIO, Tuple
 
 from .const import BLANK, EPS, SPACE, Settings
-from .hassil_fst import Fst
+from .hassil_fst import CompactFst
 from .models import Model
+from .openfst import SymbolTable
 from .speech_tools import SpeechTools
+from .train_progress import TrainingProgress
 
 _LOGGER = logging.getLogger(__name__)
 
 
-async def train_coqui_stt(model: Model, settings: Settings, fst: Fst) -> None:
+async def train_coqui_stt(
+    model: Model,
+    settings: Settings,
+    fst: CompactFst,
+    progress: Optional[TrainingProgress] = None,
+) -> None:
     """Train a Coqui STT speech model."""
+    if progress is None:
+        progress = TrainingProgress(model.id)
+
     model_dir = settings.model_data_dir(model.id).absolute()
     train_dir = settings.model_train_dir(model.id).absolute()
     train_dir.mkdir(parents=True, exist_ok=True)
@@ -136,160 +146,181 @@ async def train_coqui_stt(model: Model, settings: Settings, fst: Fst) -> None:
 
     # char -> word
     char2word_txt = train_dir / "char2word.fst.txt"
-    warned_chars: Set[str] = set()
     with open(char2word_txt, "w", encoding="utf-8") as char2word_file:
-        start = 0
-        current = 1
-
-        for word in fst.words:
-            if word == EPS:
-                continue
-
-            c_idx = 0
-            for word_char in word:
-                chars_to_use: List[str] = []
-
-                if word_char not in char2idx:
-                    # Try decomposing (splitting out accent marks)
-                    nfd_c = unicodedata.normalize("NFD", word_char)
-                    unusable_chars: List[str] = []
-                    for c in nfd_c:
-                        if c in char2idx:
-                            chars_to_use.append(c)
-                        else:
-                            unusable_chars.append(c)
-
-                    for c in unusable_chars:
-                        # None of the decomposed characters could be used
-                        if c not in warned_chars:
-                            _LOGGER.warning("Skipping '%s' in '%s'", c, word)
-                            warned_chars.add(c)
-
-                    if not chars_to_use:
-                        c_idx += 1
-                        continue
-                else:
-                    chars_to_use.append(word_char)
-
-                for c in chars_to_use:
-                    if c_idx == 0:
-                        # First char, emit word
-                        print(start, current, c, word, file=char2word_file)
-                    else:
-                        # Subsequent chars
-                        print(current, current + 1, c, EPS, file=char2word_file)
-                        current += 1
-
-                c_idx += 1
-
-            # Add space
-            print(current, current + 1, SPACE, EPS, file=char2word_file)
-            current += 1
-
-            # Loop back to start
-            print(current, start, EPS, EPS, file=char2word_file)
-            current += 1
-
-        print(start, file=char2word_file)
+        _write_char2word(fst.words, char2idx, char2word_file)
 
     # word -> sentence
-    word2sen_txt = train_dir / "word2sen.fst.txt"
-    with open(word2sen_txt, "w", encoding="utf-8") as word2sen_file:
-        fst.write(word2sen_file)
+    word2sen_raw_fst = train_dir / "word2sen.raw.fst"
+    with open(word2sen_raw_fst, "wb") as word2sen_file:
+        fst.write_binary(
+            word2sen_file, SymbolTable.load(words_txt), SymbolTable.load(output_txt)
+        )
 
     token2char_fst = train_dir / "token2char.fst"
-    await settings.tools.async_run_pipeline(
-        [
-            "fstcompile",
-            shlex.quote(f"--isymbols={tokens_with_blank}"),
-            shlex.quote(f"--osymbols={tokens_without_blank}"),
-            shlex.quote(str(token2char_txt)),
-        ],
-        ["fstdeterminize"],
-        ["fstminimize"],
-        ["fstpush", "--push_weights"],
-        ["fstarcsort", "--sort_type=ilabel", "-", shlex.quote(str(token2char_fst))],
-    )
+    with progress.stage("token2char", [token2char_fst]):
+        await settings.train_tools.async_run_pipeline(
+            [
+                "fstcompile",
+                shlex.quote(f"--isymbols={tokens_with_blank}"),
+                shlex.quote(f"--osymbols={tokens_without_blank}"),
+                shlex.quote(str(token2char_txt)),
+            ],
+            ["fstdeterminize"],
+            ["fstminimize"],
+            ["fstpush", "--push_weights"],
+            ["fstarcsort", "--sort_type=ilabel", "-", shlex.quote(str(token2char_fst))],
+        )
 
+    # Minimizing shares suffixes of the prefix trie
     char2word_fst = train_dir / "char2word.fst"
-    await _try_minimize(
-        [
-            "fstcompile",
-            shlex.quote(f"--isymbols={tokens_without_blank}"),
-            shlex.quote(f"--osymbols={words_txt}"),
-            shlex.quote(str(char2word_txt)),
-        ],
-        char2word_fst,
-        settings.tools,
-    )
+    with progress.stage("char2word", [char2word_fst]):
+        await _minimize(
+            [
+                "fstcompile",
+                shlex.quote(f"--isymbols={tokens_without_blank}"),
+                shlex.quote(f"--osymbols={words_txt}"),
+                shlex.quote(str(char2word_txt)),
+            ],
+            char2word_fst,
+            settings.train_tools,
+        )
 
     word2sen_fst = train_dir / "word2sen.fst"
-    await _try_minimize(
-        [
-            "fstcompile",
-            shlex.quote(f"--isymbols={words_txt}"),
-            shlex.quote(f"--osymbols={output_txt}"),
-            shlex.quote(str(word2sen_txt)),
-        ],
-        word2sen_fst,
-        settings.tools,
-    )
+    with progress.stage("word2sen", [word2sen_fst]):
+        await _minimize(
+            ["fstconnect", shlex.quote(str(word2sen_raw_fst))],
+            word2sen_fst,
+            settings.train_tools,
+        )
 
-    # token -> char -> word
     token2word_fst = train_dir / "token2word.fst"
-    await _try_minimize(
-        [
-            "fstcompose",
-            shlex.quote(str(token2char_fst)),
-            shlex.quote(str(char2word_fst)),
-        ],
-        token2word_fst,
-        settings.tools,
-    )
-
-    # token -> char -> word -> sentence
     token2sen_fst = train_dir / "token2sen.fst"
-    await settings.tools.async_run_pipeline(
-        [
-            "fstcompose",
-            shlex.quote(str(token2word_fst)),
-            shlex.quote(str(word2sen_fst)),
-        ],
-        ["fstrmepsilon"],
-        ["fstpush", "--push_weights"],
-        ["fstarcsort", "--sort_type=ilabel", "-", shlex.quote(str(token2sen_fst))],
-    )
+    if settings.coqui_lazy_compose:
+        # Layers are composed during decoding
+        token2word_fst.unlink(missing_ok=True)
+        token2sen_fst.unlink(missing_ok=True)
+        return
 
-
-async def _try_minimize(
-    compile_command: List[str],
-    fst_path: Union[str, Path],
-    tools: SpeechTools,
-    arc_sort_type: str = "ilabel",
-) -> None:
-    try:
-        # With minimize
-        await tools.async_run_pipeline(
-            compile_command,
-            ["fstdeterminize"],
-            ["fstminimize"],
-            ["fstpush", "--push_weights"],
+    # token -> char -> word
+    with progress.stage("token2word", [token2word_fst]):
+        await _minimize(
             [
-                "fstarcsort",
-                f"--sort_type={arc_sort_type}",
-                "-",
-                shlex.quote(str(fst_path)),
+                "fstcompose",
+                shlex.quote(str(token2char_fst)),
+                shlex.quote(str(char2word_fst)),
             ],
+            token2word_fst,
+            settings.train_tools,
         )
-    except Exception:
-        # Without minimize
-        await tools.async_run_pipeline(
-            compile_command,
-            ["fstpush", "--push_weights"],
+
+    # token -> char -> word -> sentence
+    with progress.stage("token2sen", [token2sen_fst]):
+        await settings.train_tools.async_run_pipeline(
             [
-                "fstarcsort",
-                f"--sort_type={arc_sort_type}",
-                "-",
-                shlex.quote(str(fst_path)),
+                "fstcompose",
+                shlex.quote(str(token2word_fst)),
+                shlex.quote(str(word2sen_fst)),
             ],
+            ["fstrmepsilon"],
+            ["fstpush", "--push_weights"],
+            ["fstarcsort", "--sort_type=ilabel", "-", shlex.quote(str(token2sen_fst))],
         )
+
+
+def _write_char2word(
+    words: Iterable[str], char2idx: Dict[str, int], char2word_file: TextIO
+) -> None:
+    """Write char -> word transducer in text format as a prefix trie.
+
+    Words that share a prefix share states. Each word is emitted on the space
+    after its last character, so the transducer is deterministic on its input
+    (except for words that spell the same).
+    """
+    start = 0
+    next_state = 1
+    trie: Dict[Tuple[int, str], int] = {}
+    warned_chars: Set[str] = set()
+
+    for word in sorted(words):
+        if word == EPS:
+            continue
+
+        word_chars = _get_word_chars(word, char2idx, warned_chars)
+        if not word_chars:
+            _LOGGER.warning("Skipping '%s' (no usable characters)", word)
+            continue
+
+        state = start
+        for c in word_chars:
+            child_state = trie.get((state, c))
+            if child_state is None:
+                child_state = next_state
+                next_state += 1
+                trie[(state, c)] = child_state
+                print(state, child_state, c, EPS, file=char2word_file)
+
+            state = child_state
+
+        # Emit word on space and loop back to start
+        print(state, start, SPACE, word, file=char2word_file)
+
+    print(start, file=char2word_file)
+
+
+def _get_word_chars(
+    word: str, char2idx: Dict[str, int], warned_chars: Set[str]
+) -> List[str]:
+    """Get characters of a word that are in the alphabet."""
+    chars_to_use: List[str] = []
+    for word_char in word:
+        if word_char in char2idx:
+            chars_to_use.append(word_char)
+            continue
+
+        # Try decomposing (splitting out accent marks)
+        nfd_c = unicodedata.normalize("NFD", word_char)
+        for c in nfd_c:
+            if c in char2idx:
+                chars_to_use.append(c)
+            elif c not in warned_chars:
+                # None of the decomposed characters could be used
+                _LOGGER.warning("Skipping '%s' in '%s'", c, word)
+                warned_chars.add(c)
+
+    return chars_to_use
+
+
+async def _minimize(
+    compile_command: List[str],
+    fst_path: Path,
+    tools: SpeechTools,
+    arc_sort_type: str = "ilabel",
+) -> None:
+    """Determinize and minimize a transducer.
+
+    Each (input, output, weight) triple is first encoded as a single label,
+    which works as a disambiguation symbol. The encoded FST is an unweighted
+    acceptor, so determinization always succeeds. Labels are decoded again
+    after minimization.
+    """
+    codex_path = fst_path.with_suffix(".codex")
+    await tools.async_run_pipeline(
+        compile_command,
+        [
+            "fstencode",
+            "--encode_labels",
+            "--encode_weights",
+            "-",
+            shlex.quote(str(codex_path)),
+        ],
+        ["fstdeterminize"],
+        ["fstminimize"],
+        ["fstencode", "--decode", "-", shlex.quote(str(codex_path))],
+        ["fstpush", "--push_weights"],
+        [
+            "fstarcsort",
+            f"--sort_type={arc_sort_type}",
+            "-",
+            shlex.quote(str(fst_path)),
+        ],
+    )
@@ -1,27 +1,64 @@
 """Model training for Kaldi."""
 
-import gzip
-import hashlib
+import asyncio
 import logging
+import os
 import shlex
 import shutil
 import tempfile
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Set
+from typing import Dict, List, Optional, Tuple
 
 from .const import EPS, SIL, SPN, UNK, Settings
-from .g2p import LexiconDatabase
-from .hassil_fst import Fst
+from .g2p import GuessCache, LexiconDatabase, parse_phonetisaurus_output
+from .hashing import FileHashCache
+from .hassil_fst import CompactFst
+from .kaldi_lang import prepare_lang
 from .models import Model
+from .openfst import ILABEL_SORTED, SymbolTable, VectorArc, write_vector_fst
 from .speech_tools import SpeechTools
+from .train_progress import TrainingProgress
+from .train_stages import Stage, StageManifest
 
 _LOGGER = logging.getLogger(__name__)
 
+# Minimum number of words per phonetisaurus process when guessing pronunciations
+_G2P_MIN_CHUNK_SIZE = 100
+
+# Highest n-gram order tried when the order is chosen automatically
+_MAX_AUTO_NGRAM_ORDER = 5
+
+
+@dataclass
+class ClassGrammar:
+    """Template grammar whose nonterminal class labels are replaced by sub-grammars.
+
+    Only the template is used to build the n-gram model. The class FSTs are
+    spliced into G.fst afterwards, so a change in entity names only rebuilds
+    small list FSTs.
+    """
+
+    template: CompactFst
+    classes: Dict[str, CompactFst]
+    """Nonterminal label -> sub-grammar."""
+
 
 async def train_kaldi(
-    model: Model, settings: Settings, lexicon: LexiconDatabase, fst: Fst
+    model: Model,
+    settings: Settings,
+    lexicon: LexiconDatabase,
+    fst: CompactFst,
+    file_hashes: Optional[FileHashCache] = None,
+    class_grammar: Optional[ClassGrammar] = None,
+    progress: Optional[TrainingProgress] = None,
 ) -> None:
-    """Train a Kaldi speech model."""
+    """Train a Kaldi speech model.
+
+    If a class grammar is given, it is used for G.fst instead of the full
+    intents FST. The full FST is still used for fuzzy matching.
+    """
     model_dir = (settings.model_data_dir(model.id) / "model").absolute()
     train_dir = settings.model_train_dir(model.id).absolute()
     train_dir.mkdir(parents=True, exist_ok=True)
@@ -33,11 +70,7 @@ async def train_kaldi(
 
     shutil.copytree(model_dir / "conf", conf_dir)
 
-    # Delete existing data/graph
-    data_dir = train_dir / "data"
-    if data_dir.exists():
-        shutil.rmtree(data_dir)
-
+    # Delete stale graph directories
     for graph_dir in train_dir.glob("graph_*"):
         if graph_dir.is_dir():
             continue
@@ -47,53 +80,288 @@ async def train_kaldi(
     # ---------------------------------------------------------------------
     # Kaldi Training
     # ---------------------------------------------------------
-    # 1. prepare_lang.sh
-    # 2. format_lm.sh (or fstcompile)
-    # 3. mkgraph.sh
+    # 1. prepare_lang
+    # 2. G.fst from n-gram model
+    # 3. HCL.fst and HCLG.fst (like mkgraph.sh)
     # 4. prepare_online_decoding.sh
+    #
+    # Each stage records the hashes of its inputs and outputs in a manifest,
+    # and is skipped when they are unchanged. Stages that depend on the output
+    # of a previous stage include its output hashes in their inputs, and run
+    # after it. Independent stages run concurrently.
     # ---------------------------------------------------------
+    manifest = StageManifest(
+        settings.model_train_manifest_path(model.id),
+        (
+            file_hashes
+            if file_hashes is not None
+            else FileHashCache(settings.model_file_hashes_path(model.id))
+        ),
+    )
+    model_key = f"{model.id}-{model.version}"
+
+    data_dir = train_dir / "data"
+    lang_dir = data_dir / "lang"
+    dict_local_dir = data_dir / "local" / "dict"
+    graph_dir = train_dir / "graph"
+    online_conf = model_dir / "online" / "conf" / "online.conf"
 
     # Create empty path.sh
     path_sh = train_dir / "path.sh"
     if not path_sh.is_file():
         path_sh.write_text("")
 
-    # Write pronunciation dictionary
-    await _create_lexicon(
-        fst, lexicon, model_dir, train_dir, settings.tools, spn_phone=model.spn_phone
-    )
-
     # Create utils link
     model_utils_link = train_dir / "utils"
     model_utils_link.unlink(missing_ok=True)
     model_utils_link.symlink_to(settings.tools.egs_utils_dir, target_is_directory=True)
 
-    # 1. prepare_lang.sh
-    await _prepare_lang(train_dir, settings.tools)
-
-    # 2. Generate G.fst from skill graph
-    await _create_arpa(fst, train_dir, settings.tools, method=model.arpa_method)
-    await _create_fuzzy_fst(fst, train_dir, settings.tools)
-
-    # 3. mkgraph.sh
-    await _mkgraph(model_dir, train_dir, settings.tools)
+    if class_grammar is None:
+        class_grammar = ClassGrammar(template=fst, classes={})
+
+    class_labels = sorted(class_grammar.classes)
+
+    lexicon_words = sorted(fst.words - {UNK})
+    meta_labels = sorted(fst.output_words - fst.words)
+    tools = settings.train_tools
+    template_fst_path = lang_dir / "G.arpa.fst"
+    class_fst_paths: List[Path] = [
+        lang_dir / "classes" / f"{class_idx}.fst"
+        for class_idx in range(len(class_labels))
+    ]
+    full_fst_path = lang_dir / "G.full.fst" if class_labels else template_fst_path
+    arpa_path = data_dir / "local" / "lang" / "lm.arpa"
+    ngram_prune_theta = (
+        settings.ngram_prune_theta
+        if settings.ngram_prune_theta is not None
+        else model.ngram_prune_theta
+    )
+    if settings.ngram_order is not None:
+        ngram_order = settings.ngram_order
+    elif settings.ngram_max_arcs is not None:
+        ngram_order = _MAX_AUTO_NGRAM_ORDER
+    else:
+        ngram_order = model.ngram_order
+
+    am_dir = model_dir / "model"
+    hcl_dir = train_dir / "hcl"
+
+    async def create_grammar_fsts() -> None:
+        word_symbols = SymbolTable.load(lang_dir / "words.txt")
+
+        # Only the template's own words are stored in it, so it (and the n-gram
+        # model) doesn't change when entity names add words to words.txt.
+        template = class_grammar.template
+        _write_binary_fst(
+            template,
+            template_fst_path,
+            word_symbols.subset({EPS} | template.words | template.output_words),
+        )
+
+        # Sub-grammars for entity/area/floor lists (acceptors for G.fst)
+        for class_label, class_fst_path in zip(class_labels, class_fst_paths):
+            _write_binary_fst(
+                class_grammar.classes[class_label],
+                class_fst_path,
+                word_symbols,
+                keep_symbols=False,
+                project_input=True,
+            )
+
+        if class_labels:
+            _write_binary_fst(fst, full_fst_path, word_symbols)
+
+    stages: List[Stage] = [
+        # Pronunciation dictionary
+        Stage(
+            "lexicon",
+            [
+                model_key,
+                model.spn_phone,
+                "\n".join(lexicon_words),
+                "\n".join(meta_labels),
+                "\n".join(class_labels),
+            ],
+            [dict_local_dir / "lexicon.txt"],
+            lambda: _create_lexicon(
+                fst,
+                lexicon,
+                model_dir,
+                train_dir,
+                tools,
+                settings.model_g2p_guesses_path(model.id),
+                file_hashes=manifest.file_hashes,
+                spn_phone=model.spn_phone,
+                class_labels=class_labels,
+            ),
+        ),
+        # 1. prepare_lang (Python version of prepare_lang.sh)
+        Stage(
+            "prepare_lang",
+            [model_key, dict_local_dir / "lexicon.txt"],
+            [
+                lang_dir / "L.fst",
+                lang_dir / "L_disambig.fst",
+                lang_dir / "words.txt",
+                lang_dir / "phones.txt",
+                lang_dir / "phones" / "wdisambig_words.int",
+            ],
+            lambda: _prepare_lang(train_dir),
+        ),
+        # 2. Generate G.fst from skill graph
+        Stage(
+            "grammar_fsts",
+            [lang_dir / "words.txt"],
+            [template_fst_path, *class_fst_paths, full_fst_path],
+            create_grammar_fsts,
+            memoize=False,
+        ),
+        Stage(
+            "ngram",
+            [
+                template_fst_path,
+                # Id of #0 for backoff arcs
+                lang_dir / "phones" / "wdisambig_words.int",
+                str(ngram_order),
+                model.arpa_method,
+                str(ngram_prune_theta),
+                str(settings.ngram_max_arcs),
+            ],
+            [lang_dir / "G.template.fst"]
+            + ([arpa_path] if settings.write_arpa else []),
+            lambda: _create_ngram_fst(
+                train_dir,
+                tools,
+                order=ngram_order,
+                method=model.arpa_method,
+                prune_theta=ngram_prune_theta,
+                max_arcs=settings.ngram_max_arcs,
+                write_arpa=settings.write_arpa,
+            ),
+        ),
+        Stage(
+            "replace_classes",
+            [
+                lang_dir / "G.template.fst",
+                lang_dir / "words.txt",
+                "\n".join(class_labels),
+                *class_fst_paths,
+            ],
+            [lang_dir / "G.fst"],
+            lambda: _replace_classes(
+                lang_dir, dict(zip(class_labels, class_fst_paths)), tools
+            ),
+        ),
+        Stage(
+            "fuzzy_fst",
+            [full_fst_path],
+            [lang_dir / "G.fuzzy.fst", lang_dir / "G.fuzzy_edit.fst"],
+            lambda: _create_fuzzy_fst(
+                fst, SymbolTable.load(lang_dir / "words.txt"), lang_dir
+            ),
+        ),
+        # 3. HCLG.fst (like mkgraph.sh)
+        #
+        # HCL.fst only depends on the lexicon and acoustic model, so only the
+        # composition with G.fst is redone when sentences or entities change.
+        Stage(
+            "hcl",
+            [
+                model_key,
+                lang_dir / "L_disambig.fst",
+                lang_dir / "phones.txt",
+                lang_dir / "phones" / "disambig.int",
+                am_dir / "tree",
+                am_dir / "final.mdl",
+            ],
+            [hcl_dir / "HCL.fst", hcl_dir / "disambig_tid.int"],
+            lambda: _make_hcl(model_dir, train_dir, tools),
+        ),
+    ]
+
+    # Very large grammars are composed with HCL.fst during decoding instead
+    use_lookahead = (settings.lookahead_min_arcs is not None) and (
+        fst.num_arcs >= settings.lookahead_min_arcs
+    )
+    if use_lookahead:
+        _LOGGER.debug("Using lookahead decoding graph (%s arc(s))", fst.num_arcs)
+        (graph_dir / "HCLG.fst").unlink(missing_ok=True)
+
+        stages.extend(
+            (
+                Stage(
+                    "hcl_lookahead",
+                    [model_key, hcl_dir / "HCL.fst", hcl_dir / "disambig_tid.int"],
+                    [graph_dir / "HCLr.fst", graph_dir / "relabel"],
+                    lambda: _make_hcl_lookahead(model_dir, train_dir, tools),
+                ),
+                Stage(
+                    "gr",
+                    [graph_dir / "relabel", lang_dir / "G.fst", lang_dir / "words.txt"],
+                    [graph_dir / "Gr.fst", graph_dir / "words.txt"],
+                    lambda: _make_gr(train_dir, tools),
+                ),
+            )
+        )
+    else:
+        for lookahead_path in (graph_dir / "HCLr.fst", graph_dir / "Gr.fst"):
+            lookahead_path.unlink(missing_ok=True)
+
+        stages.append(
+            Stage(
+                "hclg",
+                [
+                    model_key,
+                    hcl_dir / "HCL.fst",
+                    hcl_dir / "disambig_tid.int",
+                    lang_dir / "G.fst",
+                    lang_dir / "words.txt",
+                ],
+                [graph_dir / "HCLG.fst", graph_dir / "words.txt"],
+                lambda: _make_hclg(model_dir, train_dir, tools),
+            )
+        )
 
     # 4. prepare_online_decoding.sh
-    await _prepare_online_decoding(model_dir, train_dir, settings.tools)
+    if (model_dir / "extractor").is_dir():
+        stages.append(
+            Stage(
+                "online",
+                [model_key, lang_dir / "phones.txt"],
+                [online_conf],
+                lambda: _prepare_online_decoding(model_dir, train_dir, tools),
+            )
+        )
+    else:
+        _LOGGER.debug("Extractor dir does not exist: %s", model_dir / "extractor")
+
+    # Independent stages run concurrently, sharing the CPUs with other trainings
+    await manifest.run_graph(
+        stages,
+        max_concurrent=(os.cpu_count() or 1) // max(1, settings.train_workers),
+        progress=progress,
+    )
 
 
 # -----------------------------------------------------------------------------
 
 
 async def _create_lexicon(
-    fst: Fst,
+    fst: CompactFst,
     lexicon: LexiconDatabase,
     model_dir: Path,
     train_dir: Path,
     tools: SpeechTools,
+    guesses_path: Path,
+    file_hashes: Optional[FileHashCache] = None,
     spn_phone: str = SPN,
+    class_labels: Iterable[str] = (),
 ) -> None:
-    """Generate pronunciation dictionary."""
+    """Generate pronunciation dictionary.
+
+    Pronunciations for words missing from the lexicon are guessed once per
+    g2p model and cached at guesses_path.
+    """
     _LOGGER.debug("Generating lexicon")
     data_local_dir = train_dir / "data" / "local"
     dict_local_dir = data_local_dir / "dict"
@@ -108,17 +376,14 @@ async def _create_lexicon(
     dictionary_path = dict_local_dir / "lexicon.txt"
     with open(dictionary_path, "w", encoding="utf-8") as dictionary_file:
         missing_words = set()
-        for word in sorted(fst.words):
-            if word in (UNK,):
-                continue
-
-            word_found = False
-            for word_pron in lexicon.lookup(word):
+        for word, word_prons in lexicon.lookup_many(
+            word for word in sorted(fst.words) if word not in (UNK,)
+        ):
+            for word_pron in word_prons:
                 phonemes_str = " ".join(word_pron)
                 print(word, phonemes_str, file=dictionary_file)
-                word_found = True
 
-            if not word_found:
+            if not word_prons:
                 missing_words.add(word)
 
         missing_words_path = train_dir / "missing_words_dictionary.txt"
@@ -126,53 +391,39 @@ async def _create_lexicon(
 
         if missing_words:
             g2p_model_path = model_dir.parent / "g2p.fst"
-            with tempfile.NamedTemporaryFile(
-                mode="w+", suffix=".txt", encoding="utf-8"
-            ) as missing_words_file, open(
+            guess_cache = GuessCache(
+                guesses_path,
+                (file_hashes or FileHashCache()).hash_file(g2p_model_path),
+            )
+            new_words = sorted(missing_words - guess_cache.guesses.keys())
+            if new_words:
+                for word in new_words:
+                    _LOGGER.warning("Guessing pronunciation for %s", word)
+
+                for word, phonemes in await _guess_pronunciations(
+                    new_words, g2p_model_path, tools
+                ):
+                    guess_cache.add(word, phonemes)
+
+                guess_cache.save()
+
+            with open(
                 missing_words_path, "w", encoding="utf-8"
             ) as missing_dictionary_file:
                 for word in sorted(missing_words):
-                    _LOGGER.warning("Guessing pronunciation for %s", word)
-                    print(word, file=missing_words_file)
-
-                missing_words_file.seek(0)
-                phonetisaurus_output = (
-                    (
-                        await tools.async_run(
-                            str(tools.phonetisaurus_bin),
-                            [
-                                f"--model={g2p_model_path}",
-                                f"--wordlist={missing_words_file.name}",
-                            ],
-                        )
-                    )
-                    .decode()
-                    .splitlines()
-                )
-                for line in phonetisaurus_output:
-                    line = line.strip()
-                    if line:
-                        line_parts = line.split()
-                        if len(line_parts) == 2:
-                            word = line_parts[0]
-                            _LOGGER.warning(
-                                "No pronunciation could be guessed for: '%s'", word
-                            )
-                            print(word, SIL, file=dictionary_file)
-                            continue
-
-                        if len(line_parts) < 3:
-                            continue
-
-                        word = line_parts[0]
-                        phonemes = " ".join(line_parts[2:])
-
-                        print(
-                            word,
-                            phonemes,
-                            file=missing_dictionary_file,
+                    if word not in guess_cache.guesses:
+                        continue
+
+                    phonemes = guess_cache.guesses[word]
+                    if phonemes is None:
+                        _LOGGER.warning(
+                            "No pronunciation could be guessed for: '%s'", word
                         )
-                        print(word, phonemes, file=dictionary_file)
+                        print(word, SIL, file=dictionary_file)
+                        continue
+
+                    print(word, phonemes, file=missing_dictionary_file)
+                    print(word, phonemes, file=dictionary_file)
 
         # Add <unk>
         print(UNK, spn_phone, file=dictionary_file)
@@ -181,8 +432,42 @@ async def _create_lexicon(
         for label in meta_labels:
             print(label, SIL, file=dictionary_file)
 
+        # Nonterminals are replaced in G.fst, so they never reach HCLG.fst
+        for label in class_labels:
+            print(label, SIL, file=dictionary_file)
+
 
-async def _prepare_lang(train_dir: Path, tools: SpeechTools) -> None:
+async def _guess_pronunciations(
+    words: List[str], g2p_model_path: Path, tools: SpeechTools
+) -> List[Tuple[str, Optional[str]]]:
+    """Guess pronunciations with phonetisaurus, in parallel chunks."""
+    num_chunks = max(1, min(os.cpu_count() or 1, len(words) // _G2P_MIN_CHUNK_SIZE))
+
+    async def guess_chunk(chunk: List[str]) -> List[Tuple[str, Optional[str]]]:
+        with tempfile.NamedTemporaryFile(
+            mode="w+", suffix=".txt", encoding="utf-8"
+        ) as chunk_file:
+            for word in chunk:
+                print(word, file=chunk_file)
+
+            chunk_file.flush()
+            phonetisaurus_output = await tools.async_run(
+                str(tools.phonetisaurus_bin),
+                [f"--model={g2p_model_path}", f"--wordlist={chunk_file.name}"],
+            )
+
+        return list(
+            parse_phonetisaurus_output(phonetisaurus_output.decode().splitlines())
+        )
+
+    chunk_guesses = await asyncio.gather(
+        *(guess_chunk(words[i::num_chunks]) for i in range(num_chunks))
+    )
+
+    return [guess for guesses in chunk_guesses for guess in guesses]
+
+
+async def _prepare_lang(train_dir: Path) -> None:
     """Prepare data directory for language model."""
     data_dir = train_dir / "data"
     lang_dir = data_dir / "lang"
@@ -190,172 +475,436 @@ async def _prepare_lang(train_dir: Path, tools: SpeechTools) -> None:
     dict_local_dir = data_local_dir / "dict"
     lang_local_dir = data_local_dir / "lang"
 
-    await tools.async_run(
-        "bash",
-        [
-            str(tools.egs_utils_dir / "prepare_lang.sh"),
-            str(dict_local_dir),
-            UNK,
-            str(lang_local_dir),
-            str(lang_dir),
-        ],
-        cwd=train_dir,
-    )
+    lang_local_dir.mkdir(parents=True, exist_ok=True)
+    prepare_lang(dict_local_dir, lang_dir, oov_word=UNK)
 
 
-async def _create_arpa(
-    fst: Fst,
+def _write_binary_fst(
+    fst: CompactFst,
+    fst_path: Path,
+    word_symbols: SymbolTable,
+    keep_symbols: bool = True,
+    project_input: bool = False,
+) -> Path:
+    """Write FST in OpenFST's binary format with word ids from words.txt."""
+    fst_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(fst_path, "wb") as fst_file:
+        fst.write_binary(
+            fst_file,
+            word_symbols,
+            keep_symbols=keep_symbols,
+            project_input=project_input,
+        )
+
+    return fst_path
+
+
+async def _create_ngram_fst(
     train_dir: Path,
     tools: SpeechTools,
     order: int = 3,
     method: str = "kneser_ney",
+    prune_theta: Optional[float] = None,
+    max_arcs: Optional[int] = None,
+    write_arpa: bool = False,
 ) -> None:
-    """Create n-gram language model from intents."""
+    """Create n-gram language model from intents as Kaldi's G.fst.
+
+    The opengrm model is already an FST with words.txt ids, so only its backoff
+    arcs need to be relabeled (epsilon to #0 on the input side), like arpa2fst.
+
+    If max_arcs is given, lower orders are tried until the model fits. The size
+    of HCLG.fst grows with the size of G.fst.
+    """
     data_dir = train_dir / "data"
     lang_dir = data_dir / "lang"
-    data_local_dir = data_dir / "local"
-    dict_local_dir = data_local_dir / "dict"
-    lang_local_dir = data_local_dir / "lang"
+    lang_local_dir = data_dir / "local" / "lang"
+    lang_local_dir.mkdir(parents=True, exist_ok=True)
 
     fst_path = lang_dir / "G.arpa.fst"
-    text_fst_path = fst_path.with_suffix(".fst.txt")
-    arpa_path = lang_dir / "lm.arpa"
-
-    with open(text_fst_path, "w", encoding="utf-8") as text_fst_file:
-        fst.write(text_fst_file)
+    ngram_fst_path = lang_local_dir / "lm.fst"
+
+    ngram_order = max(1, order)
+    for candidate_order in range(ngram_order, 0, -1):
+        ngram_order = candidate_order
+        ngram_commands = [
+            [
+                "ngramcount",
+                f"--order={candidate_order}",
+                shlex.quote(str(fst_path)),
+                "-",
+            ],
+            ["ngrammake", f"--method={method}"],
+        ]
+        if prune_theta is not None:
+            ngram_commands.append(
+                ["ngramshrink", "--method=relative_entropy", f"--theta={prune_theta}"]
+            )
+
+        # Last command writes the model
+        ngram_commands[-1].extend(["-", shlex.quote(str(ngram_fst_path))])
+        await tools.async_run_pipeline(*ngram_commands)
+
+        if max_arcs is None:
+            break
+
+        num_arcs = _get_num_arcs(
+            (await tools.async_run("fstinfo", [str(ngram_fst_path)])).decode()
+        )
+        _LOGGER.debug("%s-gram model has %s arc(s)", candidate_order, num_arcs)
+        if num_arcs <= max_arcs:
+            break
+
+        if candidate_order == 1:
+            _LOGGER.warning(
+                "Unigram model has more than %s arc(s): %s", max_arcs, num_arcs
+            )
+
+    _LOGGER.info("Using %s-gram model", ngram_order)
+
+    if write_arpa:
+        # Only for debugging
+        await tools.async_run(
+            "ngramprint",
+            ["--ARPA", str(ngram_fst_path), str(lang_local_dir / "lm.arpa")],
+        )
 
-    await tools.async_run(
-        "fstcompile",
-        [
-            shlex.quote(f"--isymbols={lang_dir}/words.txt"),
-            shlex.quote(f"--osymbols={lang_dir}/words.txt"),
-            "--keep_isymbols=true",
-            "--keep_osymbols=true",
-            shlex.quote(str(text_fst_path)),
-            shlex.quote(str(fst_path)),
-        ],
+    word_symbols = SymbolTable.load(lang_dir / "words.txt")
+    backoff_relabel_path = lang_local_dir / "backoff_relabel.txt"
+    backoff_relabel_path.write_text(
+        f"0 {word_symbols.get_id('#0')}\n", encoding="utf-8"
     )
+
+    # Nonterminals are replaced later
     await tools.async_run_pipeline(
         [
-            "ngramcount",
-            f"--order={order}",
-            shlex.quote(str(fst_path)),
-            "-",
+            "fstrelabel",
+            f"--relabel_ipairs={shlex.quote(str(backoff_relabel_path))}",
+            shlex.quote(str(ngram_fst_path)),
         ],
         [
-            "ngrammake",
-            f"--method={method}",
-        ],
-        [
-            "ngramprint",
-            "--ARPA",
+            "fstarcsort",
+            "--sort_type=ilabel",
             "-",
-            shlex.quote(str(arpa_path)),
+            shlex.quote(str(lang_dir / "G.template.fst")),
         ],
     )
 
-    arpa_gz_path = lang_local_dir / "lm.arpa.gz"
-    with open(arpa_path, "r", encoding="utf-8") as arpa_file, gzip.open(
-        arpa_gz_path, "wt", encoding="utf-8"
-    ) as arpa_gz_file:
-        shutil.copyfileobj(arpa_file, arpa_gz_file)  # type: ignore[misc]
 
-    await tools.async_run(
-        "bash",
-        [
-            str(tools.egs_utils_dir / "format_lm.sh"),
-            str(lang_dir),
-            str(arpa_gz_path),
-            str(dict_local_dir / "lexicon.txt"),
-            str(lang_dir),
-        ],
-    )
+def _get_num_arcs(fstinfo_output: str) -> int:
+    """Get number of arcs from fstinfo output."""
+    for line in fstinfo_output.splitlines():
+        if line.startswith("# of arcs"):
+            return int(line.split()[-1])
 
+    raise ValueError(f"Number of arcs not in fstinfo output: {fstinfo_output}")
 
-async def _create_fuzzy_fst(fst: Fst, train_dir: Path, tools: SpeechTools) -> None:
-    """Create FST to fuzzy match sentences and output names with exact casing, etc."""
-    data_dir = train_dir / "data"
-    lang_dir = data_dir / "lang"
 
-    fst_path = lang_dir / "G.arpa.fst"
-    text_fst_path = fst_path.with_suffix(".fst.txt")
+async def _replace_classes(
+    lang_dir: Path, class_fst_paths: Dict[str, Path], tools: SpeechTools
+) -> None:
+    """Splice sub-grammars into the template G.fst to create the final G.fst."""
+    template_fst_path = lang_dir / "G.template.fst"
+    fst_path = lang_dir / "G.fst"
 
-    # Create a version of the FST with self loops that allow skipping words
+    if not class_fst_paths:
+        shutil.copy(template_fst_path, fst_path)
+        return
+
+    word_symbols = SymbolTable.load(lang_dir / "words.txt")
+
+    # Root label must not collide with any word
+    replace_args = [
+        "--epsilon_on_replace",
+        shlex.quote(str(template_fst_path)),
+        str(max(word_symbols.ids.values()) + 1),
+    ]
+    for class_label, class_fst_path in class_fst_paths.items():
+        replace_args.extend(
+            (
+                shlex.quote(str(class_fst_path)),
+                str(word_symbols.get_id(class_label)),
+            )
+        )
+
+    await tools.async_run_pipeline(
+        ["fstreplace", *replace_args],
+        ["fstarcsort", "--sort_type=ilabel", "-", shlex.quote(str(fst_path))],
+    )
+
+
+async def _create_fuzzy_fst(
+    fst: CompactFst, word_symbols: SymbolTable, lang_dir: Path
+) -> None:
+    """Create FSTs to fuzzy match sentences and output names with exact casing, etc.
+
+    Word deletions are modeled by a single-state edit transducer that is
+    composed with the input before the sentence graph, instead of self loops
+    for every word on every state of the graph.
+    """
     fuzzy_fst_path = lang_dir / "G.fuzzy.fst"
-    text_fuzzy_fst_path = fuzzy_fst_path.with_suffix(".fst.txt")
+    edit_fst_path = lang_dir / "G.fuzzy_edit.fst"
     _LOGGER.debug("Creating fuzzy FST at %s", fuzzy_fst_path)
 
-    states: Set[str] = set()
+    def iter_fuzzy_arcs() -> Iterator[Tuple[int, List[VectorArc]]]:
+        for state, arcs in fst.vector_arcs(word_symbols, word_symbols):
+            # Copy transitions without probability
+            yield state, sorted(
+                (
+                    (in_label, out_label, 0.0, to_state)
+                    for in_label, out_label, _weight, to_state in arcs
+                ),
+                key=lambda arc: arc[0],
+            )
+
+    with open(fuzzy_fst_path, "wb") as fuzzy_fst_file:
+        write_vector_fst(
+            fuzzy_fst_file,
+            start=fst.start,
+            num_states=fst.num_states,
+            num_arcs=fst.num_arcs,
+            final_states=fst.final_states,
+            state_arcs=iter_fuzzy_arcs(),
+            isymbols=word_symbols,
+            osymbols=word_symbols,
+            properties=ILABEL_SORTED,
+        )
+
+    # Pass through every word, or remove it with a penalty (skip meta words)
+    edit_arcs: List[VectorArc] = []
+    for word in fst.words:
+        word_id = word_symbols.get_id(word)
+        edit_arcs.append((word_id, word_id, 0.0, 0))
+        if word[0] not in ("<", "_"):
+            edit_arcs.append((word_id, 0, 1.0, 0))
+
+    edit_arcs.sort()
+    with open(edit_fst_path, "wb") as edit_fst_file:
+        write_vector_fst(
+            edit_fst_file,
+            start=0,
+            num_states=1,
+            num_arcs=len(edit_arcs),
+            final_states={0},
+            state_arcs=[(0, edit_arcs)],
+            isymbols=word_symbols,
+            osymbols=word_symbols,
+            properties=ILABEL_SORTED,
+        )
+
+
+async def _make_hcl(model_dir: Path, train_dir: Path, tools: SpeechTools) -> None:
+    """Compose the HMM, context, and lexicon transducers into HCL.fst.
+
+    Disambiguation symbols are kept, so HCL.fst can be composed with any
+    G.fst over the same words.
+    """
+    lang_dir = train_dir / "data" / "lang"
+    hcl_dir = train_dir / "hcl"
+    am_dir = model_dir / "model"
+    tree_path = am_dir / "tree"
+    model_path = am_dir / "final.mdl"
+
+    _check_phones_compatible(am_dir / "phones.txt", lang_dir / "phones.txt")
+
+    if hcl_dir.exists():
+        shutil.rmtree(hcl_dir)
+
+    hcl_dir.mkdir(parents=True)
+
+    tree_info: Dict[str, str] = {}
+    for line in (
+        (await tools.async_run("tree-info", [str(tree_path)])).decode().splitlines()
+    ):
+        line_parts = line.split()
+        if len(line_parts) == 2:
+            tree_info[line_parts[0]] = line_parts[1]
+
+    context_size = tree_info["context-width"]
+    central_position = tree_info["central-position"]
+
+    ilabels_path = hcl_dir / "ilabels"
+    await tools.async_run_pipeline(
+        [
+            "fstcomposecontext",
+            f"--context-size={context_size}",
+            f"--central-position={central_position}",
+            f"--read-disambig-syms={lang_dir / 'phones' / 'disambig.int'}",
+            f"--write-disambig-syms={hcl_dir / 'disambig_ilabels.int'}",
+            str(ilabels_path),
+            str(lang_dir / "L_disambig.fst"),
+        ],
+        ["fstarcsort", "--sort_type=ilabel", "-", str(hcl_dir / "CL.fst")],
+    )
+
+    await tools.async_run(
+        "make-h-transducer",
+        [
+            f"--disambig-syms-out={hcl_dir / 'disambig_tid.int'}",
+            "--transition-scale=1.0",
+            str(ilabels_path),
+            str(tree_path),
+            str(model_path),
+            str(hcl_dir / "Ha.fst"),
+        ],
+    )
+
+    await tools.async_run_pipeline(
+        ["fsttablecompose", str(hcl_dir / "Ha.fst"), str(hcl_dir / "CL.fst")],
+        ["fstdeterminizestar", "--use-log=true"],
+        ["fstminimizeencoded"],
+        ["fstarcsort", "--sort_type=olabel", "-", str(hcl_dir / "HCL.fst")],
+    )
 
-    # Copy transitions and add self loops
-    with open(text_fst_path, "r", encoding="utf-8") as text_fst_file, open(
-        text_fuzzy_fst_path, "w", encoding="utf-8"
-    ) as text_fuzzy_fst_file:
-        for line in text_fst_file:
-            line = line.strip()
-            if not line:
-                continue
 
-            # Copy transition without probability
-            parts = line.split()
-            print(*parts[:4], file=text_fuzzy_fst_file)
+async def _make_hclg(model_dir: Path, train_dir: Path, tools: SpeechTools) -> None:
+    """Compose HCL.fst with G.fst and add HMM self loops into HCLG.fst."""
+    lang_dir = train_dir / "data" / "lang"
+    hcl_dir = train_dir / "hcl"
+    graph_dir = train_dir / "graph"
+    model_path = model_dir / "model" / "final.mdl"
 
-            state = line.split(maxsplit=1)[0]
-            if state in states:
-                continue
+    graph_dir.mkdir(parents=True, exist_ok=True)
+    hclga_path = graph_dir / "HCLGa.fst"
+    await tools.async_run_pipeline(
+        ["fsttablecompose", str(hcl_dir / "HCL.fst"), str(lang_dir / "G.fst")],
+        ["fstdeterminizestar", "--use-log=true"],
+        ["fstrmsymbols", str(hcl_dir / "disambig_tid.int")],
+        ["fstrmepslocal"],
+        ["fstminimizeencoded"],
+        ["fstpushspecial", "-", str(hclga_path)],
+    )
+
+    await tools.async_run_pipeline(
+        [
+            "add-self-loops",
+            "--self-loop-scale=1.0",
+            "--reorder=true",
+            str(model_path),
+            str(hclga_path),
+        ],
+        ["fstconvert", "--fst_type=const", "-", str(graph_dir / "HCLG.fst")],
+    )
+    hclga_path.unlink()
 
-            states.add(state)
+    _copy_graph_files(train_dir)
 
-        # Create self loops
-        for state in states:
-            # No penalty for <eps>
-            print(state, state, EPS, EPS, 0.0, file=text_fuzzy_fst_file)
 
-            for word in fst.words:
-                if word[0] in ("<", "_"):
-                    # Skip meta words
-                    continue
+async def _make_hcl_lookahead(
+    model_dir: Path, train_dir: Path, tools: SpeechTools
+) -> None:
+    """Create HCLr.fst for composing with Gr.fst during decoding.
 
-                # Penalty for word removal
-                print(state, state, word, EPS, 1.0, file=text_fuzzy_fst_file)
+    Output labels are relabeled for lookahead composition. The relabeling is
+    applied to the input labels of G.fst in _make_gr.
+    """
+    hcl_dir = train_dir / "hcl"
+    graph_dir = train_dir / "graph"
+    model_path = model_dir / "model" / "final.mdl"
 
+    graph_dir.mkdir(parents=True, exist_ok=True)
     await tools.async_run_pipeline(
         [
-            "fstcompile",
-            shlex.quote(f"--isymbols={lang_dir}/words.txt"),
-            shlex.quote(f"--osymbols={lang_dir}/words.txt"),
-            "--keep_isymbols=true",
-            "--keep_osymbols=true",
-            shlex.quote(str(text_fuzzy_fst_path)),
-            "-",
+            "fstrmsymbols",
+            str(hcl_dir / "disambig_tid.int"),
+            str(hcl_dir / "HCL.fst"),
         ],
+        ["fstrmepslocal"],
+        ["fstminimizeencoded"],
+        ["add-self-loops", "--self-loop-scale=1.0", "--reorder=true", str(model_path)],
         [
-            "fstarcsort",
-            "--sort_type=ilabel",
+            "fstconvert",
+            "--fst_type=olabel_lookahead",
+            f"--save_relabel_opairs={graph_dir / 'relabel'}",
             "-",
-            shlex.quote(str(fuzzy_fst_path)),
+            str(graph_dir / "HCLr.fst"),
         ],
     )
 
 
-async def _mkgraph(model_dir: Path, train_dir: Path, tools: SpeechTools) -> None:
-    """Generate HCLG.fst."""
-    data_dir = train_dir / "data"
-    lang_dir = data_dir / "lang"
+async def _make_gr(train_dir: Path, tools: SpeechTools) -> None:
+    """Relabel G.fst to match the output labels of HCLr.fst."""
+    lang_dir = train_dir / "data" / "lang"
     graph_dir = train_dir / "graph"
 
-    await tools.async_run(
-        "bash",
+    await tools.async_run_pipeline(
         [
-            str(tools.egs_utils_dir / "mkgraph.sh"),
-            "--self-loop-scale",
-            "1.0",
-            str(lang_dir),
-            str(model_dir / "model"),
-            str(graph_dir),
+            "fstrelabel",
+            f"--relabel_ipairs={graph_dir / 'relabel'}",
+            str(lang_dir / "G.fst"),
         ],
+        ["fstarcsort", "--sort_type=ilabel"],
+        ["fstconvert", "--fst_type=const", "-", str(graph_dir / "Gr.fst")],
     )
 
+    _copy_graph_files(train_dir)
+
+
+def _copy_graph_files(train_dir: Path) -> None:
+    """Keep a copy of the symbol tables and phone lists with the graph."""
+    lang_dir = train_dir / "data" / "lang"
+    hcl_dir = train_dir / "hcl"
+    graph_dir = train_dir / "graph"
+
+    shutil.copy(lang_dir / "words.txt", graph_dir / "words.txt")
+    shutil.copy(lang_dir / "phones.txt", graph_dir / "phones.txt")
+    shutil.copy(hcl_dir / "disambig_tid.int", graph_dir / "disambig_tid.int")
+
+    graph_phones_dir = graph_dir / "phones"
+    graph_phones_dir.mkdir(parents=True, exist_ok=True)
+    for phones_file_name in (
+        "word_boundary.txt",
+        "word_boundary.int",
+        "align_lexicon.txt",
+        "align_lexicon.int",
+        "optional_silence.txt",
+        "optional_silence.int",
+        "optional_silence.csl",
+        "disambig.txt",
+        "disambig.int",
+        "silence.csl",
+    ):
+        shutil.copy(
+            lang_dir / "phones" / phones_file_name, graph_phones_dir / phones_file_name
+        )
+
+
+async def build_decoding_graph(
+    model_dir: Path, train_dir: Path, tools: SpeechTools, lookahead: bool = False
+) -> None:
+    """Build decoding graph from an already trained HCL.fst and G.fst.
+
+    With lookahead, HCLr.fst and Gr.fst are created instead of HCLG.fst.
+    """
+    if lookahead:
+        await _make_hcl_lookahead(model_dir, train_dir, tools)
+        await _make_gr(train_dir, tools)
+    else:
+        await _make_hclg(model_dir, train_dir, tools)
+
+
+def _check_phones_compatible(model_phones_path: Path, lang_phones_path: Path) -> None:
+    """Check that the lang directory has the same phones as the acoustic model.
+
+    Disambiguation symbols may differ.
+    """
+    if not model_phones_path.is_file():
+        return
+
+    def read_phones(phones_path: Path) -> List[str]:
+        with open(phones_path, "r", encoding="utf-8") as phones_file:
+            return [
+                line.strip()
+                for line in phones_file
+                if line.strip() and (not line.startswith("#"))
+            ]
+
+    if read_phones(model_phones_path) != read_phones(lang_phones_path):
+        raise ValueError(
+            f"Phones in {lang_phones_path} don't match acoustic model: "
+            f"{model_phones_path}"
+        )
+
 
 async def _prepare_online_decoding(
     model_dir: Path, train_dir: Path, tools: SpeechTools
@@ -386,36 +935,3 @@ async def _prepare_online_decoding(
         ],
         cwd=train_dir,
     )
-
-
-# -----------------------------------------------------------------------------
-
-
-def _get_sentences_hash(
-    model: Model, settings: Settings, chunk_size: int = 8192
-) -> str:
-    """Get a hash of sentences YAML files (builtin and custom)."""
-    hasher = hashlib.sha256()
-
-    # Builtin sentences
-    sentences_path = settings.sentences / f"{model.sentences_language}.yaml"
-    with open(sentences_path, "rb") as sentences_file:
-        chunk = sentences_file.read(chunk_size)
-        hasher.update(chunk)
-
-    # Custom sentences
-    for custom_sentences_dir in settings.custom_sentences_dirs:
-        dir_for_language = custom_sentences_dir / model.language
-        if not dir_for_language.is_dir():
-            # Try language family
-            dir_for_language = custom_sentences_dir / model.language_family
-
-            if not dir_for_language.is_dir():
-                continue
-
-        for custom_sentences_path in sorted(dir_for_language.glob("*.yaml")):
-            with open(custom_sentences_path, "rb") as custom_sentences_file:
-                chunk = custom_sentences_file.read(chunk_size)
-                hasher.update(chunk)
-
-    return hasher.hexdigest()
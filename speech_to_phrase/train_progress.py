@@ -0,0 +1,199 @@
+"""Timings and progress of training stages."""
+
+import json
+import logging
+import statistics
+import time
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field, fields
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+from .speech_tools import collect_process_usage
+
+_LOGGER = logging.getLogger(__name__)
+
+_MAX_RUNS = 5
+
+
+@dataclass
+class StageTiming:
+    """Resources used by a training stage.
+
+    Only subprocesses run with SpeechTools in the stage's task are counted, not
+    those of concurrent stages or transcriptions.
+    """
+
+    name: str
+    wall_seconds: float = 0.0
+
+    cpu_seconds: float = 0.0
+    """User + system time of the stage's subprocesses."""
+
+    max_rss_mb: float = 0.0
+    """Peak resident set size of the stage's largest subprocess."""
+
+    output_bytes: Dict[str, int] = field(default_factory=dict)
+    """Output path -> size in bytes."""
+
+    skipped: bool = False
+    """True if the stage's outputs were already up to date."""
+
+
+@dataclass
+class TrainingRun:
+    """Timings of one training run."""
+
+    started: float
+    """Unix timestamp."""
+
+    total_seconds: float = 0.0
+    stages: List[StageTiming] = field(default_factory=list)
+
+
+class TrainingProgress:
+    """Records stage timings and estimates the time left in training.
+
+    The estimate is the median duration of previous runs of the same model,
+    which are kept in a JSON report in the train directory.
+    """
+
+    def __init__(
+        self, model_id: str, report_path: Optional[Union[str, Path]] = None
+    ) -> None:
+        """Load previous runs if a report exists."""
+        self.model_id = model_id
+        self.report_path = Path(report_path) if report_path is not None else None
+        self.previous_runs: List[TrainingRun] = []
+        self.run = TrainingRun(started=time.time())
+        self._start_time = time.monotonic()
+
+        if (self.report_path is not None) and self.report_path.exists():
+            try:
+                with open(self.report_path, "r", encoding="utf-8") as report_file:
+                    self.previous_runs = [
+                        _run_from_dict(run_dict)
+                        for run_dict in json.load(report_file)["runs"]
+                    ]
+            except Exception:  # pylint: disable=broad-exception-caught
+                _LOGGER.exception(
+                    "Failed to load training report: %s", self.report_path
+                )
+                self.previous_runs = []
+
+    @property
+    def elapsed_seconds(self) -> float:
+        """Seconds since training started."""
+        return time.monotonic() - self._start_time
+
+    @property
+    def expected_seconds(self) -> Optional[float]:
+        """Expected duration of training from previous runs."""
+        if not self.previous_runs:
+            return None
+
+        return statistics.median(run.total_seconds for run in self.previous_runs)
+
+    @property
+    def eta_seconds(self) -> Optional[float]:
+        """Expected seconds until training is finished."""
+        expected_seconds = self.expected_seconds
+        if expected_seconds is None:
+            return None
+
+        return max(0.0, expected_seconds - self.elapsed_seconds)
+
+    @contextmanager
+    def stage(self, name: str, outputs: Iterable[Path] = ()) -> Iterator[StageTiming]:
+        """Time a training stage and record it when it finishes."""
+        timing = StageTiming(name=name)
+        start_time = time.monotonic()
+
+        with collect_process_usage() as usages:
+            yield timing
+
+        timing.wall_seconds = time.monotonic() - start_time
+        timing.cpu_seconds = sum(usage.cpu_seconds for usage in usages)
+        timing.max_rss_mb = (
+            max((usage.max_rss_kb for usage in usages), default=0) / 1024
+        )
+        for output_path in outputs:
+            if output_path.is_file():
+                timing.output_bytes[self._relative_path(output_path)] = (
+                    output_path.stat().st_size
+                )
+
+        self.run.stages.append(timing)
+        self._log_stage(timing)
+
+    def finish(self) -> None:
+        """Record the total duration and save the report."""
+        self.run.total_seconds = self.elapsed_seconds
+        self.previous_runs = (self.previous_runs + [self.run])[-_MAX_RUNS:]
+        self.save()
+
+    def save(self) -> None:
+        """Write report with the latest runs to disk."""
+        if self.report_path is None:
+            return
+
+        self.report_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.report_path.with_suffix(".tmp")
+        with open(temp_path, "w", encoding="utf-8") as report_file:
+            json.dump(
+                {
+                    "model_id": self.model_id,
+                    "runs": [asdict(run) for run in self.previous_runs],
+                },
+                report_file,
+                indent=2,
+            )
+
+        temp_path.replace(self.report_path)
+
+    def _relative_path(self, path: Path) -> str:
+        if self.report_path is not None:
+            try:
+                return str(path.relative_to(self.report_path.parent))
+            except ValueError:
+                pass
+
+        return str(path)
+
+    def _log_stage(self, timing: StageTiming) -> None:
+        if timing.skipped:
+            _LOGGER.debug("Stage %s of %s is up to date", timing.name, self.model_id)
+            return
+
+        eta_seconds = self.eta_seconds
+        _LOGGER.info(
+            "Stage %s of %s: %.2fs wall, %.2fs CPU, %.1f MB max RSS, %.1f MB output%s",
+            timing.name,
+            self.model_id,
+            timing.wall_seconds,
+            timing.cpu_seconds,
+            timing.max_rss_mb,
+            sum(timing.output_bytes.values()) / (1024 * 1024),
+            f" (ETA {eta_seconds:.0f}s)" if eta_seconds is not None else "",
+            extra={"training_stage": asdict(timing)},
+        )
+
+
+def _run_from_dict(run_dict: Dict[str, Any]) -> TrainingRun:
+    # Ignore fields from other versions
+    stage_fields = {stage_field.name for stage_field in fields(StageTiming)}
+    return TrainingRun(
+        started=run_dict["started"],
+        total_seconds=run_dict["total_seconds"],
+        stages=[
+            StageTiming(
+                **{
+                    key: value
+                    for key, value in stage_dict.items()
+                    if key in stage_fields
+                }
+            )
+            for stage_dict in run_dict["stages"]
+        ],
+    )
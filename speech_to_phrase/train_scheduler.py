@@ -0,0 +1,196 @@
+"""Scheduling of training jobs."""
+
+import asyncio
+import heapq
+import itertools
+import logging
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Dict, List, Optional, Set
+
+from .worker_pool import WorkerPool
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class TrainingPriority(IntEnum):
+    """Priority of a training job (lower runs first)."""
+
+    CLIENT = 0
+    """A client is waiting for the model."""
+
+    BACKGROUND = 1
+    """Retraining on start or on an interval."""
+
+
+@dataclass(order=True)
+class _PendingJob:
+    priority: int
+    order: int
+    model_id: str = field(compare=False)
+
+
+class TrainingScheduler:
+    """Runs training jobs with a limited number of workers.
+
+    There is at most one job per model. Background jobs wait for active decodes
+    to finish before starting, up to max_defer_seconds.
+
+    Jobs share worker_pool for CPU-bound steps, so worker processes are reused
+    between trainings.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 1,
+        max_defer_seconds: float = 0,
+        worker_niceness: int = 0,
+    ) -> None:
+        self.max_workers = max(1, max_workers)
+        self.max_defer_seconds = max_defer_seconds
+        self.worker_pool = WorkerPool(
+            max_workers=self.max_workers, niceness=worker_niceness
+        )
+
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._pending: List[_PendingJob] = []
+        self._pending_by_model: Dict[str, _PendingJob] = {}
+        self._order = itertools.count()
+        self._num_running = 0
+        self._condition: Optional[asyncio.Condition] = None
+        self._notify_tasks: Set[asyncio.Task] = set()
+
+        self._num_decoding = 0
+        self._decoding_done: Optional[asyncio.Event] = None
+
+    @property
+    def num_running(self) -> int:
+        """Number of jobs that are currently running."""
+        return self._num_running
+
+    def schedule(
+        self,
+        model_id: str,
+        job: Callable[[], Awaitable[None]],
+        priority: TrainingPriority = TrainingPriority.BACKGROUND,
+    ) -> asyncio.Task:
+        """Queue a training job for a model.
+
+        If the model already has a job, it is returned instead and its priority
+        is raised if it hasn't started yet.
+        """
+        task = self._tasks.get(model_id)
+        if task is not None:
+            pending_job = self._pending_by_model.get(model_id)
+            if (pending_job is not None) and (priority < pending_job.priority):
+                pending_job.priority = priority
+                heapq.heapify(self._pending)
+
+            return task
+
+        pending_job = _PendingJob(priority, next(self._order), model_id)
+        heapq.heappush(self._pending, pending_job)
+        self._pending_by_model[model_id] = pending_job
+
+        task = asyncio.create_task(self._run(pending_job, job))
+        self._tasks[model_id] = task
+        task.add_done_callback(lambda done_task: self._job_done(done_task, pending_job))
+
+        return task
+
+    async def cancel_all(self) -> List[str]:
+        """Cancel all queued and running jobs, returning their model ids."""
+        tasks = dict(self._tasks)
+        for task in tasks.values():
+            task.cancel()
+
+        if tasks:
+            await asyncio.wait(tasks.values())
+
+        return sorted(tasks)
+
+    def start_decoding(self) -> None:
+        """Mark a decode as active."""
+        self._num_decoding += 1
+        self._get_decoding_done().clear()
+
+    def stop_decoding(self) -> None:
+        """Mark a decode as finished."""
+        self._num_decoding = max(0, self._num_decoding - 1)
+        if self._num_decoding == 0:
+            self._get_decoding_done().set()
+
+    async def _run(
+        self, pending_job: _PendingJob, job: Callable[[], Awaitable[None]]
+    ) -> None:
+        condition = self._get_condition()
+
+        async with condition:
+            await condition.wait_for(
+                lambda: (self._num_running < self.max_workers)
+                and (self._pending[0] is pending_job)
+            )
+            self._remove_pending(pending_job)
+            self._num_running += 1
+
+            # Next job may be able to start
+            condition.notify_all()
+
+        try:
+            if pending_job.priority > TrainingPriority.CLIENT:
+                await self._wait_for_decoding(pending_job.model_id)
+
+            await job()
+        finally:
+            async with condition:
+                self._num_running -= 1
+                condition.notify_all()
+
+    def _job_done(self, task: asyncio.Task, pending_job: _PendingJob) -> None:
+        if self._tasks.get(pending_job.model_id) is task:
+            self._tasks.pop(pending_job.model_id)
+
+        if self._pending_by_model.get(pending_job.model_id) is pending_job:
+            # Cancelled before starting
+            self._remove_pending(pending_job)
+            notify_task = asyncio.create_task(self._notify_all())
+            self._notify_tasks.add(notify_task)
+            notify_task.add_done_callback(self._notify_tasks.discard)
+
+    def _remove_pending(self, pending_job: _PendingJob) -> None:
+        self._pending.remove(pending_job)
+        heapq.heapify(self._pending)
+        self._pending_by_model.pop(pending_job.model_id, None)
+
+    async def _notify_all(self) -> None:
+        condition = self._get_condition()
+        async with condition:
+            condition.notify_all()
+
+    async def _wait_for_decoding(self, model_id: str) -> None:
+        """Defer training while decodes are active."""
+        if (self._num_decoding <= 0) or (self.max_defer_seconds <= 0):
+            return
+
+        _LOGGER.debug("Deferring training of %s while decoding", model_id)
+        try:
+            await asyncio.wait_for(
+                self._get_decoding_done().wait(), timeout=self.max_defer_seconds
+            )
+        except asyncio.TimeoutError:
+            _LOGGER.debug("Starting training of %s while decoding", model_id)
+
+    def _get_condition(self) -> asyncio.Condition:
+        # Created lazily inside the event loop (required for Python < 3.10)
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+
+        return self._condition
+
+    def _get_decoding_done(self) -> asyncio.Event:
+        if self._decoding_done is None:
+            self._decoding_done = asyncio.Event()
+            self._decoding_done.set()
+
+        return self._decoding_done
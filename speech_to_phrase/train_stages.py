@@ -0,0 +1,293 @@
+"""Memoized training stages."""
+
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections.abc import Awaitable, Callable, Iterable, Sequence
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple, Union
+
+from .hashing import FileHashCache
+from .train_progress import TrainingProgress
+
+_LOGGER = logging.getLogger(__name__)
+
+HashInput = Union[str, bytes, Path]
+
+
+@dataclass
+class StageRecord:
+    """Hashes of a completed training stage's inputs and outputs."""
+
+    inputs_hash: str
+    outputs: Dict[str, str] = field(default_factory=dict)
+    """Output path -> file hash."""
+
+
+@dataclass
+class Stage:
+    """Training stage in a dependency graph.
+
+    A stage depends on the stages that produce any of its input paths.
+    """
+
+    name: str
+    inputs: Sequence[HashInput]
+    """Strings, bytes, and files that the stage's result depends on."""
+
+    outputs: Sequence[Path]
+    func: Callable[[], Awaitable[None]]
+
+    memoize: bool = True
+    """If False, the stage always runs."""
+
+
+class StageManifest:
+    """Dependency manifest for training stages.
+
+    Each stage records a hash of its inputs and the hashes of the files it
+    produced. A stage is skipped when its inputs are unchanged and its outputs
+    are still intact on disk.
+    """
+
+    def __init__(
+        self,
+        manifest_path: Union[str, Path],
+        file_hashes: Optional[FileHashCache] = None,
+    ) -> None:
+        """Load manifest if it exists."""
+        self.manifest_path = Path(manifest_path)
+        self.file_hashes = file_hashes if file_hashes is not None else FileHashCache()
+        self.stages: Dict[str, StageRecord] = {}
+
+        if self.manifest_path.exists():
+            try:
+                with open(self.manifest_path, "r", encoding="utf-8") as manifest_file:
+                    self.stages = {
+                        stage_name: StageRecord(**stage_dict)
+                        for stage_name, stage_dict in json.load(manifest_file).items()
+                    }
+            except Exception:  # pylint: disable=broad-exception-caught
+                _LOGGER.exception(
+                    "Failed to load training manifest: %s", self.manifest_path
+                )
+                self.stages = {}
+
+    def is_complete(
+        self,
+        stage_name: str,
+        inputs_hash: str,
+        outputs: Optional[Iterable[Path]] = None,
+    ) -> bool:
+        """True if stage has completed with the same inputs and outputs.
+
+        If outputs are given, the stage must also have recorded exactly those
+        output paths.
+        """
+        record = self.stages.get(stage_name)
+        if (record is None) or (record.inputs_hash != inputs_hash):
+            return False
+
+        if (outputs is not None) and (
+            {str(output_path) for output_path in outputs} != set(record.outputs)
+        ):
+            _LOGGER.debug("Outputs changed for stage %s", stage_name)
+            return False
+
+        for output_path_str, output_hash in record.outputs.items():
+            output_path = Path(output_path_str)
+            if (not output_path.is_file()) or (
+                self.file_hashes.hash_file(output_path) != output_hash
+            ):
+                _LOGGER.debug(
+                    "Output changed for stage %s: %s", stage_name, output_path
+                )
+                return False
+
+        return True
+
+    def invalidate(self, stage_name: str) -> None:
+        """Remove stage record (before re-running it)."""
+        if self.stages.pop(stage_name, None) is not None:
+            self.save()
+
+    def mark_complete(
+        self, stage_name: str, inputs_hash: str, outputs: Iterable[Path]
+    ) -> None:
+        """Record that a stage completed and save the manifest."""
+        self.stages[stage_name] = StageRecord(
+            inputs_hash=inputs_hash,
+            outputs={
+                str(output_path): self.file_hashes.hash_file(output_path)
+                for output_path in outputs
+            },
+        )
+        self.save()
+
+    def hash_inputs(self, *inputs: HashInput) -> str:
+        """Hash stage inputs, using cached hashes for unchanged files."""
+        return hash_inputs(*inputs, file_hashes=self.file_hashes)
+
+    def save(self) -> None:
+        """Write manifest to disk."""
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.manifest_path.with_suffix(".tmp")
+        with open(temp_path, "w", encoding="utf-8") as manifest_file:
+            json.dump(
+                {
+                    stage_name: asdict(record)
+                    for stage_name, record in self.stages.items()
+                },
+                manifest_file,
+                indent=2,
+            )
+
+        temp_path.replace(self.manifest_path)
+        self.file_hashes.save()
+
+    async def run_stage(
+        self,
+        stage_name: str,
+        inputs_hash: str,
+        outputs: Iterable[Path],
+        stage_func: Callable[[], Awaitable[None]],
+    ) -> bool:
+        """Run stage if its inputs or outputs have changed.
+
+        Returns True if the stage was run.
+        """
+        outputs = list(outputs)
+        if self.is_complete(stage_name, inputs_hash, outputs):
+            _LOGGER.debug("Skipping stage: %s", stage_name)
+            return False
+
+        # An interrupted stage must not be considered complete
+        self.invalidate(stage_name)
+
+        _LOGGER.debug("Running stage: %s", stage_name)
+        await stage_func()
+        self.mark_complete(stage_name, inputs_hash, outputs)
+
+        return True
+
+    async def run_graph(
+        self,
+        stages: Sequence[Stage],
+        max_concurrent: int = 1,
+        progress: Optional[TrainingProgress] = None,
+    ) -> List[Tuple[str, float]]:
+        """Run stages concurrently once the stages they depend on are finished.
+
+        Stages must come after the stages that produce their inputs.
+        Returns the critical path as (stage name, seconds) pairs.
+        """
+        if progress is None:
+            progress = TrainingProgress("")
+
+        producers: Dict[Path, str] = {}
+        dependencies: Dict[str, Set[str]] = {}
+        for stage in stages:
+            dependencies[stage.name] = {
+                producers[stage_input]
+                for stage_input in stage.inputs
+                if isinstance(stage_input, Path) and (stage_input in producers)
+            }
+            for output_path in stage.outputs:
+                producers[output_path] = stage.name
+
+        semaphore = asyncio.Semaphore(max(1, max_concurrent))
+        tasks: Dict[str, asyncio.Task] = {}
+        times: Dict[str, Tuple[float, float]] = {}
+
+        async def run_one(stage: Stage) -> None:
+            await asyncio.gather(*(tasks[name] for name in dependencies[stage.name]))
+
+            async with semaphore:
+                start_time = time.monotonic()
+                with progress.stage(stage.name, stage.outputs) as stage_timing:
+                    if stage.memoize:
+                        stage_timing.skipped = not await self.run_stage(
+                            stage.name,
+                            self.hash_inputs(*stage.inputs),
+                            stage.outputs,
+                            stage.func,
+                        )
+                    else:
+                        _LOGGER.debug("Running stage: %s", stage.name)
+                        await stage.func()
+
+                times[stage.name] = (start_time, time.monotonic())
+
+        for stage in stages:
+            tasks[stage.name] = asyncio.create_task(run_one(stage))
+
+        try:
+            await asyncio.gather(*tasks.values())
+        finally:
+            # Stop remaining stages if one failed or training was cancelled
+            for task in tasks.values():
+                task.cancel()
+
+            if tasks:
+                await asyncio.wait(tasks.values())
+
+        critical_path = _get_critical_path(dependencies, times)
+        if critical_path:
+            _LOGGER.info(
+                "Critical path: %s",
+                " -> ".join(
+                    f"{name} ({seconds:.2f}s)" for name, seconds in critical_path
+                ),
+            )
+
+        return critical_path
+
+
+def _get_critical_path(
+    dependencies: Dict[str, Set[str]], times: Dict[str, Tuple[float, float]]
+) -> List[Tuple[str, float]]:
+    """Follow the last dependency to finish back from the last stage."""
+    critical_path: List[Tuple[str, float]] = []
+    if not times:
+        return critical_path
+
+    stage_name: Optional[str] = max(times, key=lambda name: times[name][1])
+    while stage_name is not None:
+        start_time, end_time = times[stage_name]
+        critical_path.append((stage_name, end_time - start_time))
+        stage_name = max(
+            dependencies[stage_name],
+            key=lambda name: times[name][1],
+            default=None,
+        )
+
+    critical_path.reverse()
+
+    return critical_path
+
+
+# -----------------------------------------------------------------------------
+
+
+def hash_inputs(*inputs: HashInput, file_hashes: Optional[FileHashCache] = None) -> str:
+    """Hash strings, bytes, and file contents into a single hash."""
+    if file_hashes is None:
+        file_hashes = FileHashCache()
+
+    hasher = hashlib.sha256()
+    for stage_input in inputs:
+        if isinstance(stage_input, Path):
+            stage_input = (
+                file_hashes.hash_file(stage_input) if stage_input.is_file() else ""
+            )
+
+        if isinstance(stage_input, str):
+            stage_input = stage_input.encode("utf-8")
+
+        hasher.update(stage_input)
+        hasher.update(b"\0")
+
+    return hasher.hexdigest()
@@ -71,6 +71,7 @@ async def transcribe_coqui_stt(
         train_dir,
         settings.tools,
         sentence_prob_threshold=model.sentence_prob_threshold,
+        lazy_compose=settings.coqui_lazy_compose,
     )
 
 
@@ -80,6 +81,7 @@ async def _decode_probs(
     tools: SpeechTools,
     prune_threshold: Optional[float] = None,
     sentence_prob_threshold: Optional[float] = None,
+    lazy_compose: bool = False,
 ) -> str:
     if not probs:
         # Nothing to decode
@@ -144,7 +146,17 @@ async def _decode_probs(
 
         # tokens -> chars -> words -> sentences
         tokens_txt = train_dir / "tokens_with_blank.txt"
-        token2sen_fst = train_dir / "token2sen.fst"
+        if lazy_compose:
+            # Only paths reachable from the pruned logits are expanded
+            compose_commands = [
+                ["fstcompose", "-", shlex.quote(str(train_dir / fst_name))]
+                for fst_name in ("token2char.fst", "char2word.fst", "word2sen.fst")
+            ]
+        else:
+            compose_commands = [
+                ["fstcompose", "-", shlex.quote(str(train_dir / "token2sen.fst"))]
+            ]
+
         stdout = await tools.async_run_pipeline(
             [
                 "fstcompile",
@@ -158,7 +170,7 @@ async def _decode_probs(
             ["fstpush", "--push_weights"],
             ["fstarcsort", "--sort_type=olabel"],
             ["fstprune", f"--weight={prune_threshold}"],  # prune logits
-            ["fstcompose", "-", shlex.quote(str(token2sen_fst))],
+            *compose_commands,
             ["fstshortestpath"],
             ["fstproject", "--project_type=output"],
             ["fstrmepsilon"],
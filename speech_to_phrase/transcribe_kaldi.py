@@ -4,14 +4,17 @@ import asyncio
 import io
 import logging
 import shlex
+import struct
 import tempfile
+import time
 from collections.abc import AsyncIterable
 from pathlib import Path
 from typing import List, Optional, Tuple
 
-from .const import EPS, Settings
+from .const import CHANNELS, EPS, RATE, WIDTH, Settings
 from .hassil_fst import Fst, decode_meta
 from .models import Model
+from .openfst import SymbolTable
 from .speech_tools import SpeechTools
 
 _LOGGER = logging.getLogger(__name__)
@@ -32,6 +35,9 @@ NBEST_PENALTY = 0.1
 # Max penalty before we declare the sentence to be OOV
 MAX_FUZZY_COST = 2.0
 
+# RIFF and data chunk size for a WAV stream of unknown length
+_WAV_STREAM_SIZE = 0xFFFFFFFF
+
 
 async def transcribe_kaldi(
     model: Model, settings: Settings, audio_stream: AsyncIterable[bytes]
@@ -49,38 +55,15 @@ async def transcribe_kaldi(
 
     with tempfile.NamedTemporaryFile("wb+") as lattice_file:
         lattice_path = lattice_file.name
-        program = "online2-cli-nnet3-decode-faster"
-        args = [
-            f"--config={online_conf}",
-            f"--max-active={MAX_ACTIVE}",
-            f"--lattice-beam={LATTICE_BEAM}",
-            f"--acoustic-scale={DECODE_ACOUSTIC_SCALE}",
-            f"--beam={BEAM}",
-            str(model_file),
-            str(graph_dir / "HCLG.fst"),
-            str(words_txt),
-            f"ark:{lattice_path}",
-        ]
-        _LOGGER.debug("%s %s", program, args)
-        proc = await asyncio.create_subprocess_exec(
-            program,
-            *args,
-            stdin=asyncio.subprocess.PIPE,
-            stdout=asyncio.subprocess.PIPE,
-            env=tools.extended_env,
-        )
-        assert proc.stdin is not None
-        assert proc.stdout is not None
-
-        stream_has_chunks = False
-        async for chunk in audio_stream:
-            proc.stdin.write(chunk)
-            await proc.stdin.drain()
-            stream_has_chunks = True
-
-        _LOGGER.debug("Stream ended")
-        proc.stdin.write_eof()
-        await proc.communicate()
+        if (graph_dir / "HCLr.fst").is_file() and (graph_dir / "Gr.fst").is_file():
+            # Grammar is composed during decoding
+            stream_has_chunks = await _decode_lookahead(
+                model_file, online_conf, graph_dir, lattice_path, audio_stream, tools
+            )
+        else:
+            stream_has_chunks = await _decode_hclg(
+                model_file, online_conf, graph_dir, lattice_path, audio_stream, tools
+            )
 
         if not stream_has_chunks:
             # Can't transcribe nothing
@@ -128,6 +111,165 @@ async def transcribe_kaldi(
         return decode_meta(text)
 
 
+def get_decode_command(
+    model_file: Path,
+    online_conf: Path,
+    graph_dir: Path,
+    lattice_path: str,
+    lookahead: bool = False,
+) -> List[str]:
+    """Get command that decodes audio from stdin into a lattice.
+
+    Without lookahead, raw audio is decoded with HCLG.fst.
+    With lookahead, a WAV stream (see get_wav_stream_header) is decoded with
+    HCLr.fst and Gr.fst.
+    """
+    decode_args = [
+        f"--config={online_conf}",
+        f"--max-active={MAX_ACTIVE}",
+        f"--lattice-beam={LATTICE_BEAM}",
+        f"--acoustic-scale={DECODE_ACOUSTIC_SCALE}",
+        f"--beam={BEAM}",
+    ]
+
+    if not lookahead:
+        return [
+            "online2-cli-nnet3-decode-faster",
+            *decode_args,
+            str(model_file),
+            str(graph_dir / "HCLG.fst"),
+            str(graph_dir / "words.txt"),
+            f"ark:{lattice_path}",
+        ]
+
+    subsampling_path = model_file.parent / "frame_subsampling_factor"
+    if subsampling_path.is_file():
+        decode_args.append(
+            f"--frame-subsampling-factor={subsampling_path.read_text().strip()}"
+        )
+
+    return [
+        "online2-wav-nnet3-latgen-faster-lookahead",
+        *decode_args,
+        str(model_file),
+        str(graph_dir / "HCLr.fst"),
+        str(graph_dir / "Gr.fst"),
+        "ark:echo utt1 utt1|",
+        "scp:echo utt1 -|",  # WAV from stdin
+        f"ark:{lattice_path}",
+    ]
+
+
+def get_wav_stream_header() -> bytes:
+    """Get header of a WAV stream whose length isn't known in advance.
+
+    Kaldi reads the audio after this header until the end of the stream.
+    """
+    block_align = WIDTH * CHANNELS
+    return (
+        struct.pack("<4sI4s", b"RIFF", _WAV_STREAM_SIZE, b"WAVE")
+        + struct.pack(
+            "<4sIHHIIHH",
+            b"fmt ",
+            16,  # chunk size
+            1,  # PCM
+            CHANNELS,
+            RATE,
+            RATE * block_align,  # bytes per second
+            block_align,
+            WIDTH * 8,  # bits per sample
+        )
+        + struct.pack("<4sI", b"data", _WAV_STREAM_SIZE)
+    )
+
+
+async def _decode_hclg(
+    model_file: Path,
+    online_conf: Path,
+    graph_dir: Path,
+    lattice_path: str,
+    audio_stream: AsyncIterable[bytes],
+    tools: SpeechTools,
+) -> bool:
+    """Decode streaming audio with HCLG.fst.
+
+    Returns False if the stream had no audio.
+    """
+    command = get_decode_command(model_file, online_conf, graph_dir, lattice_path)
+    _LOGGER.debug(command)
+    proc = await asyncio.create_subprocess_exec(
+        *command,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        env=tools.extended_env,
+    )
+    assert proc.stdin is not None
+    assert proc.stdout is not None
+
+    stream_has_chunks = False
+    async for chunk in audio_stream:
+        proc.stdin.write(chunk)
+        await proc.stdin.drain()
+        stream_has_chunks = True
+
+    _LOGGER.debug("Stream ended")
+    proc.stdin.write_eof()
+    await proc.communicate()
+
+    return stream_has_chunks
+
+
+async def _decode_lookahead(
+    model_file: Path,
+    online_conf: Path,
+    graph_dir: Path,
+    lattice_path: str,
+    audio_stream: AsyncIterable[bytes],
+    tools: SpeechTools,
+) -> bool:
+    """Decode streaming audio with HCLr.fst composed on the fly with Gr.fst.
+
+    The decoder is started on the first chunk, so the graphs are loaded while
+    audio is still streaming. It doesn't produce a lattice until the stream
+    ends, though. Returns False if the stream had no audio.
+    """
+    command = get_decode_command(
+        model_file, online_conf, graph_dir, lattice_path, lookahead=True
+    )
+    proc: "Optional[asyncio.subprocess.Process]" = None
+
+    async for chunk in audio_stream:
+        if proc is None:
+            _LOGGER.debug(command)
+            proc = await asyncio.create_subprocess_exec(
+                *command,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                env=tools.extended_env,
+            )
+            assert proc.stdin is not None
+            proc.stdin.write(get_wav_stream_header())
+
+        assert proc.stdin is not None
+        proc.stdin.write(chunk)
+        await proc.stdin.drain()
+
+    _LOGGER.debug("Stream ended")
+    if proc is None:
+        return False
+
+    assert proc.stdin is not None
+    end_time = time.monotonic()
+    proc.stdin.write_eof()
+    await proc.communicate()
+    _LOGGER.debug(
+        "Lookahead decoding finished %.3fs after stream ended",
+        time.monotonic() - end_time,
+    )
+
+    return True
+
+
 async def _get_fuzzy_text(
     nbest_stdout: bytes,
     lang_dir: Path,
@@ -138,6 +280,7 @@ async def _get_fuzzy_text(
         return None
 
     words_txt = lang_dir / "words.txt"
+    edit_fst_path = lang_dir / "G.fuzzy_edit.fst"
 
     # Get best fuzzy transcription
     input_fst = Fst()
@@ -159,24 +302,30 @@ async def _get_fuzzy_text(
             # Each lower nbest candidate should be penalized more
             penalty += NBEST_PENALTY
 
-    with io.StringIO() as input_fst_file:
-        input_fst.write(input_fst_file)
-        input_fst_file.flush()
-        input_fst_file.seek(0)
+    # Labels are already word ids
+    input_symbols = SymbolTable(name="words", ids={EPS: 0})
+    input_symbols.ids.update((word, int(word)) for word in input_fst.words)
+
+    with io.BytesIO() as input_fst_file:
+        input_fst.write_binary(input_fst_file, input_symbols)
+
+        compose_commands: List[List[str]] = []
+        if edit_fst_path.exists():
+            # Word deletions are in a separate edit transducer
+            compose_commands.append(
+                ["fstcompose", "-", shlex.quote(str(edit_fst_path))]
+            )
+
+        compose_commands.append(["fstcompose", "-", shlex.quote(str(fuzzy_fst_path))])
 
         stdout = await tools.async_run_pipeline(
-            ["fstcompile"],
-            [
-                "fstcompose",
-                "-",
-                shlex.quote(str(fuzzy_fst_path)),
-            ],
+            *compose_commands,
             ["fstshortestpath"],
             ["fstrmepsilon"],
             ["fsttopsort"],
             ["fstproject", "--project_type=output"],
             ["fstprint", f"--osymbols={words_txt}"],
-            input=input_fst_file.getvalue().encode("utf-8"),
+            input=input_fst_file.getvalue(),
         )
 
         # _LOGGER.debug("Fuzzy output: %s", stdout.decode("utf-8"))
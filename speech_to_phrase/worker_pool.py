@@ -0,0 +1,151 @@
+"""Long-lived worker processes for CPU-bound steps of training."""
+
+import asyncio
+import logging
+import multiprocessing
+import multiprocessing.context
+import os
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, List, Optional, TypeVar
+
+_LOGGER = logging.getLogger(__name__)
+
+_T = TypeVar("_T")
+
+
+class WorkerPool:
+    """Worker processes that are started on first use and reused afterwards.
+
+    Workers are spawned (not forked) and run with lower priority. Log records
+    from workers are handled by the loggers of this process.
+
+    A process pool can't stop a single running job, so cancelling a job stops
+    all workers. Other running jobs are retried on new workers.
+    """
+
+    def __init__(self, max_workers: int = 1, niceness: int = 0) -> None:
+        self.max_workers = max(1, max_workers)
+        self.niceness = niceness
+
+        self._mp_context = _TrackingSpawnContext()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._log_queue: "Optional[multiprocessing.Queue[Any]]" = None
+        self._log_listener: Optional[QueueListener] = None
+
+    async def run(self, func: Callable[..., _T], *args: Any) -> _T:
+        """Run func(*args) in a worker process.
+
+        func and args must be picklable.
+        """
+        while True:
+            executor = self._get_executor()
+            try:
+                return await asyncio.get_running_loop().run_in_executor(
+                    executor, func, *args
+                )
+            except asyncio.CancelledError:
+                # Stop work on stale inputs
+                self._stop_workers(executor)
+                raise
+            except BrokenProcessPool:
+                if executor is self._executor:
+                    # Worker crashed
+                    self._stop_workers(executor)
+                    raise
+
+                _LOGGER.debug("Retrying job after workers were stopped")
+
+    def shutdown(self) -> None:
+        """Stop all workers and log forwarding."""
+        if self._executor is not None:
+            self._stop_workers(self._executor)
+
+        if self._log_listener is not None:
+            self._log_listener.stop()
+            self._log_listener = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is not None:
+            return self._executor
+
+        if self._log_queue is None:
+            self._log_queue = self._mp_context.Queue()
+            self._log_listener = QueueListener(self._log_queue, _ForwardLogHandler())
+            self._log_listener.start()
+
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=self._mp_context,
+            initializer=_init_worker,
+            initargs=(
+                self._log_queue,
+                logging.getLogger().getEffectiveLevel(),
+                self.niceness,
+            ),
+        )
+
+        return self._executor
+
+    def _stop_workers(self, executor: ProcessPoolExecutor) -> None:
+        if executor is not self._executor:
+            # Already stopped
+            return
+
+        self._executor = None
+
+        # Don't block the event loop
+        executor.shutdown(wait=False, cancel_futures=True)
+        for process in self._mp_context.take_processes():
+            if process.pid is None:
+                # Not started
+                continue
+
+            try:
+                process.kill()
+            except (OSError, ValueError):
+                # Already exited or closed
+                pass
+
+
+class _TrackingSpawnContext(multiprocessing.context.SpawnContext):
+    """Spawn context that keeps the worker processes it creates."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._processes: List[multiprocessing.process.BaseProcess] = []
+
+    # pylint: disable-next=invalid-name
+    def Process(self, *args: Any, **kwargs: Any) -> Any:  # type: ignore[override]
+        """Create a worker process and remember it."""
+        process = multiprocessing.context.SpawnProcess(*args, **kwargs)
+        self._processes.append(process)
+        return process
+
+    def take_processes(self) -> List[multiprocessing.process.BaseProcess]:
+        """Get and forget the processes created so far."""
+        processes, self._processes = self._processes, []
+        return processes
+
+
+def _init_worker(
+    log_queue: "multiprocessing.Queue[Any]", log_level: int, niceness: int
+) -> None:
+    """Lower worker priority and send log records back to the parent."""
+    if niceness > 0:
+        os.nice(niceness)
+
+    root_logger = logging.getLogger()
+    root_logger.handlers = [QueueHandler(log_queue)]
+    root_logger.setLevel(log_level)
+
+
+class _ForwardLogHandler(logging.Handler):
+    """Handle a log record from a worker process with the logger of its name."""
+
+    def emit(self, record: logging.LogRecord) -> None:
+        logger = logging.getLogger(record.name)
+        if logger.isEnabledFor(record.levelno):
+            logger.handle(record)
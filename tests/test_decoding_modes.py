@@ -0,0 +1,122 @@
+"""Tests for optional decoding modes with the real speech tools.
+
+Tests are skipped unless the model and tools are in the local directory.
+"""
+
+import shutil
+import tempfile
+from pathlib import Path
+from typing import List
+
+import pytest
+from pysilero_vad import SileroVoiceActivityDetector
+
+from speech_to_phrase import MODELS, Model, Settings, Things, train, transcribe
+from speech_to_phrase.audio import wav_audio_stream
+from speech_to_phrase.util import yaml
+
+from . import LOCAL_DIR, SETTINGS, TESTS_DIR
+
+
+@pytest.mark.asyncio
+async def test_ngram_g_fst() -> None:
+    """Test G.fst built directly from the opengrm model (no ARPA text)."""
+    model = MODELS["en"]
+    _require(model, ["ngramcount", "ngrammake", "fstrelabel", "fstreplace"])
+
+    with tempfile.TemporaryDirectory() as temp_dir_str:
+        settings = _make_settings(temp_dir_str)
+        await _train_and_transcribe(model, settings)
+
+        data_dir = settings.model_train_dir(model.id) / "data"
+        assert (data_dir / "lang" / "G.fst").stat().st_size > 0
+        for arpa_name in ("lm.arpa", "lm.arpa.gz"):
+            assert not (data_dir / "local" / "lang" / arpa_name).exists()
+
+
+@pytest.mark.asyncio
+async def test_lookahead_decoding() -> None:
+    """Test lookahead composition of HCLr.fst and Gr.fst during decoding."""
+    model = MODELS["en"]
+    _require(
+        model, ["fstconvert", "online2-wav-nnet3-latgen-faster-lookahead", "fstinfo"]
+    )
+
+    with tempfile.TemporaryDirectory() as temp_dir_str:
+        settings = _make_settings(temp_dir_str, lookahead_min_arcs=0)
+        await _train_and_transcribe(model, settings)
+
+        graph_dir = settings.model_train_dir(model.id) / "graph"
+        assert not (graph_dir / "HCLG.fst").exists()
+
+        # HCL.fst was converted with --fst_type=olabel_lookahead
+        fst_info = (
+            await settings.tools.async_run("fstinfo", [str(graph_dir / "HCLr.fst")])
+        ).decode()
+        assert "olabel_lookahead" in fst_info
+        assert (graph_dir / "Gr.fst").stat().st_size > 0
+
+
+@pytest.mark.asyncio
+async def test_coqui_lazy_compose() -> None:
+    """Test composing the Coqui STT graphs during decoding."""
+    model = MODELS["el"]
+    _require(model, ["fstcompose", "fstcompile", "fstshortestpath"])
+    if not (LOCAL_DIR / "stt_onlyprobs").is_file():
+        pytest.skip("stt_onlyprobs is not in local directory")
+
+    with tempfile.TemporaryDirectory() as temp_dir_str:
+        settings = _make_settings(temp_dir_str, coqui_lazy_compose=True)
+        await _train_and_transcribe(model, settings)
+
+        train_dir = settings.model_train_dir(model.id)
+        assert not (train_dir / "token2sen.fst").exists()
+
+
+# -----------------------------------------------------------------------------
+
+
+def _require(model: Model, programs: List[str]) -> None:
+    """Skip test if the model or any of the programs is missing."""
+    if not SETTINGS.model_data_dir(model.id).is_dir():
+        pytest.skip(f"Model is not in local directory: {model.id}")
+
+    tools_path = SETTINGS.tools.extended_env["PATH"]
+    for program in programs:
+        if shutil.which(program, path=tools_path) is None:
+            pytest.skip(f"Program is not in local directory: {program}")
+
+
+def _make_settings(train_dir: str, **kwargs) -> Settings:
+    return Settings(
+        models_dir=SETTINGS.models_dir,
+        train_dir=Path(train_dir),
+        tools_dir=LOCAL_DIR,
+        hass_token="",
+        hass_websocket_uri="",
+        retrain_on_connect=False,
+        custom_sentences_dirs=[],
+        **kwargs,
+    )
+
+
+async def _train_and_transcribe(model: Model, settings: Settings) -> None:
+    """Train with test fixtures and check the transcript of one test WAV."""
+    language = model.language_family
+    with open(
+        TESTS_DIR / "fixtures" / f"{language}.yaml", "r", encoding="utf-8"
+    ) as fixtures_file:
+        things = Things.from_dict(yaml.load(fixtures_file)["fixtures"])
+
+    await train(model, settings, things)
+
+    wav_dir = TESTS_DIR / "wav" / language
+    wav_path = next(
+        p
+        for p in sorted(wav_dir.glob("*.wav")) + sorted(wav_dir.glob("generated/*.wav"))
+        if not p.name.startswith("oov_")
+    )
+    text = await transcribe(
+        model, settings, wav_audio_stream(wav_path, SileroVoiceActivityDetector())
+    )
+    assert text == wav_path.stem
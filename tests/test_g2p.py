@@ -1,8 +1,17 @@
 """Tests for grapheme-to-phoneme (g2p) methods."""
 
+import sqlite3
+import tempfile
+from pathlib import Path
+
 from unicode_rbnf import RbnfEngine
 
-from speech_to_phrase.g2p import LexiconDatabase, split_words
+from speech_to_phrase.g2p import (
+    GuessCache,
+    LexiconDatabase,
+    parse_phonetisaurus_output,
+    split_words,
+)
 
 
 def test_split_words() -> None:
@@ -34,3 +43,89 @@ def test_decimal_numbers() -> None:
         ("virgule", None),
         ("cinq", None),
     ]
+
+
+def test_lookup_many() -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = Path(temp_dir) / "lexicon.db"
+        with sqlite3.connect(db_path) as conn:
+            conn.execute(
+                "CREATE TABLE word_phonemes (word TEXT, phonemes TEXT, pron_order INTEGER)"
+            )
+            conn.executemany(
+                "INSERT INTO word_phonemes VALUES (?, ?, ?)",
+                [
+                    ("hello", "h E l o", 1),
+                    ("hello", "h @ l o", 0),
+                    ("world", "w 3 l d", 0),
+                    ("NASA", "n a s @", 0),
+                ],
+            )
+
+        lexicon = LexiconDatabase(db_path)
+        lexicon.add("cached", [["k a S t"]])
+        assert list(
+            lexicon.lookup_many(["Hello", "world", "nasa", "cached", "missing"])
+        ) == [
+            ("Hello", [["h", "@", "l", "o"], ["h", "E", "l", "o"]]),
+            ("world", [["w", "3", "l", "d"]]),
+            ("nasa", [["n", "a", "s", "@"]]),
+            ("cached", [["k a S t"]]),
+            ("missing", []),
+        ]
+
+        # Results are cached
+        assert lexicon.lookup("Hello") == [["h", "@", "l", "o"], ["h", "E", "l", "o"]]
+        assert lexicon.lookup("missing") == []
+
+
+def test_exists_word_index() -> None:
+    words = ["a", "NASA", "hello", "zoo", "Ölkanne", "éclair", "日本"]
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = Path(temp_dir) / "lexicon.db"
+        with sqlite3.connect(db_path) as conn:
+            conn.execute(
+                "CREATE TABLE word_phonemes (word TEXT, phonemes TEXT, pron_order INTEGER)"
+            )
+            conn.executemany(
+                "INSERT INTO word_phonemes VALUES (?, ?, 0)",
+                [(word, "x") for word in words],
+            )
+
+        lexicon = LexiconDatabase(db_path)
+        for word in words:
+            assert lexicon.exists(word)
+
+        # Casing variations
+        assert lexicon.exists("Hello")
+        assert lexicon.exists("nasa")
+        assert lexicon.exists("ÉCLAIR")
+
+        for word in ("", "b", "hell", "helloo", "zzz", "0", "ölkanne"):
+            assert not lexicon.exists(word)
+
+        # Index is shared with other instances
+        index_path = db_path.with_suffix(".words")
+        assert index_path.is_file()
+        index_mtime_ns = index_path.stat().st_mtime_ns
+        assert LexiconDatabase(db_path).exists("zoo")
+        assert index_path.stat().st_mtime_ns == index_mtime_ns
+
+
+def test_guess_cache() -> None:
+    assert list(
+        parse_phonetisaurus_output(["abc\t12.5\ta b k", "xyz\t0", "", "bad"])
+    ) == [("abc", "a b k"), ("xyz", None)]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache_path = Path(temp_dir) / "g2p_guesses.json"
+        guess_cache = GuessCache(cache_path, "hash1")
+        guess_cache.add("abc", "a b k")
+        guess_cache.add("xyz", None)
+        guess_cache.save()
+
+        # Reloaded with same g2p model
+        assert GuessCache(cache_path, "hash1").guesses == {"abc": "a b k", "xyz": None}
+
+        # Different g2p model
+        assert not GuessCache(cache_path, "hash2").guesses
@@ -0,0 +1,42 @@
+"""Tests for content hashing."""
+
+import os
+import tempfile
+from pathlib import Path
+
+from speech_to_phrase.hashing import FileHashCache, hash_file
+
+
+def test_full_content_hashed() -> None:
+    """Test that changes past the first chunk of a file change its hash."""
+    with tempfile.TemporaryDirectory() as temp_dir_str:
+        temp_dir = Path(temp_dir_str)
+        file_path = temp_dir / "sentences.yaml"
+        file_path.write_text("a" * 10000 + "b")
+        hash_b = FileHashCache().hash_file(file_path)
+
+        file_path.write_text("a" * 10000 + "c")
+        assert FileHashCache().hash_file(file_path) != hash_b
+
+
+def test_cache_uses_stat() -> None:
+    """Test that unchanged files are not re-read."""
+    with tempfile.TemporaryDirectory() as temp_dir_str:
+        temp_dir = Path(temp_dir_str)
+        cache_path = temp_dir / "file_hashes.json"
+        file_path = temp_dir / "sentences.yaml"
+        file_path.write_text("abc")
+
+        file_hashes = FileHashCache(cache_path)
+        abc_hash = file_hashes.hash_file(file_path)
+        file_hashes.save()
+
+        # Same size and modification time, so the cached hash is used
+        file_stat = os.stat(file_path)
+        file_path.write_text("xyz")
+        os.utime(file_path, ns=(file_stat.st_atime_ns, file_stat.st_mtime_ns))
+        assert FileHashCache(cache_path).hash_file(file_path) == abc_hash
+
+        # Modification time changed
+        os.utime(file_path, ns=(file_stat.st_atime_ns, file_stat.st_mtime_ns + 1))
+        assert FileHashCache(cache_path).hash_file(file_path) == hash_file(file_path)
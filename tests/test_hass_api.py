@@ -5,7 +5,15 @@ from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 
-from speech_to_phrase.hass_api import Entity, Things, get_hass_info
+from speech_to_phrase.hass_api import (
+    CHANGE_EVENT_TYPES,
+    Area,
+    Entity,
+    Floor,
+    Things,
+    get_hass_info,
+    watch_hass_changes,
+)
 
 
 class MockWebsocket:
@@ -50,7 +58,7 @@ class MockWebsocket:
         self.responses = self.responses[1:]
         self._next_msg = None
 
-        response_data["success"] = True
+        response_data.setdefault("success", True)
         return response_data
 
     async def send_json(self, msg):
@@ -726,3 +734,95 @@ async def test_automation_script_answers() -> None:
     with patch("aiohttp.ClientSession", return_value=_make_session(mock_websocket)):
         ha_info = await get_hass_info("<token>", "<url>")
         assert set(ha_info.things.extra_sentences) == {"answer 1", "answer 2"}
+
+
+def test_component_hashes() -> None:
+    """Test that each kind of thing is hashed separately."""
+    things = Things(
+        entities=[Entity(names=["Lamp"], domain="light")],
+        areas=[Area(names=["Kitchen"])],
+        floors=[Floor(names=["Upstairs"])],
+    )
+    hashes = things.get_component_hashes()
+
+    # Changing an area only changes the area hash
+    things_new_area = Things(
+        entities=things.entities, areas=[Area(names=["Office"])], floors=things.floors
+    )
+    new_hashes = things_new_area.get_component_hashes()
+    assert new_hashes["areas"] != hashes["areas"]
+    assert new_hashes["entities"] == hashes["entities"]
+    assert new_hashes["floors"] == hashes["floors"]
+    assert things_new_area.get_hash() != things.get_hash()
+
+
+@pytest.mark.asyncio
+async def test_watch_hass_changes() -> None:
+    """Test subscribing to events that change the things to train."""
+    mock_websocket = MockWebsocket(
+        [
+            (None, {"type": "auth_required"}),
+            ("auth", {"type": "auth_ok"}),
+            *(
+                (
+                    "subscribe_events",
+                    {"id": msg_id, "type": "result"},
+                    {"event_type": event_type},
+                )
+                for msg_id, event_type in enumerate(sorted(CHANGE_EVENT_TYPES), start=1)
+            ),
+            (
+                None,
+                {"type": "event", "event": {"event_type": "area_registry_updated"}},
+            ),
+        ]
+    )
+
+    with patch("aiohttp.ClientSession", return_value=_make_session(mock_websocket)):
+        async for event_type in watch_hass_changes("<token>", "<url>"):
+            assert event_type == "area_registry_updated"
+            break
+
+
+@pytest.mark.asyncio
+async def test_watch_hass_changes_event_before_result(
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    """Test events that arrive before a subscription result, and failed results."""
+    event_types = sorted(CHANGE_EVENT_TYPES)
+    mock_websocket = MockWebsocket(
+        [
+            (None, {"type": "auth_required"}),
+            ("auth", {"type": "auth_ok"}),
+            (
+                "subscribe_events",
+                {"id": 1, "type": "result", "success": False, "error": "denied"},
+                {"event_type": event_types[0]},
+            ),
+            ("subscribe_events", {"id": 2, "type": "result"}),
+            (
+                "subscribe_events",
+                {"type": "event", "event": {"event_type": event_types[1]}},
+                {"event_type": event_types[2]},
+            ),
+            (None, {"id": 3, "type": "result"}),
+            *(
+                ("subscribe_events", {"id": msg_id, "type": "result"})
+                for msg_id in range(4, len(event_types) + 1)
+            ),
+            (
+                None,
+                {"type": "event", "event": {"event_type": "area_registry_updated"}},
+            ),
+        ]
+    )
+
+    received_event_types: List[str] = []
+    with patch("aiohttp.ClientSession", return_value=_make_session(mock_websocket)):
+        async for event_type in watch_hass_changes("<token>", "<url>"):
+            received_event_types.append(event_type)
+            if len(received_event_types) == 2:
+                break
+
+    assert received_event_types == [event_types[1], "area_registry_updated"]
+    assert f"Failed to subscribe to {event_types[0]} events" in caplog.text
@@ -1,4 +1,5 @@
 import io
+import math
 import re
 import shlex
 import tempfile
@@ -9,7 +10,14 @@ from hassil import Intents
 
 from speech_to_phrase.const import WordCasing
 from speech_to_phrase.g2p import LexiconDatabase
-from speech_to_phrase.hassil_fst import SPACE, G2PInfo, intents_to_fst
+from speech_to_phrase.hassil_fst import (
+    SPACE,
+    ClassLists,
+    Fst,
+    G2PInfo,
+    class_lists_to_fsts,
+    intents_to_fst,
+)
 
 from . import SETTINGS
 
@@ -240,6 +248,104 @@ def test_prune() -> None:
     # Branch is pruned
     fst.prune()
     assert not fst.to_tokens(only_connected=False)
+    assert not fst.words
+
+
+def test_prune_dead_chain() -> None:
+    fst = Fst()
+    s1 = fst.next_edge(fst.start, "a")
+    s2 = fst.next_edge(s1, "b")
+    fst.accept(s2)
+
+    # Long branch that never reaches a final state
+    dead_state = fst.next_edge(s1, "dead")
+    for _ in range(100):
+        dead_state = fst.next_edge(dead_state, "dead")
+
+    fst.prune()
+    assert fst.states == {fst.start, s1, s2}
+    assert fst.final_states == {s2}
+    assert fst.words == {"a", "b"}
+    assert fst.to_strings(True) == ["a b"]
+
+
+def test_compact() -> None:
+    with io.StringIO(INTENTS_YAML) as intents_file:
+        intents = Intents.from_yaml(intents_file)
+
+    fst = intents_to_fst(
+        intents, number_language="en", include_intents={"TurnOn", "SetBrightness"}
+    ).remove_spaces()
+    fst.prune()
+    compact_fst = fst.to_compact()
+
+    assert compact_fst.words == fst.words
+    assert compact_fst.output_words == fst.output_words
+    assert compact_fst.states == fst.states
+
+    with io.StringIO() as fst_file, io.StringIO() as compact_fst_file:
+        fst.write(fst_file)
+        compact_fst.write(compact_fst_file)
+        assert compact_fst_file.getvalue() == fst_file.getvalue()
+
+    num_arcs = compact_fst.num_arcs
+    with pytest.raises(ValueError):
+        compact_fst.add_edge(0, 1, "white space")
+
+    # Rejected arc isn't partially added
+    assert all(
+        len(arcs) == num_arcs
+        for arcs in (
+            compact_fst.from_states,
+            compact_fst.to_states,
+            compact_fst.in_labels,
+            compact_fst.out_labels,
+            compact_fst.log_probs,
+        )
+    )
+
+    # Cached properties are updated with new arcs
+    new_state = compact_fst.next_edge(compact_fst.start, "new_word", "new_output")
+    assert "new_word" in compact_fst.words
+    assert "new_output" in compact_fst.output_words
+    assert new_state in compact_fst.states
+
+
+def test_remove_spaces_long_sentence() -> None:
+    """Test that long sentences don't hit the recursion limit."""
+    words = [f"word{i}" for i in range(800)]
+    intents_yaml = f"""
+language: en
+intents:
+  Long:
+    data:
+      - sentences:
+          - "{' '.join(words)}"
+"""
+    with io.StringIO(intents_yaml) as intents_file:
+        intents = Intents.from_yaml(intents_file)
+
+    fst = intents_to_fst(intents).remove_spaces()
+    assert fst.to_strings(True) == [" ".join(words)]
+
+
+def test_remove_spaces_adjacent_optionals() -> None:
+    """Test that paths joining inside a word are only walked once."""
+    intents_yaml = f"""
+language: en
+intents:
+  Plural:
+    data:
+      - sentences:
+          - "turn on light{'[s]' * 20}"
+"""
+    with io.StringIO(intents_yaml) as intents_file:
+        intents = Intents.from_yaml(intents_file)
+
+    fst = intents_to_fst(intents).remove_spaces()
+    assert sorted(fst.to_strings(True)) == sorted(
+        f"turn on light{'s' * num_s}" for num_s in range(21)
+    )
 
 
 def test_g2p() -> None:
@@ -327,6 +433,47 @@ def test_permutations() -> None:
     }
 
 
+def test_class_lists() -> None:
+    with io.StringIO(INTENTS_YAML) as intents_file:
+        intents = Intents.from_yaml(intents_file)
+
+    class_lists = ClassLists(list_names={"name", "name_with_features"})
+    template_fst = intents_to_fst(
+        intents,
+        include_intents={"TurnOn", "PauseMediaWithFeatures", "NextMediaWithFeatures"},
+        class_lists=class_lists,
+    ).remove_spaces()
+
+    # Same context-filtered values share a label
+    assert set(template_fst.to_strings(True)) == {
+        "turn on __class:name:0",
+        "turn on the __class:name:0",
+        "pause __class:name_with_features:1",
+        "next track on __class:name_with_features:1",
+    }
+
+    class_fsts = class_lists_to_fsts(class_lists, intents)
+    assert set(class_fsts["__class:name:0"].to_strings(True)) == {"tv", "light"}
+
+    # Values are weighted uniformly with log probabilities, like intents
+    name_fst = class_fsts["__class:name:0"]
+    assert [arc.log_prob for arc in name_fst.arcs[name_fst.start]] == [
+        pytest.approx(math.log(1 / 2))
+    ]
+    assert set(class_fsts["__class:name_with_features:1"].to_strings(True)) == {
+        "Smart Speaker"
+    }
+
+    # Replacing the nonterminals gives back the full grammar
+    full_fst = template_fst.replace_labels(class_fsts)
+    expected_fst = intents_to_fst(
+        intents,
+        include_intents={"TurnOn", "PauseMediaWithFeatures", "NextMediaWithFeatures"},
+    ).remove_spaces()
+    assert set(full_fst.to_strings(True)) == set(expected_fst.to_strings(True))
+    assert full_fst.words == expected_fst.words
+
+
 @pytest.mark.asyncio
 async def test_list_value_probabilities() -> None:
     """Test that normalizing intent level probabilities boost the probabilities
@@ -447,3 +594,38 @@ lists:
         # they will still not be identical because order=3.
         perplexity_ratio = time_perplexity / color_perplexity
         assert perplexity_ratio < 1.5, perplexity_ratio
+
+
+def test_shared_list_with_local_rules() -> None:
+    """Test that list values with <rule> use each intent's own rule."""
+    intents_yaml = """
+language: en
+intents:
+  First:
+    data:
+      - sentences:
+          - "first {thing}"
+        expansion_rules:
+          color: "red"
+  Second:
+    data:
+      - sentences:
+          - "second {thing}"
+        expansion_rules:
+          color: "blue"
+lists:
+  thing:
+    values:
+      - "<color> ball"
+      - "box"
+"""
+    with io.StringIO(intents_yaml) as intents_file:
+        intents = Intents.from_yaml(intents_file)
+
+    fst = intents_to_fst(intents).remove_spaces()
+    assert set(fst.to_strings(True)) == {
+        "first red ball",
+        "first box",
+        "second blue ball",
+        "second box",
+    }
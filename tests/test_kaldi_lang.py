@@ -0,0 +1,132 @@
+"""Tests for the Python version of prepare_lang.sh."""
+
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from speech_to_phrase.kaldi_lang import (
+    add_lexicon_disambig,
+    get_word_order,
+    prepare_lang,
+    validate_lang,
+)
+
+
+def test_add_lexicon_disambig() -> None:
+    lexicon_disambig, max_disambig = add_lexicon_disambig(
+        [
+            ("cat", ["k_B", "a_I", "t_E"]),
+            ("kat", ["k_B", "a_I", "t_E"]),
+            ("ka", ["k_B", "a_I"]),  # prefix
+            ("b", ["b_S"]),
+        ]
+    )
+    assert max_disambig == 2
+    assert lexicon_disambig == [
+        ("cat", ["k_B", "a_I", "t_E", "#1"]),
+        ("kat", ["k_B", "a_I", "t_E", "#2"]),
+        ("ka", ["k_B", "a_I", "#1"]),
+        ("b", ["b_S"]),
+    ]
+
+
+def test_get_word_order() -> None:
+    assert get_word_order(["b", "a"], []) == ["<eps>", "a", "b", "#0", "<s>", "</s>"]
+
+    # New words are appended and removed words keep their ids
+    previous_words = ["<eps>", "a", "c", "#0", "<s>", "</s>"]
+    assert get_word_order(["d", "b", "a"], previous_words) == previous_words + [
+        "b",
+        "d",
+    ]
+
+    # Renumbered when most ids are for removed words
+    assert get_word_order(["b"], previous_words) == ["<eps>", "b", "#0", "<s>", "</s>"]
+
+
+def test_prepare_lang() -> None:
+    with tempfile.TemporaryDirectory() as temp_dir_str:
+        temp_dir = Path(temp_dir_str)
+        dict_dir = temp_dir / "dict"
+        dict_dir.mkdir()
+        (dict_dir / "silence_phones.txt").write_text("SIL\nSPN\n")
+        (dict_dir / "nonsilence_phones.txt").write_text("a\nk\nt\n")
+        (dict_dir / "optional_silence.txt").write_text("SIL\n")
+        (dict_dir / "lexicon.txt").write_text("cat k a t\nkat k a t\na a\n<unk> SPN\n")
+
+        lang_dir = temp_dir / "lang"
+        prepare_lang(dict_dir, lang_dir)
+
+        assert (lang_dir / "words.txt").read_text().splitlines() == [
+            "<eps> 0",
+            "<unk> 1",
+            "a 2",
+            "cat 3",
+            "kat 4",
+            "#0 5",
+            "<s> 6",
+            "</s> 7",
+        ]
+
+        phones = (lang_dir / "phones.txt").read_text().splitlines()
+        assert phones[:3] == ["<eps> 0", "SIL 1", "SIL_B 2"]
+
+        # cat/kat need #1 and #2, silence uses #3
+        assert phones[-4:] == ["#0 23", "#1 24", "#2 25", "#3 26"]
+        assert (lang_dir / "phones" / "disambig.csl").read_text() == "23:24:25:26\n"
+        assert (lang_dir / "phones" / "align_lexicon.txt").read_text().splitlines() == [
+            "<eps> <eps> SIL",
+            "<unk> <unk> SPN_S",
+            "a a a_S",
+            "cat cat k_B a_I t_E",
+            "kat kat k_B a_I t_E",
+        ]
+        assert (lang_dir / "oov.int").read_text() == "1\n"
+
+        for fst_name in ("L.fst", "L_disambig.fst"):
+            assert (lang_dir / fst_name).stat().st_size > 0
+
+        # Unchanged files are not rewritten
+        mtimes = {p: p.stat().st_mtime_ns for p in lang_dir.rglob("*") if p.is_file()}
+        prepare_lang(dict_dir, lang_dir)
+        assert mtimes == {
+            p: p.stat().st_mtime_ns for p in lang_dir.rglob("*") if p.is_file()
+        }
+
+        # Symbol tables and phone lists must agree
+        validate_lang(lang_dir)
+
+        words_path = lang_dir / "words.txt"
+        words_path.write_text(words_path.read_text().replace("<s> 6", "<s> 8"))
+        with pytest.raises(ValueError):
+            validate_lang(lang_dir)
+
+        prepare_lang(dict_dir, lang_dir)
+        disambig_path = lang_dir / "phones" / "disambig.int"
+        disambig_path.write_text(disambig_path.read_text().replace("26", "22"))
+        with pytest.raises(ValueError):
+            validate_lang(lang_dir)
+
+
+def test_prepare_lang_add_word() -> None:
+    with tempfile.TemporaryDirectory() as temp_dir_str:
+        temp_dir = Path(temp_dir_str)
+        dict_dir = temp_dir / "dict"
+        dict_dir.mkdir()
+        (dict_dir / "silence_phones.txt").write_text("SIL\nSPN\n")
+        (dict_dir / "nonsilence_phones.txt").write_text("a\nk\nt\n")
+        (dict_dir / "optional_silence.txt").write_text("SIL\n")
+        (dict_dir / "lexicon.txt").write_text("cat k a t\na a\n<unk> SPN\n")
+
+        lang_dir = temp_dir / "lang"
+        prepare_lang(dict_dir, lang_dir)
+        words = (lang_dir / "words.txt").read_text().splitlines()
+        lexicon_fst = (lang_dir / "L.fst").read_bytes()
+
+        # Existing ids don't change
+        (dict_dir / "lexicon.txt").write_text("at a t\ncat k a t\na a\n<unk> SPN\n")
+        prepare_lang(dict_dir, lang_dir)
+        assert (lang_dir / "words.txt").read_text().splitlines() == words + ["at 7"]
+        assert (lang_dir / "L.fst").read_bytes() != lexicon_fst
+        validate_lang(lang_dir)
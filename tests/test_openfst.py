@@ -0,0 +1,111 @@
+"""Tests for binary OpenFST serialization."""
+
+import io
+import math
+import struct
+from typing import List, Tuple
+
+from speech_to_phrase.hassil_fst import Fst
+from speech_to_phrase.openfst import SymbolTable
+
+
+def _read_string(data: bytes, offset: int) -> Tuple[str, int]:
+    (length,) = struct.unpack_from("<i", data, offset)
+    offset += 4
+    return data[offset : offset + length].decode("utf-8"), offset + length
+
+
+def test_write_binary() -> None:
+    fst = Fst()
+    state = fst.next_edge(fst.start, "hello", log_prob=0.5)
+    state = fst.next_edge(state, "world", "__output:World")
+    fst.accept(state)
+
+    symbols = SymbolTable(
+        name="words.txt", ids={"<eps>": 0, "hello": 1, "world": 2, "__output:World": 3}
+    )
+    with io.BytesIO() as fst_file:
+        fst.write_binary(fst_file, symbols, keep_symbols=True)
+        data = fst_file.getvalue()
+
+    (magic,) = struct.unpack_from("<i", data, 0)
+    assert magic == 2125659606
+
+    fst_type, offset = _read_string(data, 4)
+    arc_type, offset = _read_string(data, offset)
+    assert (fst_type, arc_type) == ("vector", "standard")
+
+    _version, flags, _properties, start, num_states, num_arcs = struct.unpack_from(
+        "<iiQqqq", data, offset
+    )
+    offset += 40
+    assert flags == 0x3  # input/output symbols
+    assert (start, num_states, num_arcs) == (0, 3, 2)
+
+    # Input and output symbol tables
+    for _ in range(2):
+        offset += 4  # magic
+        name, offset = _read_string(data, offset)
+        assert name == "words.txt"
+        _available_key, num_symbols = struct.unpack_from("<qq", data, offset)
+        offset += 16
+        table = {}
+        for _ in range(num_symbols):
+            symbol, offset = _read_string(data, offset)
+            (table[symbol],) = struct.unpack_from("<q", data, offset)
+            offset += 8
+
+        assert table == symbols.ids
+
+    # States
+    arcs: List[Tuple[int, int, int, float, int]] = []
+    final_states = set()
+    for state in range(num_states):
+        final_weight, state_num_arcs = struct.unpack_from("<fq", data, offset)
+        offset += 12
+        if not math.isinf(final_weight):
+            final_states.add(state)
+
+        for _ in range(state_num_arcs):
+            arcs.append((state, *struct.unpack_from("<iifi", data, offset)))
+            offset += 16
+
+    assert offset == len(data)
+    assert final_states == {2}
+    assert arcs == [(0, 1, 1, 0.5, 1), (1, 2, 3, 0.0, 2)]
+
+
+def test_symbol_table_subset() -> None:
+    symbols = SymbolTable(
+        name="words.txt", ids={"<eps>": 0, "hello": 1, "world": 2, "new": 3}
+    )
+    subset = symbols.subset({"<eps>", "world"})
+    assert subset.name == "words.txt"
+    assert subset.ids == {"<eps>": 0, "world": 2}
+
+    # Template written with a subset doesn't change when words are appended
+    fst = Fst()
+    fst.accept(fst.next_edge(fst.start, "world"))
+    symbols.ids["newer"] = 4
+    with io.BytesIO() as fst_file, io.BytesIO() as fst_file_2:
+        fst.write_binary(fst_file, subset, keep_symbols=True)
+        fst.write_binary(
+            fst_file_2, symbols.subset({"<eps>", "world"}), keep_symbols=True
+        )
+        assert fst_file.getvalue() == fst_file_2.getvalue()
+
+
+def test_write_binary_empty() -> None:
+    fst = Fst()
+    symbols = SymbolTable(name="words.txt", ids={"<eps>": 0})
+    with io.BytesIO() as fst_file:
+        fst.write_binary(fst_file, symbols)
+        data = fst_file.getvalue()
+
+    _fst_type, offset = _read_string(data, 4)
+    _arc_type, offset = _read_string(data, offset)
+    _version, _flags, _properties, start, num_states, num_arcs = struct.unpack_from(
+        "<iiQqqq", data, offset
+    )
+    assert (start, num_states, num_arcs) == (0, 1, 0)
+    assert len(data) == offset + 40 + 12  # one state without arcs
@@ -0,0 +1,97 @@
+"""Tests for debounced, cancellable retraining."""
+
+import asyncio
+import tempfile
+from pathlib import Path
+from typing import List
+from unittest.mock import patch
+
+import pytest
+
+from speech_to_phrase.const import Settings, State
+from speech_to_phrase.hass_api import Entity, HomeAssistantInfo, Things
+from speech_to_phrase.retrain import RetrainCoordinator
+
+
+@pytest.mark.asyncio
+async def test_debounce_and_cancel_stale() -> None:
+    """Test that bursts of changes lead to one training with the newest inputs."""
+    hass_info = HomeAssistantInfo(
+        system_language="en",
+        things=Things(entities=[Entity(names=["lamp"], domain="light")]),
+    )
+    started: List[str] = []
+    cancelled: List[str] = []
+    finished: List[str] = []
+    release = asyncio.Event()
+
+    async def get_hass_info(**_kwargs) -> HomeAssistantInfo:
+        return hass_info
+
+    async def train(_model, _settings, things: Things, **_kwargs) -> None:
+        name = things.entities[0].names[0]
+        started.append(name)
+        try:
+            await release.wait()
+        except asyncio.CancelledError:
+            cancelled.append(name)
+            raise
+
+        finished.append(name)
+
+    with tempfile.TemporaryDirectory() as temp_dir_str:
+        temp_dir = Path(temp_dir_str)
+        state = State(
+            settings=Settings(
+                models_dir=temp_dir / "models",
+                train_dir=temp_dir / "train",
+                tools_dir=temp_dir / "tools",
+                custom_sentences_dirs=[],
+                hass_token="",
+                hass_websocket_uri="",
+                retrain_on_connect=False,
+            )
+        )
+        coordinator = RetrainCoordinator(state, debounce_seconds=0.01)
+
+        with patch("speech_to_phrase.retrain.get_hass_info", get_hass_info), patch(
+            "speech_to_phrase.retrain.train", train
+        ):
+            # Training that started before the first retrain isn't cancelled
+            client_release = asyncio.Event()
+
+            async def client_train() -> None:
+                await client_release.wait()
+
+            client_training = state.train_scheduler.schedule("client", client_train)
+            await asyncio.sleep(0)
+
+            # Burst of changes
+            for _ in range(3):
+                coordinator.request_retrain("test")
+
+            await asyncio.sleep(0.1)
+            assert not client_training.done()
+
+            client_release.set()
+            await asyncio.sleep(0.1)
+            assert not client_training.cancelled()
+            assert started == ["lamp"]
+
+            # Same inputs don't restart training
+            await coordinator.retrain()
+            assert started == ["lamp"]
+
+            # New inputs cancel stale training
+            hass_info = HomeAssistantInfo(
+                system_language="en",
+                things=Things(entities=[Entity(names=["fan"], domain="fan")]),
+            )
+            coordinator.request_retrain("test")
+            await asyncio.sleep(0.1)
+            assert started == ["lamp", "fan"]
+            assert cancelled == ["lamp"]
+
+            release.set()
+            await asyncio.sleep(0.01)
+            assert finished == ["fan"]
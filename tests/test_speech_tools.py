@@ -0,0 +1,65 @@
+"""Tests for running speech tools as subprocesses."""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pytest
+
+from speech_to_phrase.speech_tools import SpeechTools, collect_process_usage
+
+_PRINT_PGID = "import os; print(os.getpgrp())"
+
+
+@pytest.mark.asyncio
+async def test_process_groups() -> None:
+    """Test that only training subprocesses get their own process group."""
+    with tempfile.TemporaryDirectory() as temp_dir_str:
+        tools = SpeechTools.from_tools_dir(Path(temp_dir_str) / "tools")
+        train_tools = tools.for_training(niceness=0)
+
+        output = await tools.async_run(sys.executable, ["-c", _PRINT_PGID])
+        assert int(output) == os.getpgrp()
+
+        async def check_train_tools() -> None:
+            output = await train_tools.async_run(sys.executable, ["-c", _PRINT_PGID])
+            assert int(output) != os.getpgrp()
+
+            # Whole pipeline is killed when training is cancelled
+            start_time = time.monotonic()
+            pipeline_task = asyncio.create_task(
+                train_tools.async_run_shell("sleep 60 | cat")
+            )
+            await asyncio.sleep(0.5)
+            pipeline_task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await pipeline_task
+
+            assert time.monotonic() - start_time < 30
+
+        await check_train_tools()
+
+        # Subprocesses are reaped differently when usage is collected
+        with collect_process_usage():
+            await check_train_tools()
+
+
+@pytest.mark.asyncio
+async def test_usage_with_input() -> None:
+    """Test that input and output pass through when usage is collected."""
+    with tempfile.TemporaryDirectory() as temp_dir_str:
+        tools = SpeechTools.from_tools_dir(Path(temp_dir_str) / "tools")
+        with collect_process_usage() as usages:
+            output = await tools.async_run_pipeline(
+                ["cat"], ["tr", "a", "b"], input=b"a" * 1_000_000
+            )
+            assert output == b"b" * 1_000_000
+
+            with pytest.raises(RuntimeError):
+                await tools.async_run("false", [])
+
+        assert len(usages) == 2
+        assert all(usage.max_rss_kb > 0 for usage in usages)
@@ -0,0 +1,94 @@
+"""Tests for grammar compilation during training."""
+
+import io
+import logging
+import tempfile
+from pathlib import Path
+
+import pytest
+from hassil import Intents
+
+from speech_to_phrase.const import Language, Settings
+from speech_to_phrase.g2p import LexiconDatabase
+from speech_to_phrase.hass_api import Entity, Things
+from speech_to_phrase.models import MODELS
+from speech_to_phrase.train import (
+    _create_class_grammar,
+    _create_intents_fst,
+    compile_grammar,
+)
+from speech_to_phrase.worker_pool import WorkerPool
+
+
+@pytest.mark.asyncio
+async def test_compile_grammar_in_process(caplog: pytest.LogCaptureFixture) -> None:
+    """Test that the worker process returns the same grammar as in-process."""
+    model = MODELS[Language.GREEK.value]
+    things = Things(entities=[Entity(names=["φως κουζίνας"], domain="light")])
+
+    with tempfile.TemporaryDirectory() as temp_dir_str:
+        temp_dir = Path(temp_dir_str)
+        settings = Settings(
+            models_dir=temp_dir / "models",
+            train_dir=temp_dir / "train",
+            tools_dir=temp_dir / "tools",
+            custom_sentences_dirs=[],
+            hass_token="",
+            hass_websocket_uri="",
+            retrain_on_connect=False,
+        )
+        settings.model_train_dir(model.id).mkdir(parents=True)
+
+        expected = compile_grammar(model, settings, things)
+        worker_pool = WorkerPool()
+        try:
+            with caplog.at_level(logging.DEBUG):
+                actual = await worker_pool.run(compile_grammar, model, settings, things)
+        finally:
+            worker_pool.shutdown()
+
+    assert actual.class_grammar is None
+    assert actual.fst.symbols == expected.fst.symbols
+    assert actual.fst.in_labels == expected.fst.in_labels
+    assert actual.fst.out_labels == expected.fst.out_labels
+    assert actual.fst.final_states == expected.fst.final_states
+    assert "φως" in actual.fst.words
+
+    # Log records are forwarded from the worker
+    assert any(
+        record.message.startswith("Wrote debug YAML") for record in caplog.records
+    )
+
+
+def test_class_grammar() -> None:
+    """Test that the full grammar is derived from the class grammar."""
+    model = MODELS[Language.ENGLISH.value]
+    lexicon = LexiconDatabase()
+
+    intents = _make_intents('"turn on [the] {name}"')
+    grammar = _create_class_grammar(model, lexicon, intents)
+    assert grammar is not None
+    assert grammar.class_grammar is not None
+    assert grammar.fst.words == _create_intents_fst(model, lexicon, intents).words
+
+    # Text next to a list reference can't be separated from its values
+    intents = _make_intents('"what is the {name}\'s state"')
+    assert _create_class_grammar(model, lexicon, intents) is None
+
+
+def _make_intents(sentence: str) -> Intents:
+    intents_yaml = f"""
+language: en
+intents:
+  Test:
+    data:
+      - sentences:
+          - {sentence}
+lists:
+  name:
+    values:
+      - tv
+      - light
+"""
+    with io.StringIO(intents_yaml) as intents_file:
+        return Intents.from_yaml(intents_file)
@@ -0,0 +1,35 @@
+"""Tests for Coqui STT training."""
+
+import io
+from collections import Counter
+
+from speech_to_phrase.const import EPS, SPACE
+from speech_to_phrase.train_coqui_stt import _write_char2word
+
+
+def test_char2word_prefix_trie() -> None:
+    """Test that char2word shares prefixes and is deterministic."""
+    char2idx = {c: i for i, c in enumerate("abcefot", start=1)}
+    char2idx[SPACE] = len(char2idx) + 1
+
+    with io.StringIO() as char2word_file:
+        _write_char2word(
+            [EPS, "cat", "cab", "coat", "café", "a"], char2idx, char2word_file
+        )
+        lines = char2word_file.getvalue().splitlines()
+
+    arcs = [line.split() for line in lines if len(line.split()) == 4]
+    assert lines[-1] == "0"
+
+    # c, ca, cat, cab, co, coa, coat, caf, cafe, a
+    states = {int(arc[1]) for arc in arcs} - {0}
+    assert len(states) == 10
+
+    # Words are emitted on the space after their last character
+    word_arcs = {arc[3]: arc for arc in arcs if arc[3] != EPS}
+    assert set(word_arcs) == {"a", "cab", "café", "cat", "coat"}
+    assert all((arc[1] == "0") and (arc[2] == SPACE) for arc in word_arcs.values())
+
+    # Deterministic on input
+    arc_inputs = Counter((arc[0], arc[2]) for arc in arcs)
+    assert max(arc_inputs.values()) == 1
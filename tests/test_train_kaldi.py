@@ -0,0 +1,23 @@
+"""Tests for Kaldi training helpers."""
+
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from speech_to_phrase.hassil_fst import CompactFst
+from speech_to_phrase.openfst import SymbolTable
+from speech_to_phrase.train_kaldi import _create_fuzzy_fst
+
+
+@pytest.mark.asyncio
+async def test_create_fuzzy_fst_empty() -> None:
+    """Test that an empty sentence graph still gives valid fuzzy FSTs."""
+    with tempfile.TemporaryDirectory() as temp_dir_str:
+        lang_dir = Path(temp_dir_str)
+        await _create_fuzzy_fst(
+            CompactFst(), SymbolTable(name="words.txt", ids={"<eps>": 0}), lang_dir
+        )
+
+        for fst_name in ("G.fuzzy.fst", "G.fuzzy_edit.fst"):
+            assert (lang_dir / fst_name).stat().st_size > 0
@@ -0,0 +1,80 @@
+"""Tests for training stage timings and progress."""
+
+import asyncio
+import json
+import resource
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from speech_to_phrase.speech_tools import SpeechTools
+from speech_to_phrase.train_progress import TrainingProgress
+
+# More than this process, whose peak memory subprocesses count too
+_ALLOCATE_EXTRA_MB = 100
+
+# Touch every page so it counts towards the resident set size
+_ALLOCATE_SCRIPT = """
+import sys
+memory = bytearray(int(sys.argv[1]) * 1024 * 1024)
+for i in range(0, len(memory), 4096):
+    memory[i] = 1
+"""
+
+
+@pytest.mark.asyncio
+async def test_stage_timings_and_eta() -> None:
+    """Test that stage timings are saved and used to estimate time left."""
+    with tempfile.TemporaryDirectory() as temp_dir_str:
+        temp_dir = Path(temp_dir_str)
+        tools = SpeechTools.from_tools_dir(temp_dir / "tools")
+        report_path = temp_dir / "training_report.json"
+        output_path = temp_dir / "output.txt"
+
+        progress = TrainingProgress("test", report_path)
+        assert progress.eta_seconds is None
+
+        allocate_mb = _ALLOCATE_EXTRA_MB + (
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+        )
+
+        async def allocate() -> None:
+            await tools.async_run(
+                sys.executable, ["-c", _ALLOCATE_SCRIPT, str(allocate_mb)]
+            )
+
+        with progress.stage("allocate", [output_path]):
+            await allocate()
+            output_path.write_text("abc", encoding="utf-8")
+
+        # Processes from other tasks aren't counted
+        with progress.stage("small"):
+            allocate_task = asyncio.create_task(allocate())
+            await tools.async_run_pipeline(["echo", "small"], ["cat"])
+
+        await allocate_task
+
+        with progress.stage("skip") as stage_timing:
+            stage_timing.skipped = True
+
+        progress.finish()
+
+        with open(report_path, "r", encoding="utf-8") as report_file:
+            report = json.load(report_file)
+
+        assert report["model_id"] == "test"
+        assert len(report["runs"]) == 1
+        stages = report["runs"][0]["stages"]
+        assert [stage["name"] for stage in stages] == ["allocate", "small", "skip"]
+        assert stages[0]["output_bytes"] == {"output.txt": 3}
+        assert stages[0]["cpu_seconds"] > 0
+        assert stages[0]["max_rss_mb"] >= allocate_mb
+        assert 0 < stages[1]["max_rss_mb"] < allocate_mb
+        assert stages[2]["skipped"]
+
+        # Estimate comes from the previous run
+        next_progress = TrainingProgress("test", report_path)
+        assert next_progress.expected_seconds == report["runs"][0]["total_seconds"]
+        assert next_progress.eta_seconds is not None
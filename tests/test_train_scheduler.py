@@ -0,0 +1,87 @@
+"""Tests for scheduling of training jobs."""
+
+import asyncio
+from typing import List
+
+import pytest
+
+from speech_to_phrase.train_scheduler import TrainingPriority, TrainingScheduler
+
+
+@pytest.mark.asyncio
+async def test_workers_and_priority() -> None:
+    """Test that jobs are limited to the number of workers and run by priority."""
+    scheduler = TrainingScheduler(max_workers=1)
+    started: List[str] = []
+    max_running = 0
+    release = asyncio.Event()
+
+    def make_job(model_id: str):
+        async def job() -> None:
+            nonlocal max_running
+            started.append(model_id)
+            max_running = max(max_running, scheduler.num_running)
+            await release.wait()
+
+        return job
+
+    task_a = scheduler.schedule("a", make_job("a"))
+    await asyncio.sleep(0)
+    task_b = scheduler.schedule("b", make_job("b"))
+    task_c = scheduler.schedule("c", make_job("c"))
+
+    # Already queued, but a client is now waiting for it
+    assert scheduler.schedule("c", make_job("c2"), TrainingPriority.CLIENT) is task_c
+
+    release.set()
+    await asyncio.gather(task_a, task_b, task_c)
+
+    assert started == ["a", "c", "b"]
+    assert max_running == 1
+
+
+@pytest.mark.asyncio
+async def test_cancel_running_job() -> None:
+    """Test that cancelling a running job lets the next one run."""
+    scheduler = TrainingScheduler(max_workers=1)
+    started: List[str] = []
+    release = asyncio.Event()
+
+    async def job_a() -> None:
+        started.append("a")
+        await release.wait()
+
+    async def job_b() -> None:
+        started.append("b")
+
+    task_a = scheduler.schedule("a", job_a)
+    task_b = scheduler.schedule("b", job_b)
+    await asyncio.sleep(0)
+
+    task_a.cancel()
+    await task_b
+    assert started == ["a", "b"]
+
+    # Model can be scheduled again
+    release.set()
+    await scheduler.schedule("a", job_a)
+    assert started == ["a", "b", "a"]
+
+
+@pytest.mark.asyncio
+async def test_defer_while_decoding() -> None:
+    """Test that background jobs wait for decoding to finish."""
+    scheduler = TrainingScheduler(max_defer_seconds=10)
+    started: List[str] = []
+
+    async def job() -> None:
+        started.append("background")
+
+    scheduler.start_decoding()
+    task = scheduler.schedule("a", job)
+    await asyncio.sleep(0.01)
+    assert not started
+
+    scheduler.stop_decoding()
+    await task
+    assert started == ["background"]
@@ -0,0 +1,137 @@
+"""Tests for memoized training stages."""
+
+import asyncio
+import tempfile
+from pathlib import Path
+from typing import List
+
+import pytest
+
+from speech_to_phrase.train_stages import Stage, StageManifest, hash_inputs
+
+
+@pytest.mark.asyncio
+async def test_stage_skipped_when_unchanged() -> None:
+    """Test that a stage only runs again when its inputs or outputs change."""
+    with tempfile.TemporaryDirectory() as temp_dir_str:
+        temp_dir = Path(temp_dir_str)
+        manifest_path = temp_dir / "stages.json"
+        input_path = temp_dir / "input.txt"
+        output_path = temp_dir / "output.txt"
+        runs: List[str] = []
+
+        async def copy_stage() -> None:
+            runs.append(input_path.read_text())
+            output_path.write_text(input_path.read_text().upper())
+
+        input_path.write_text("a")
+        manifest = StageManifest(manifest_path)
+        assert await manifest.run_stage(
+            "copy", hash_inputs(input_path), [output_path], copy_stage
+        )
+
+        # Unchanged (reloaded from disk)
+        manifest = StageManifest(manifest_path)
+        assert not await manifest.run_stage(
+            "copy", hash_inputs(input_path), [output_path], copy_stage
+        )
+
+        # Changed input
+        input_path.write_text("b")
+        assert await manifest.run_stage(
+            "copy", hash_inputs(input_path), [output_path], copy_stage
+        )
+
+        # Changed output
+        output_path.write_text("tampered")
+        assert await manifest.run_stage(
+            "copy", hash_inputs(input_path), [output_path], copy_stage
+        )
+
+        # New output added to stage
+        extra_output_path = temp_dir / "extra.txt"
+        extra_output_path.write_text("extra")
+        assert await manifest.run_stage(
+            "copy",
+            hash_inputs(input_path),
+            [output_path, extra_output_path],
+            copy_stage,
+        )
+
+        assert runs == ["a", "b", "b", "b"]
+
+
+@pytest.mark.asyncio
+async def test_interrupted_stage_reruns() -> None:
+    """Test that a failed stage is not recorded as complete."""
+    with tempfile.TemporaryDirectory() as temp_dir_str:
+        temp_dir = Path(temp_dir_str)
+        manifest_path = temp_dir / "stages.json"
+        output_path = temp_dir / "output.txt"
+
+        async def good_stage() -> None:
+            output_path.write_text("done")
+
+        async def bad_stage() -> None:
+            raise RuntimeError("interrupted")
+
+        manifest = StageManifest(manifest_path)
+        assert await manifest.run_stage("first", "1", [output_path], good_stage)
+
+        with pytest.raises(RuntimeError):
+            await manifest.run_stage("second", "1", [], bad_stage)
+
+        # Resume from last completed stage
+        manifest = StageManifest(manifest_path)
+        assert manifest.is_complete("first", "1")
+        assert not manifest.is_complete("second", "1")
+
+
+@pytest.mark.asyncio
+async def test_run_graph() -> None:
+    """Test that independent stages run concurrently and dependencies in order."""
+    with tempfile.TemporaryDirectory() as temp_dir_str:
+        temp_dir = Path(temp_dir_str)
+        a_path = temp_dir / "a.txt"
+        b_path = temp_dir / "b.txt"
+        c_path = temp_dir / "c.txt"
+        events: List[str] = []
+
+        def make_stage_func(name: str, output_path: Path, seconds: float):
+            async def stage_func() -> None:
+                events.append(f"start {name}")
+                await asyncio.sleep(seconds)
+                output_path.write_text(name)
+                events.append(f"end {name}")
+
+            return stage_func
+
+        stages = [
+            Stage("a", ["a"], [a_path], make_stage_func("a", a_path, 0.05)),
+            Stage("b", ["b"], [b_path], make_stage_func("b", b_path, 0.01)),
+            Stage("c", [a_path], [c_path], make_stage_func("c", c_path, 0.01)),
+        ]
+        manifest = StageManifest(temp_dir / "stages.json")
+        critical_path = await manifest.run_graph(stages, max_concurrent=2)
+
+        # a and b overlap, c waits for a
+        assert events[:2] == ["start a", "start b"]
+        assert events.index("start c") > events.index("end a")
+        assert [name for name, _seconds in critical_path] == ["a", "c"]
+
+        # Nothing runs again
+        events.clear()
+        await manifest.run_graph(stages, max_concurrent=2)
+        assert not events
+
+        # Failed stage stops the graph
+        async def bad_stage() -> None:
+            raise RuntimeError("failed")
+
+        a_path.unlink()
+        with pytest.raises(RuntimeError):
+            await manifest.run_graph(
+                [Stage("a", ["a"], [a_path], bad_stage), *stages[1:]]
+            )
+
+        assert not manifest.is_complete("c", hash_inputs(a_path))
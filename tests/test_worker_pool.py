@@ -0,0 +1,34 @@
+"""Tests for long-lived training worker processes."""
+
+import asyncio
+import os
+import time
+
+import pytest
+
+from speech_to_phrase.worker_pool import WorkerPool
+
+
+@pytest.mark.asyncio
+async def test_workers_reused_and_cancelled() -> None:
+    """Test that workers are reused and stopped when a job is cancelled."""
+    worker_pool = WorkerPool()
+    try:
+        worker_pid = await worker_pool.run(os.getpid)
+        assert worker_pid != os.getpid()
+        assert await worker_pool.run(os.getpid) == worker_pid
+
+        # Cancelling doesn't wait for the job to finish
+        start_time = time.monotonic()
+        sleep_task = asyncio.create_task(worker_pool.run(time.sleep, 60))
+        await asyncio.sleep(0.5)
+        sleep_task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await sleep_task
+
+        assert time.monotonic() - start_time < 30
+
+        # New workers are started for the next job
+        assert await worker_pool.run(os.getpid) != worker_pid
+    finally:
+        worker_pool.shutdown()